@@ -0,0 +1,55 @@
+"""Benchmark multi-channel FIR filtering in nelpy.filtering.
+
+Reports throughput in samples / second / channel for the serial
+filtfilt path, the threaded path, and the FFT (overlap-add) path.
+
+Usage:
+    python benchmarks/bench_filtering.py [n_signals] [duration_s] [fs]
+"""
+
+import sys
+import time
+import numpy as np
+
+from scipy.signal import firwin
+
+from nelpy.filtering import _fir_filtfilt, approx_number_of_taps
+
+def bench(b, data, n_repeats=3, **kwargs):
+    """Return the best wall time (in seconds) over n_repeats."""
+    best = np.inf
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        _fir_filtfilt(b, data, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main(n_signals=64, duration=10, fs=30000):
+    n_samples = int(duration*fs)
+    data = np.random.randn(n_signals, n_samples)
+
+    numtaps = approx_number_of_taps(fs=fs, delta_f=20, delta1=10e-2, delta2=10e-2)
+    numtaps += 1 - numtaps % 2 # firwin bandpass filters need an odd number of taps
+    b = firwin(numtaps=numtaps, cutoff=[150/(fs/2), 250/(fs/2)], pass_zero=False)
+
+    print("{} signals x {} samples, {} taps".format(n_signals, n_samples, numtaps))
+
+    configs = [('serial filtfilt', {}),
+               ('threaded filtfilt (n_jobs=-1)', {'n_jobs': -1}),
+               ('serial fft', {'method': 'fft'}),
+               ('threaded fft (n_jobs=-1)', {'n_jobs': -1, 'method': 'fft'}),
+               ('threaded fft, chunked', {'n_jobs': -1, 'method': 'fft', 'chunksize': fs*2})]
+
+    for name, kwargs in configs:
+        elapsed = bench(b, data, **kwargs)
+        throughput = n_samples / elapsed
+        print("{:>32s}: {:8.3f} s  {:12,.0f} samples/s/channel".format(name, elapsed, throughput))
+
+if __name__ == '__main__':
+    args = [float(arg) for arg in sys.argv[1:]]
+    kwargs = dict(zip(['n_signals', 'duration', 'fs'], args))
+    if 'n_signals' in kwargs:
+        kwargs['n_signals'] = int(kwargs['n_signals'])
+    if 'fs' in kwargs:
+        kwargs['fs'] = int(kwargs['fs'])
+    main(**kwargs)
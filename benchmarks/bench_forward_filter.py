@@ -0,0 +1,80 @@
+"""Benchmark per-bin latency of nelpy.hmmbatch.ForwardFilter.
+
+Samples a synthetic spike count stream from a random Poisson HMM, feeds
+it to the online forward filter one bin at a time, and reports the
+p50/p99/max latency of update() for filtering only and for fixed-lag
+smoothing. Filtered and smoothed distributions are checked against the
+batched forward-backward recursions in nelpy.hmmbatch.
+
+Usage:
+    python benchmarks/bench_forward_filter.py [n_states] [n_units] [lag] [n_updates]
+"""
+
+import sys
+import time
+import numpy as np
+
+from nelpy import hmmbatch
+from nelpy.hmmbatch import ForwardFilter
+
+def synthetic_hmm(n_states, n_units, n_updates, random_state=0):
+    """Return (startprob, transmat, means) and a (n_updates, n_units) count stream."""
+    rng = np.random.RandomState(random_state)
+    startprob = rng.dirichlet(np.ones(n_states))
+    transmat = rng.dirichlet(np.ones(n_states)*0.1, size=n_states) + 0.5*np.eye(n_states)
+    transmat /= transmat.sum(axis=1, keepdims=True)
+    means = rng.gamma(0.5, 0.5, size=(n_states, n_units)) + 0.01
+
+    states = np.empty(n_updates, dtype=int)
+    states[0] = rng.choice(n_states, p=startprob)
+    for tt in range(1, n_updates):
+        states[tt] = rng.choice(n_states, p=transmat[states[tt-1]])
+    counts = rng.poisson(means[states]).astype(float)
+    return (startprob, transmat, means), counts
+
+def framelogprob(means, counts):
+    return np.dot(counts, np.log(means).T) - means.sum(axis=1)
+
+def run(params, counts, lag):
+    ff = ForwardFilter(*params, lag=lag)
+    latencies = np.empty(len(counts))
+    filtered = np.empty((len(counts), len(params[0])))
+    smoothed = np.empty_like(filtered)
+    for ii, bin_counts in enumerate(counts):
+        t0 = time.perf_counter()
+        ff.update(bin_counts)
+        latencies[ii] = time.perf_counter() - t0
+        filtered[ii] = ff.filtered
+        smoothed[ii] = ff.smoothed
+    return latencies, filtered, smoothed
+
+def main(n_states=50, n_units=100, lag=5, n_updates=20000):
+    params, counts = synthetic_hmm(n_states, n_units, n_updates)
+    startprob, transmat, means = params
+    print("{} states, {} units, {} updates".format(n_states, n_units, n_updates))
+
+    for name, ll in [('filter', 0), ('fixed-lag ({})'.format(lag), lag)]:
+        latencies, filtered, smoothed = run(params, counts, ll)
+        p50, p99 = np.percentile(latencies, [50, 99])*1e6
+        print("{:>16s}: p50 {:8.1f} us  p99 {:8.1f} us  max {:8.1f} us".format(
+            name, p50, p99, latencies.max()*1e6))
+
+    # check against the batched recursions on a prefix of the stream
+    n_check = 500
+    padded, mask = hmmbatch.pad_sequences(framelogprob(means, counts[:n_check]), [n_check])
+    _, fwdlattice = hmmbatch.forward(np.log(startprob), np.log(transmat), padded, mask)
+    expected = np.exp(fwdlattice[0] - fwdlattice[0].max(axis=1, keepdims=True))
+    expected /= expected.sum(axis=1, keepdims=True)
+    print("filtered matches forward pass: {}".format(np.allclose(filtered[:n_check], expected)))
+
+    tt = n_check - 1
+    padded, mask = hmmbatch.pad_sequences(framelogprob(means, counts[:tt+1]), [tt+1])
+    _, fwdlattice = hmmbatch.forward(np.log(startprob), np.log(transmat), padded, mask)
+    bwdlattice = hmmbatch.backward(np.log(transmat), padded, mask)
+    gamma = hmmbatch.posteriors(fwdlattice, bwdlattice, mask)
+    print("smoothed matches forward-backward: {}".format(np.allclose(smoothed[tt], gamma[tt-lag])))
+
+if __name__ == '__main__':
+    args = [float(arg) for arg in sys.argv[1:]]
+    kwargs = {key: int(value) for key, value in zip(['n_states', 'n_units', 'lag', 'n_updates'], args)}
+    main(**kwargs)
@@ -0,0 +1,72 @@
+"""Benchmark per-bin latency of nelpy.decoding.StreamingDecoder.
+
+Feeds a synthetic Poisson spike stream, generated from a set of
+Gaussian place fields and a moving animal, to the streaming decoder one
+bin at a time, and reports the p50/p99/max latency of update(). The
+posteriors of all full windows are checked against a batch computation
+on the same counts.
+
+Usage:
+    python benchmarks/bench_streaming_decoder.py [n_units] [n_xbins] [w] [n_updates]
+"""
+
+import sys
+import time
+import numpy as np
+
+import nelpy as nel
+from nelpy.decoding import StreamingDecoder
+
+def synthetic_stream(n_units, n_xbins, n_updates, ds, random_state=0):
+    """Return a TuningCurve1D and a (n_units, n_updates) count stream."""
+    rng = np.random.RandomState(random_state)
+    bin_centers = (np.arange(n_xbins) + 0.5) / n_xbins
+    centers = rng.uniform(0, 1, size=n_units)
+    peaks = rng.uniform(5, 30, size=n_units)
+    ratemap = peaks[:, np.newaxis]*np.exp(-(bin_centers - centers[:, np.newaxis])**2/(2*0.05**2)) + 0.1
+    tc = nel.TuningCurve1D(ratemap=ratemap, extmin=0, extmax=1)
+
+    t = np.arange(n_updates)*ds
+    x_idx = ((np.sin(t/2) + 1)/2*(n_xbins - 1)).astype(int)
+    counts = rng.poisson(ratemap[:, x_idx]*ds)
+    return tc, counts
+
+def batch_posteriors(ratemap, counts, ds, w):
+    """Posteriors (n_xbins, n_windows) of all full windows, as decode1D
+    computes them."""
+    datacum = np.hstack((np.zeros((counts.shape[0], 1)), np.cumsum(counts, axis=1)))
+    obs = datacum[:, w:] - datacum[:, :-w]
+    logp = np.dot(np.log(ratemap).T, obs) - ratemap.sum(axis=0)[:, np.newaxis]*ds*w
+    posterior = np.exp(logp - logp.max(axis=0))
+    posterior /= posterior.sum(axis=0)
+    posterior[:, obs.sum(axis=0) == 0] = np.nan
+    return posterior
+
+def main(n_units=100, n_xbins=200, w=4, n_updates=20000, ds=0.005):
+    tc, counts = synthetic_stream(n_units, n_xbins, n_updates, ds)
+    decoder = StreamingDecoder(tc, ds=ds, w=w)
+
+    print("{} units, {} position bins, w={} x {} ms bins, {} updates".format(
+        n_units, n_xbins, w, ds*1000, n_updates))
+
+    stream = np.ascontiguousarray(counts.T, dtype=float)
+    latencies = np.empty(n_updates)
+    posteriors = np.empty((n_updates, n_xbins))
+    for ii, bin_counts in enumerate(stream):
+        t0 = time.perf_counter()
+        posterior = decoder.update(bin_counts)
+        latencies[ii] = time.perf_counter() - t0
+        posteriors[ii] = posterior
+
+    p50, p99 = np.percentile(latencies, [50, 99])*1e6
+    print("update latency: p50 {:8.1f} us  p99 {:8.1f} us  max {:8.1f} us".format(
+        p50, p99, latencies.max()*1e6))
+
+    expected = batch_posteriors(tc.ratemap, counts, ds, w)
+    agree = np.allclose(posteriors[w-1:].T, expected, equal_nan=True)
+    print("matches batch decoding: {}".format(agree))
+
+if __name__ == '__main__':
+    args = [float(arg) for arg in sys.argv[1:]]
+    kwargs = {key: int(value) for key, value in zip(['n_units', 'n_xbins', 'w', 'n_updates'], args)}
+    main(**kwargs)
@@ -0,0 +1,52 @@
+"""Benchmark ratemap accumulation in nelpy.auxiliary._tuningcurve.
+
+Compares the per-time-bin Python loop that TuningCurve1D/2D used to
+accumulate spike counts into external bins with the per-unit
+np.bincount accumulation that is used now, and checks that both give
+identical ratemaps.
+
+Usage:
+    python benchmarks/bench_tuningcurve.py [n_units] [duration_s] [ds]
+"""
+
+import sys
+import time
+import numpy as np
+
+from nelpy.auxiliary._tuningcurve import _accumulate_by_bin
+
+def loop_accumulate(data, bin_idx, n_bins):
+    ratemap = np.zeros((data.shape[0], n_bins))
+    for tt, bidx in enumerate(bin_idx):
+        ratemap[:,bidx] += data[:,tt]
+    return ratemap
+
+def bench(func, *args, n_repeats=3):
+    """Return the result and the best wall time (in seconds) over n_repeats."""
+    best = np.inf
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        out = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+def main(n_units=300, duration=3600, ds=0.05):
+    n_samples = int(duration/ds)
+    data = np.random.poisson(0.5, size=(n_units, n_samples))
+
+    print("{} units x {} time bins".format(n_units, n_samples))
+
+    for name, n_bins in [('1D (100 bins)', 100), ('2D (50x50 bins)', 2500)]:
+        bin_idx = np.random.randint(n_bins, size=n_samples)
+        expected, t_loop = bench(loop_accumulate, data, bin_idx, n_bins, n_repeats=1)
+        ratemap, t_bincount = bench(_accumulate_by_bin, data, bin_idx, n_bins)
+        assert np.array_equal(expected, ratemap)
+        print("{:>16s}: loop {:8.3f} s, bincount {:8.3f} s ({:.0f}x)".format(
+            name, t_loop, t_bincount, t_loop/t_bincount))
+
+if __name__ == '__main__':
+    args = [float(arg) for arg in sys.argv[1:]]
+    kwargs = dict(zip(['n_units', 'duration', 'ds'], args))
+    if 'n_units' in kwargs:
+        kwargs['n_units'] = int(kwargs['n_units'])
+    main(**kwargs)
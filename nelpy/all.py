@@ -15,6 +15,7 @@ from . import hmmutils
 from . import io
 from . import decoding
 from . import scoring
+from . import spectral
 from . import plotting
 from . import utils
 
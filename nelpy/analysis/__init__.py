@@ -9,7 +9,8 @@ nelpy.analysis provides several commonly used analyses.
 
 from .replay import *
 from .ergodic import *
-# from .ripple import *
+from .ripple import *
+from .placefields import *
 # from .decoding import *
 
 __version__ = '0.0.1'  # should I maintain a separate version for this?
\ No newline at end of file
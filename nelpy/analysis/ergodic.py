@@ -5,27 +5,47 @@
 
 __author__  = "Sergio J. Rey <srey@asu.edu> "
 
-__all__=['steady_state','fmpt']
+__all__=['steady_state','steady_state_sparse','fmpt','var_fmpt']
 
 import numpy as np
-import numpy.linalg as la
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
 
 def set_self_transition_zero(x):
     """Set cost/length of self-transition to zero."""
     np.fill_diagonal(x, 0.0)
 
+def _as_stacked(P):
+    """Return P as a float ndarray of shape (..., k, k), and whether it
+    was given as an np.matrix (whose results are returned as np.matrix)."""
+    is_matrix = isinstance(P, np.matrix)
+    P = np.asarray(P, dtype=float)
+    if P.ndim < 2 or P.shape[-1] != P.shape[-2]:
+        raise ValueError("P must be a (k, k) or (n_models, k, k) array of square transition matrices")
+    return P, is_matrix
+
+def _fundamental(P, ss):
+    """Fundamental matrix Z = inv(I - P + A) of stacked transition
+    matrices, where every row of A is the steady state distribution."""
+    k = P.shape[-1]
+    I = np.identity(k)
+    return np.linalg.solve(I - P + ss[..., np.newaxis, :], np.broadcast_to(I, P.shape))
+
 def steady_state(P):
     """
     Calculates the steady state probability vector for a regular Markov
     transition matrix P
     Parameters
     ----------
-    P        : matrix (kxk)
-               an ergodic Markov transition probability matrix
+    P        : matrix (kxk) or array (..., k, k)
+               an ergodic Markov transition probability matrix, or a stack
+               of them, e.g. (n_models, k, k)
     Returns
     -------
-    implicit : matrix (kx1)
-               steady state distribution
+    implicit : matrix (kx1) or array (..., k)
+               steady state distribution; an np.matrix P gives a (kx1)
+               matrix, an array gives an array with one distribution per
+               transition matrix
     Examples
     --------
     Taken from Kemeny and Snell. [1]_ Land of Oz example where the states are
@@ -43,17 +63,109 @@ def steady_state(P):
     Thus, the long run distribution for Oz is to have 40 percent of the
     days classified as Rain, 20 percent as Nice, and 40 percent as Snow
     (states are mutually exclusive).
+
+    Stacked transition matrices are solved at once:
+
+    >>> steady_state(np.array([p.A, np.identity(3)*0.5 + 0.5/3]))
+    array([[0.4       , 0.2       , 0.4       ],
+           [0.33333333, 0.33333333, 0.33333333]])
+
+    Notes
+    -----
+    The steady state distribution pi is the solution of
+    pi (I - P + E) = 1, with E a matrix of ones, which is solved with
+    np.linalg.solve for all transition matrices at once. For large,
+    sparse transition matrices see steady_state_sparse.
     """
+    P, is_matrix = _as_stacked(P)
+    k = P.shape[-1]
+    lhs = np.swapaxes(np.identity(k) - P + 1, -1, -2)
+    ss = np.linalg.solve(lhs, np.ones(P.shape[:-1] + (1,)))[..., 0]
+
+    if is_matrix:
+        return np.matrix(ss).T
+    return ss
+
+def steady_state_sparse(P, method='direct', tol=1e-12, maxiter=None, x0=None):
+    """
+    Calculates the steady state probability vector for a large, sparse
+    regular Markov transition matrix P
+    Parameters
+    ----------
+    P        : scipy.sparse matrix or array (kxk)
+               an ergodic Markov transition probability matrix
+    method   : string, optional
+               'direct' (default) solves the sparse linear system
+               pi (I - P) = 0, sum(pi) = 1 with a sparse LU factorization;
+               'power' uses power iteration, which only needs
+               sparse matrix-vector products, and is preferable when
+               the LU factors fill in (densely connected chains) and
+               the chain mixes quickly.
+    tol      : float, optional
+               convergence tolerance (L1 change of pi per iteration) for
+               method 'power'. Default is 1e-12.
+    maxiter  : int, optional
+               maximum number of iterations for method 'power'. Default
+               is 100*k.
+    x0       : array (k,), optional
+               initial distribution for method 'power'. Default is
+               uniform.
+    Returns
+    -------
+    implicit : array (k,)
+               steady state distribution
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import scipy.sparse as sp
+    >>> p=sp.csr_matrix([[.5, .25, .25],[.5,0,.5],[.25,.25,.5]])
+    >>> steady_state_sparse(p)
+    array([0.4, 0.2, 0.4])
+    >>> np.allclose(steady_state_sparse(p, method='power'), [0.4, 0.2, 0.4])
+    True
 
-    v,d=la.eig(np.transpose(P))
+    Notes
+    -----
+    Power iteration is applied to the lazy chain (I + P)/2, which has the
+    same steady state as P but is aperiodic, so that the iteration also
+    converges for periodic chains.
+    """
+    P = sp.csr_matrix(P, dtype=float)
+    k = P.shape[0]
+    if P.shape != (k, k):
+        raise ValueError("P must be a square transition matrix")
 
-    # for a regular P maximum eigenvalue will be 1
-    mv=max(v)
-    # find its position
-    i=v.tolist().index(mv)
+    if method == 'direct':
+        # (I - P).T pi = 0 has rank k-1 for an ergodic chain; fix the last
+        # component to 1 and drop its (redundant) equation, which keeps the
+        # system sparse, then normalize:
+        Q = (sp.identity(k, format='csr') - P).T.tocsc()
+        ss = np.ones(k)
+        if k > 1:
+            ss[:-1] = spla.spsolve(Q[:-1, :-1], -Q[:-1, -1].toarray().ravel())
+        ss /= ss.sum()
+    elif method == 'power':
+        if maxiter is None:
+            maxiter = 100*k
+        if x0 is None:
+            ss = np.full(k, 1/k)
+        else:
+            ss = np.asarray(x0, dtype=float)
+            ss = ss/ss.sum()
+        PT = P.T.tocsr()
+        for _ in range(maxiter):
+            ss_new = 0.5*(ss + PT.dot(ss))
+            ss_new /= ss_new.sum()
+            converged = np.abs(ss_new - ss).sum() < tol
+            ss = ss_new
+            if converged:
+                break
+        else:
+            raise RuntimeError("power iteration did not converge in {} iterations".format(maxiter))
+    else:
+        raise ValueError("method must be 'direct' or 'power'")
 
-    # normalize eigenvector corresponding to the eigenvalue 1
-    return d[:,i]/sum(d[:,i])
+    return ss
 
 def fmpt(P):
     """
@@ -61,11 +173,12 @@ def fmpt(P):
     ergodic transition probability matrix.
     Parameters
     ----------
-    P    : matrix (kxk)
-           an ergodic Markov transition probability matrix
+    P    : matrix (kxk) or array (..., k, k)
+           an ergodic Markov transition probability matrix, or a stack of
+           them, e.g. (n_models, k, k)
     Returns
     -------
-    M    : matrix (kxk)
+    M    : matrix (kxk) or array (..., k, k)
            elements are the expected value for the number of intervals
            required for  a chain starting in state i to first enter state j
            If i=j then this is the recurrence time.
@@ -95,19 +208,16 @@ def fmpt(P):
     .. [1] Kemeny, John, G. and J. Laurie Snell (1976) Finite Markov
        Chains. Springer-Verlag. Berlin
     """
-    P=np.matrix(P)
-    A=np.zeros_like(P)
-    ss=steady_state(P)
-    k=ss.shape[0]
-    for i in range(k):
-        A[:,i]=ss
-    A=A.transpose()
-    I=np.identity(k)
-    Z=la.inv(I-P+A)
-    E=np.ones_like(Z)
-    D=np.diag(1./np.diag(A))
-    Zdg=np.diag(np.diag(Z))
-    M=(I-Z+E*Zdg)*D
+    P, is_matrix = _as_stacked(P)
+    ss = steady_state(P)
+    Z = _fundamental(P, ss)
+    Zdg = np.diagonal(Z, axis1=-2, axis2=-1)
+
+    # M = (I - Z + E Zdg) D, with D = diag(1/ss)
+    M = (np.identity(P.shape[-1]) - Z + Zdg[..., np.newaxis, :]) / ss[..., np.newaxis, :]
+
+    if is_matrix:
+        return np.matrix(M)
     return M
 
 
@@ -119,11 +229,12 @@ def var_fmpt(P):
     probability matrix
     Parameters
     ----------
-    P    : matrix (kxk)
-           an ergodic Markov transition probability matrix
+    P    : matrix (kxk) or array (..., k, k)
+           an ergodic Markov transition probability matrix, or a stack of
+           them, e.g. (n_models, k, k)
     Returns
     -------
-    implic : matrix (kxk)
+    implic : matrix (kxk) or array (..., k, k)
              elements are the variances for the number of intervals
              required for  a chain starting in state i to first enter state j
     Examples
@@ -145,18 +256,21 @@ def var_fmpt(P):
     .. [1] Kemeny, John, G. and J. Laurie Snell (1976) Finite Markov
        Chains. Springer-Verlag. Berlin
     """
-    A=P**1000
-    n,k=A.shape
-    I=np.identity(k)
-    Z=la.inv(I-P+A)
-    E=np.ones_like(Z)
-    D=np.diag(1./np.diag(A))
-    Zdg=np.diag(np.diag(Z))
-    M=(I-Z+E*Zdg)*D
-    ZM=Z*M
-    ZMdg=np.diag(np.diag(ZM))
-    W=M*(2*Zdg*D-I)+2*(ZM-E*ZMdg)
-    return W-np.multiply(M,M)
+    P, is_matrix = _as_stacked(P)
+    ss = steady_state(P)
+    Z = _fundamental(P, ss)
+    Zdg = np.diagonal(Z, axis1=-2, axis2=-1)
+    M = (np.identity(P.shape[-1]) - Z + Zdg[..., np.newaxis, :]) / ss[..., np.newaxis, :]
+
+    # W = M (2 Zdg D - I) + 2 (ZM - E ZMdg)
+    ZM = np.matmul(Z, M)
+    ZMdg = np.diagonal(ZM, axis1=-2, axis2=-1)
+    W = M*(2*Zdg/ss)[..., np.newaxis, :] - M + 2*(ZM - ZMdg[..., np.newaxis, :])
+    V = W - M*M
+
+    if is_matrix:
+        return np.matrix(V)
+    return V
 
 
 def _test():
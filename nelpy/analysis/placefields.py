@@ -0,0 +1,199 @@
+"""Shuffle-based significance of place fields."""
+
+__all__ = ['spatial_information_shuffle']
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from scipy.ndimage import gaussian_filter1d
+
+from .. import auxiliary
+from ..auxiliary._tuningcurve import _interp_extern
+from ..filtering import _n_workers
+
+# arguments shared by every shuffle batch; set once per worker process
+_SHUFFLE_ARGS = None
+
+def _init_shuffle_worker(args):
+    global _SHUFFLE_ARGS
+    _SHUFFLE_ARGS = args
+
+def _spatial_information_batch(occupancy, ratemaps):
+    """Spatial information and sparsity of a stack of ratemaps.
+
+    Vectorized version of utils.spatial_information() and
+    utils.spatial_sparsity(), where ratemaps has shape (..., n_units,
+    n_bins), and every (n_units, n_bins) ratemap is treated as a separate
+    tuning curve.
+    """
+    Pi = occupancy / np.sum(occupancy)
+
+    R = ratemaps.mean(axis=-1, keepdims=True) # mean firing rate
+    sparsity = np.sum(Pi*ratemaps, axis=-1) / R[..., 0]**2
+
+    # ensure that the ratemap always has nonzero firing rates,
+    # otherwise the spatial information might return NaNs:
+    bkg_rate = np.where(ratemaps > 0, ratemaps, np.inf).min(axis=(-2, -1), keepdims=True)
+    ratemaps = np.maximum(ratemaps, bkg_rate)
+    R = ratemaps.mean(axis=-1, keepdims=True)
+    ratio = ratemaps / R
+    si = np.sum(Pi*ratio*np.log2(ratio), axis=-1)
+
+    return si, sparsity
+
+def _shuffle_batch(shifts, args=None):
+    """Return the spatial information and sparsity, each of shape
+    (n_shifts, n_units), of the counts circularly shifted by each of
+    shifts (in time bins) against position."""
+    if args is None:
+        args = _SHUFFLE_ARGS
+    data, bin_idx, occupancy, n_bins, ds, minbgrate, sigma, bw = args
+
+    n_units, n_samples = data.shape
+    n_shifts = len(shifts)
+
+    # rolling the counts forward by shift pairs data[:, t] with the
+    # position at t + shift; every shift gets its own block of n_bins:
+    rolled = bin_idx[(np.arange(n_samples) + shifts[:, np.newaxis]) % n_samples]
+    idx = (rolled + n_bins*np.arange(n_shifts)[:, np.newaxis]).ravel()
+
+    ratemaps = np.empty((n_shifts, n_units, n_bins))
+    for uu, counts in enumerate(data):
+        ratemaps[:, uu, :] = np.bincount(idx, weights=np.tile(counts, n_shifts),
+                                         minlength=n_shifts*n_bins).reshape(n_shifts, n_bins)
+
+    # same normalization as TuningCurve1D:
+    denom = occupancy.astype(float)
+    denom[denom==0] = 1
+    ratemaps = ratemaps / ds / denom
+    ratemaps[ratemaps < minbgrate] = minbgrate
+    if sigma is not None and sigma > 0:
+        ratemaps = gaussian_filter1d(ratemaps, sigma=sigma, axis=-1, truncate=bw)
+
+    return _spatial_information_batch(occupancy, ratemaps)
+
+def spatial_information_shuffle(bst, extern, *, n_extern=None, extmin=0,
+                                extmax=1, transform_func=None, sigma=None,
+                                bw=None, minbgrate=None, n_shuffles=500,
+                                min_shift=None, batchsize=None,
+                                random_state=None, n_jobs=None):
+    """Spatial information and sparsity, with shuffle-based p-values.
+
+    The binned spike counts are circularly shifted in time against the
+    position (treating all epochs as one concatenated sequence), and the
+    spatial information and sparsity of the resulting tuning curves are
+    compared to those of the observed TuningCurve1D. Shifted ratemaps are
+    computed in batches of stacked shifts, without rebuilding tuning
+    curves, and batches can be distributed across a process pool.
+
+    Parameters
+    ----------
+    bst : BinnedSpikeTrainArray
+    extern : AnalogSignalArray
+        External correlate (e.g., position).
+    n_extern, extmin, extmax, transform_func, sigma, bw, minbgrate :
+        Passed to TuningCurve1D.
+    n_shuffles : int, optional
+        Number of circular shifts. Default is 500.
+    min_shift : float, optional
+        Minimum shift (in seconds) in either direction. Default is one
+        time bin.
+    batchsize : int, optional
+        Number of shifts computed at once. Default is 50.
+    random_state : int or RandomState, optional
+        Seed for the shifts; results do not depend on n_jobs.
+    n_jobs : int, optional
+        Number of processes. Default is None (serial); -1 uses all
+        available cores.
+
+    Returns
+    -------
+    results : ResultsContainer
+        With attributes
+            tuningcurve : TuningCurve1D
+                The observed tuning curve.
+            si, sparsity : arrays of shape (n_units,)
+                Observed spatial information (in bits) and sparsity.
+            si_shuffled, sparsity_shuffled : arrays of shape (n_shuffles, n_units)
+                Spatial information and sparsity of shifted data.
+            si_pvalues : array of shape (n_units,)
+                Fraction of shuffles with spatial information greater
+                than or equal to that observed, as (r+1)/(n+1).
+            sparsity_pvalues : array of shape (n_units,)
+                Fraction of shuffles with sparsity less than or equal to
+                that observed, as (r+1)/(n+1).
+            shifts : array of shape (n_shuffles,)
+                Shifts (in time bins).
+    """
+
+    if float(n_shuffles).is_integer():
+        n_shuffles = int(n_shuffles)
+    else:
+        raise ValueError("n_shuffles must be an integer!")
+    if batchsize is None:
+        batchsize = 50
+    if bw is None:
+        bw = 4
+    if minbgrate is None:
+        minbgrate = 0.01 # Hz minimum background firing rate
+
+    ext_cache = {}
+    tuningcurve = auxiliary.TuningCurve1D(bst=bst, extern=extern,
+                                          n_extern=n_extern, extmin=extmin,
+                                          extmax=extmax,
+                                          transform_func=transform_func,
+                                          sigma=sigma, bw=bw,
+                                          minbgrate=minbgrate,
+                                          ext_cache=ext_cache)
+    ext = _interp_extern(tuningcurve.trans_func, extern, bst.bin_centers,
+                         ext_cache)
+    bin_idx = np.digitize(np.ravel(ext), tuningcurve.bins, True) - 1
+
+    n_samples = int(bst.n_bins)
+    if min_shift is None:
+        min_shift = 1
+    else:
+        min_shift = max(int(np.ceil(min_shift / bst.ds)), 1)
+    if n_samples - 2*min_shift < 0:
+        raise ValueError("min_shift is too large for the duration of bst!")
+
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    shifts = random_state.randint(min_shift, n_samples - min_shift + 1, size=n_shuffles)
+
+    if sigma is not None and sigma > 0:
+        sigma_bins = sigma / ((tuningcurve.bins[-1] - tuningcurve.bins[0])/tuningcurve.n_bins)
+    else:
+        sigma_bins = None
+    args = (np.atleast_2d(bst.data), bin_idx, np.asarray(tuningcurve.occupancy),
+            tuningcurve.n_bins, bst.ds, minbgrate, sigma_bins, bw)
+
+    batches = [shifts[first:first+batchsize] for first in range(0, n_shuffles, batchsize)]
+    n_workers = min(_n_workers(n_jobs), max(len(batches), 1))
+    if n_workers == 1:
+        results = [_shuffle_batch(batch, args) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_shuffle_worker,
+                                 initargs=(args,)) as executor:
+            results = list(executor.map(_shuffle_batch, batches))
+
+    n_units = tuningcurve.n_units
+    si_shuffled = np.concatenate([si for si, _ in results]) if results else np.zeros((0, n_units))
+    sparsity_shuffled = np.concatenate([sp for _, sp in results]) if results else np.zeros((0, n_units))
+
+    si = tuningcurve.spatial_information()
+    sparsity = tuningcurve.spatial_sparsity()
+
+    si_pvalues = (np.sum(si_shuffled >= si, axis=0) + 1) / (n_shuffles + 1)
+    sparsity_pvalues = (np.sum(sparsity_shuffled <= sparsity, axis=0) + 1) / (n_shuffles + 1)
+
+    return auxiliary.ResultsContainer(tuningcurve=tuningcurve,
+                                      si=si,
+                                      sparsity=sparsity,
+                                      si_shuffled=si_shuffled,
+                                      sparsity_shuffled=sparsity_shuffled,
+                                      si_pvalues=si_pvalues,
+                                      sparsity_pvalues=sparsity_pvalues,
+                                      shifts=shifts,
+                                      description="spatial information shuffle")
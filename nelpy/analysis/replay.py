@@ -5,6 +5,7 @@ __all__ = ['linregress_ting',
            'column_cycle_array',
            'trajectory_score_array',
            'trajectory_score_bst',
+           'trajectory_score_unit_id_shuffle',
            'get_significant_events',
            'three_consecutive_bins_above_q',
            'score_hmm_time_resolved',
@@ -14,9 +15,16 @@ import warnings
 import copy
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from scipy import stats
+from scipy.special import logsumexp
 from .. import auxiliary
+from .. import hmmbatch
+from .. import scoring
 from ..decoding import decode1D as decode
+from ..decoding import decoding_terms, _windowed_counts
+from ..filtering import _n_workers
 from ..decoding import get_mode_pth_from_array, get_mean_pth_from_array
 
 def linregress_ting(bst, tuningcurve, n_shuffles=250):
@@ -255,10 +263,10 @@ def trajectory_score_bst(bst, tuningcurve, w=None, n_shuffles=250,
 
     if w is None:
         w = 0
-    if not float(w).is_integer:
+    if not float(w).is_integer():
         raise ValueError("w has to be an integer!")
 
-    if float(n_shuffles).is_integer:
+    if float(n_shuffles).is_integer():
         n_shuffles = int(n_shuffles)
     else:
         raise ValueError("n_shuffles must be an integer!")
@@ -297,7 +305,112 @@ def trajectory_score_bst(bst, tuningcurve, w=None, n_shuffles=250,
         return scores, scores_time_swap, scores_col_cycle
     return scores
 
-def shuffle_transmat(transmat):
+def trajectory_score_unit_id_shuffle(bst, tuningcurve, w=None, n_shuffles=250,
+                                     normalize=False, random_state=None,
+                                     batchsize=None):
+    """Trajectory scores and linear regression R^2 values of each event
+    in the BinnedSpikeTrainArray, with a unit identity shuffle.
+
+    In each shuffle, the tuning curves are randomly reassigned to the
+    units. Instead of building a new tuning curve and re-decoding for
+    every shuffle, the rows (units) of the log ratemap are permuted, and
+    the posteriors of a batch of shuffles are computed as one batched
+    matrix product of shape (batchsize, n_xbins, n_bins). The expected
+    spike count term does not depend on the unit order and is shared by
+    all shuffles. Each shuffled posterior is scored with
+    linregress_array() and trajectory_score_array(), as in
+    trajectory_score_bst().
+
+    Parameters
+    ----------
+    bst : BinnedSpikeTrainArray
+        BinnedSpikeTrainArray containing all the candidate events to
+        score.
+    tuningcurve : TuningCurve1D
+        Tuning curve to decode events in bst.
+    w : int, optional (default is 0)
+        Half band width for calculating the trajectory score.
+    n_shuffles : int, optional (default is 250)
+        Number of unit identity shuffles.
+    normalize : bool, optional (default is False)
+        If True, the trajectory scores will be normalized by the number
+        of non-NaN bins in each event.
+    random_state : int or RandomState, optional
+        Seed for the unit permutations.
+    batchsize : int, optional
+        Number of shuffles decoded at a time. Default is chosen such
+        that each batch of posteriors has about 10 million elements.
+
+    Returns
+    -------
+    scores : array of size (bst.n_epochs, )
+        Trajectory scores.
+    r2values : array of size (bst.n_epochs, )
+    scores_shuffled : array of size (n_shuffles, bst.n_epochs)
+    r2values_shuffled : array of size (n_shuffles, bst.n_epochs)
+    """
+
+    if w is None:
+        w = 0
+    if not float(w).is_integer():
+        raise ValueError("w has to be an integer!")
+
+    if float(n_shuffles).is_integer():
+        n_shuffles = int(n_shuffles)
+    else:
+        raise ValueError("n_shuffles must be an integer!")
+
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    lfx, eterm = decoding_terms(tuningcurve, bst.unit_ids, ds=bst.ds, w=1)
+    obs, bdries = _windowed_counts(bst, 1)
+    n_xbins, n_units = lfx.shape
+    n_tbins = obs.shape[1]
+    empty = obs.sum(axis=0) == 0
+
+    def _posterior(lfx):
+        # (..., n_xbins, n_units) x (n_units, n_tbins)
+        logp = np.matmul(lfx, obs)
+        logp += eterm[:, np.newaxis]
+        logp -= logp.max(axis=-2, keepdims=True)
+        np.exp(logp, out=logp)
+        logp /= logp.sum(axis=-2, keepdims=True)
+        logp[..., empty] = np.nan
+        return logp
+
+    def _score(posterior):
+        scores = np.zeros(bst.n_epochs)
+        r2values = np.zeros(bst.n_epochs)
+        for idx in range(bst.n_epochs):
+            posterior_array = posterior[:, bdries[idx]:bdries[idx+1]]
+            slope, intercept, r2values[idx] = linregress_array(posterior_array)
+            scores[idx] = trajectory_score_array(posterior=posterior_array,
+                                                 slope=slope,
+                                                 intercept=intercept,
+                                                 w=w,
+                                                 normalize=normalize)
+        return scores, r2values
+
+    scores, r2values = _score(_posterior(lfx))
+
+    # one random permutation of the units per shuffle:
+    perms = np.argsort(random_state.rand(n_shuffles, n_units), axis=1)
+
+    if batchsize is None:
+        batchsize = max(int(1e7 // max(n_xbins*n_tbins, 1)), 1)
+
+    scores_shuffled = np.zeros((n_shuffles, bst.n_epochs))
+    r2values_shuffled = np.zeros((n_shuffles, bst.n_epochs))
+    for first in range(0, n_shuffles, batchsize):
+        batch = perms[first:first+batchsize]
+        posteriors = _posterior(lfx[:, batch].transpose(1, 0, 2))
+        for ii, shuffled_posterior in enumerate(posteriors):
+            scores_shuffled[first+ii], r2values_shuffled[first+ii] = _score(shuffled_posterior)
+
+    return scores, r2values, scores_shuffled, r2values_shuffled
+
+def shuffle_transmat(transmat, n_shuffles=None, random_state=None):
     """Shuffle transition probability matrix within each row, leaving self transitions in tact.
 
     It is assumed that the transmat is stochastic-row-wise, meaning that A_{ij} = Pr(S_{t+1}=j|S_t=i).
@@ -306,23 +419,104 @@ def shuffle_transmat(transmat):
     ----------
     transmat : array of size (n_states, n_states)
         Transition probability matrix, where A_{ij} = Pr(S_{t+1}=j|S_t=i).
+    n_shuffles : int, optional
+        If given, that many independently shuffled matrices are generated
+        at once, and returned as an array of size (n_shuffles, n_states,
+        n_states).
+    random_state : int or RandomState, optional
+        Default uses the global numpy random state.
 
     Returns
     -------
     shuffled : array of size (n_states, n_states)
         Shuffled transition probability matrix.
     """
-    shuffled = transmat.copy()
-
+    transmat = np.asarray(transmat)
     nrows, ncols = transmat.shape
-    for rowidx in range(nrows):
-        all_but_diagonal = np.append(np.arange(rowidx), np.arange(rowidx+1, ncols))
-        shuffle_idx = np.random.permutation(all_but_diagonal)
-        shuffle_idx = np.insert(shuffle_idx, rowidx, rowidx)
-        shuffled[rowidx,:] = shuffled[rowidx, shuffle_idx]
 
+    if random_state is None:
+        random_state = np.random
+    elif not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    # column indices of all but the diagonal element, for every row:
+    offdiag = np.array([np.append(np.arange(rowidx), np.arange(rowidx+1, ncols))
+                        for rowidx in range(nrows)], dtype=int).reshape(nrows, ncols-1)
+    size = 1 if n_shuffles is None else int(n_shuffles)
+    perms = np.argsort(random_state.rand(size, nrows, ncols-1), axis=-1)
+    shuffle_idx = np.take_along_axis(np.broadcast_to(offdiag, perms.shape), perms, axis=-1)
+
+    rows = np.arange(nrows)[:, np.newaxis]
+    shuffled = np.repeat(transmat[np.newaxis], size, axis=0)
+    shuffled[:, rows, offdiag] = transmat[rows, shuffle_idx]
+
+    if n_shuffles is None:
+        return shuffled[0]
     return shuffled
 
+# emissions shared by every batch of transmat shuffles; set once per
+# worker process
+_TRANSMAT_SHUFFLE_ARGS = None
+
+def _init_transmat_shuffle_worker(args):
+    global _TRANSMAT_SHUFFLE_ARGS
+    _TRANSMAT_SHUFFLE_ARGS = args
+
+def _transmat_shuffle_batch(log_transmats, args=None, cumulative=False):
+    """Log likelihoods of all events under each of a batch of transition
+    matrices, of shape (n_transmats, n_events), or, if cumulative, of the
+    first b bins of every event, of shape (n_transmats, n_bins)."""
+    if args is None:
+        args = _TRANSMAT_SHUFFLE_ARGS
+    log_startprob, padded, mask = args
+    if cumulative:
+        _, fwdlattice = hmmbatch.forward(log_startprob, log_transmats, padded, mask)
+        return logsumexp(hmmbatch.unpad_sequences(fwdlattice, mask), axis=-1)
+    logprob, _ = hmmbatch.forward(log_startprob, log_transmats, padded, mask,
+                                  return_lattice=False)
+    return logprob
+
+def _score_transmat_shuffles(bst, hmm, n_shuffles, cumulative=False,
+                             random_state=None, batchsize=None, n_jobs=None):
+    """Score all events in bst under n_shuffles transmat shuffles of hmm.
+
+    All shuffled transition matrices are generated at once, and each
+    batch of them is evaluated with one batched forward pass over
+    (batchsize x n_events), re-using the cached emissions of hmm.
+    Batches can be distributed across a process pool.
+    """
+    padded, mask, _ = hmm._padded_framelogprob(bst)
+    log_startprob, _ = hmm._log_params()
+    with np.errstate(divide='ignore'):
+        log_transmats = np.log(shuffle_transmat(hmm.transmat_,
+                                                n_shuffles=n_shuffles,
+                                                random_state=random_state))
+
+    if batchsize is None:
+        # keep the (forward lattice of a) batch at about 10 million elements
+        per_shuffle = padded.size if cumulative else padded.shape[0]*padded.shape[2]
+        batchsize = max(int(1e7 // max(per_shuffle, 1)), 1)
+    batches = [log_transmats[first:first+batchsize]
+               for first in range(0, n_shuffles, batchsize)]
+
+    args = (log_startprob, padded, mask)
+    n_workers = min(_n_workers(n_jobs), max(len(batches), 1))
+    if n_workers == 1:
+        results = [_transmat_shuffle_batch(batch, args, cumulative=cumulative)
+                   for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_transmat_shuffle_worker,
+                                 initargs=(args,)) as executor:
+            results = list(executor.map(partial(_transmat_shuffle_batch,
+                                                cumulative=cumulative),
+                                        batches))
+
+    if not results:
+        n_out = int(mask.sum()) if cumulative else mask.shape[0]
+        return np.zeros((0, n_out))
+    return np.concatenate(results)
+
 def score_hmm_logprob(bst, hmm, normalize=False):
     """Score events in a BinnedSpikeTrainArray by computing the log
     probability under the model.
@@ -346,10 +540,15 @@ def score_hmm_logprob(bst, hmm, normalize=False):
 
     return logprob
 
-def score_hmm_transmat_shuffle(bst, hmm, n_shuffles=250, normalize=False):
+def score_hmm_transmat_shuffle(bst, hmm, n_shuffles=250, normalize=False,
+                               random_state=None, batchsize=None, n_jobs=None):
     """Score sequences using a hidden Markov model, and a model where
     the transition probability matrix has been shuffled.BaseException
 
+    All shuffled transition matrices are generated at once, and scored
+    with batched forward passes over (shuffles x events) that re-use the
+    emission log likelihoods of the model.
+
     Parameters
     ----------
     bst : BinnedSpikeTrainArray
@@ -362,6 +561,15 @@ def score_hmm_transmat_shuffle(bst, hmm, n_shuffles=250, normalize=False):
         shuffles.
     normalize : bool, optional (default is False)
         If True, the scores will be normalized by event lengths.
+    random_state : int or RandomState, optional
+        Seed for the shuffles. Default uses the global numpy random
+        state.
+    batchsize : int, optional
+        Number of shuffles scored at once. Default is chosen to bound
+        memory use.
+    n_jobs : int, optional
+        Number of processes. Default is None (serial); -1 uses all
+        available cores.
 
     Returns
     -------
@@ -369,22 +577,20 @@ def score_hmm_transmat_shuffle(bst, hmm, n_shuffles=250, normalize=False):
     shuffled : array of size (n_shuffles, n_events)
     """
 
-    if float(n_shuffles).is_integer:
+    if float(n_shuffles).is_integer():
         n_shuffles = int(n_shuffles)
     else:
         raise ValueError("n_shuffles must be an integer!")
 
-    hmm_shuffled = copy.deepcopy(hmm)
     scores = score_hmm_logprob(bst=bst,
                                hmm=hmm,
                                normalize=normalize)
-    n_events = bst.n_epochs
-    shuffled = np.zeros((n_shuffles, n_events))
-    for ii in range(n_shuffles):
-        hmm_shuffled.transmat_ = shuffle_transmat(hmm_shuffled.transmat_)
-        shuffled[ii,:] = score_hmm_logprob(bst=bst,
-                                           hmm=hmm_shuffled,
-                                           normalize=normalize)
+    shuffled = _score_transmat_shuffles(bst, hmm, n_shuffles,
+                                        random_state=random_state,
+                                        batchsize=batchsize,
+                                        n_jobs=n_jobs)
+    if normalize:
+        shuffled = shuffled / bst.lengths
 
     return scores, shuffled
 
@@ -447,17 +653,69 @@ def get_significant_events(scores, shuffled_scores, q=95):
     pvalues :
     """
 
+    shuffled_scores = np.asarray(shuffled_scores, dtype=float)
+    scores = np.broadcast_to(np.asarray(scores, dtype=float), shuffled_scores.shape[1:])
     n, _ = shuffled_scores.shape
-    r = np.sum(shuffled_scores >= scores, axis=0)
+
+    # a single sort of every column (NaNs are sorted to the end) gives both
+    # the ranks of the scores and the percentiles
+    sorted_scores = np.sort(shuffled_scores, axis=0)
+    n_valid = n - np.count_nonzero(np.isnan(sorted_scores), axis=0)
+    r = n_valid - _searchsorted_columns(sorted_scores, scores)
+    r[np.isnan(scores)] = 0
     pvalues = (r+1)/(n+1)
 
-    sig_event_idx = np.argwhere(scores > np.percentile(
-        shuffled_scores,
-        axis=0,
-        q=q)).squeeze()
+    # as with np.percentile, columns with NaN shuffles have no threshold
+    threshold = np.where(n_valid < n, np.nan, _percentile_sorted(sorted_scores, q=q))
+    with np.errstate(invalid='ignore'):
+        sig_event_idx = np.flatnonzero(scores > threshold)
 
     return np.atleast_1d(sig_event_idx), np.atleast_1d(pvalues)
 
+def _searchsorted_columns(a, v):
+    """np.searchsorted(a[:,jj], v[jj]) for all columns of a at once.
+
+    Parameters
+    ----------
+    a : array of shape (n, m)
+        Array sorted along axis 0.
+    v : array of shape (m,)
+
+    Returns
+    -------
+    idx : array of shape (m,)
+        Number of entries in every column of a that are smaller than v.
+    """
+    n, m = a.shape
+    cols = np.arange(m)
+    lo = np.zeros(m, dtype=int)
+    hi = np.full(m, n, dtype=int)
+    # vectorized bisection, ~log2(n) passes over the columns
+    active = lo < hi
+    while np.any(active):
+        mid = (lo + hi) // 2
+        less = active & (a[np.minimum(mid, n-1), cols] < v)
+        lo = np.where(less, mid + 1, lo)
+        hi = np.where(active & ~less, mid, hi)
+        active = lo < hi
+    return lo
+
+def _percentile_sorted(a, q):
+    """np.percentile(a, q, axis=0) (linear interpolation) of an array
+    that is already sorted along axis 0."""
+    n = a.shape[0]
+    h = (n - 1)*q/100
+    lo = int(np.floor(h))
+    hi = min(lo + 1, n - 1)
+    frac = h - lo
+    # same interpolation as np.percentile, including its NaNs between
+    # infinite values
+    with np.errstate(invalid='ignore'):
+        diff = a[hi] - a[lo]
+        if frac >= 0.5:
+            return a[hi] - diff*(1 - frac)
+        return a[lo] + diff*frac
+
 def score_hmm_logprob_cumulative(bst, hmm, normalize=False):
     """Score events in a BinnedSpikeTrainArray by computing the log
     probability under the model.
@@ -485,10 +743,15 @@ def score_hmm_logprob_cumulative(bst, hmm, normalize=False):
 
     return logprob
 
-def score_hmm_time_resolved(bst, hmm, n_shuffles=250, normalize=False):
+def score_hmm_time_resolved(bst, hmm, n_shuffles=250, normalize=False,
+                            random_state=None, batchsize=None, n_jobs=None):
     """Score sequences using a hidden Markov model, and a model where
     the transition probability matrix has been shuffled.BaseException
 
+    The cumulative log likelihoods under all shuffled transition
+    matrices are computed with batched forward passes over (shuffles x
+    events) that re-use the emission log likelihoods of the model.
+
     Parameters
     ----------
     bst : BinnedSpikeTrainArray
@@ -501,103 +764,124 @@ def score_hmm_time_resolved(bst, hmm, n_shuffles=250, normalize=False):
         shuffles.
     normalize : bool, optional (default is False)
         If True, the scores will be normalized by event lengths.
+    random_state : int or RandomState, optional
+        Seed for the shuffles. Default uses the global numpy random
+        state.
+    batchsize : int, optional
+        Number of shuffles scored at once. Default is chosen to bound
+        memory use.
+    n_jobs : int, optional
+        Number of processes. Default is None (serial); -1 uses all
+        available cores.
 
     Returns
     -------
-    scores : array of size (n_events,)
-    shuffled : array of size (n_shuffles, n_events)
+    scores : array of size (n_bins,)
+    shuffled : array of size (n_shuffles, n_bins)
     """
 
-    if float(n_shuffles).is_integer:
+    if float(n_shuffles).is_integer():
         n_shuffles = int(n_shuffles)
     else:
         raise ValueError("n_shuffles must be an integer!")
 
-    hmm_shuffled = copy.deepcopy(hmm)
     Lbraw = score_hmm_logprob_cumulative(bst=bst,
                                hmm=hmm,
                                normalize=normalize)
 
-    # per event, compute L(:b|raw) - L(:b-1|raw)
-    Lb = copy.copy(Lbraw)
+    # per event, compute L(:b|raw) - L(:b-1|raw); the first bin of every
+    # event is left as is
+    cumLengths = np.insert(np.cumsum(bst.lengths), 0, 0)
+    first_bins = np.zeros(len(Lbraw), dtype=bool)
+    first_bins[cumLengths[:-1]] = True
+    Lprev = np.where(first_bins, 0, np.roll(Lbraw, 1))
 
-    cumLengths = np.cumsum(bst.lengths)
-    cumLengths = np.insert(cumLengths, 0, 0)
+    scores = Lbraw - Lprev
 
-    for ii in range(bst.n_epochs):
-        LE = cumLengths[ii]
-        RE = cumLengths[ii+1]
-        Lb[LE+1:RE] -= Lbraw[LE:RE-1]
+    Lbtmat = _score_transmat_shuffles(bst, hmm, n_shuffles,
+                                      cumulative=True,
+                                      random_state=random_state,
+                                      batchsize=batchsize,
+                                      n_jobs=n_jobs)
+    if normalize:
+        Lbtmat = Lbtmat / (np.arange(len(Lbraw)) - np.repeat(cumLengths[:-1], bst.lengths) + 1)
 
-    n_bins = bst.n_bins
-    shuffled = np.zeros((n_shuffles, n_bins))
-    for ii in range(n_shuffles):
-        hmm_shuffled.transmat_ = shuffle_transmat(hmm_shuffled.transmat_)
-        Lbtmat = score_hmm_logprob_cumulative(bst=bst,
-                               hmm=hmm_shuffled,
-                               normalize=normalize)
+    # per event, compute L(:b|tmat) - L(:b-1|raw)
+    shuffled = Lbtmat - Lprev
 
-        # per event, compute L(:b|tmat) - L(:b-1|raw)
-        NL = copy.copy(Lbtmat)
-        for jj in range(bst.n_epochs):
-            LE = cumLengths[jj]
-            RE = cumLengths[jj+1]
-            NL[LE+1:RE] -= Lbraw[LE:RE-1]
+    return scores, shuffled
 
-        shuffled[ii,:] = NL
+def _run_lengths(mask, lengths):
+    """Length of the run of True values ending at every element of mask,
+    with runs restarting at every event boundary.
 
-    scores = Lb
+    Parameters
+    ----------
+    mask : boolean array of shape (n_bins,)
+        Concatenation of the bins of all events.
+    lengths : array of shape (n_events,)
+        Number of bins in every event.
 
-    return scores, shuffled
+    Returns
+    -------
+    run_lengths : array of shape (n_bins,)
+    """
+    mask = np.asarray(mask, dtype=bool)
+    lengths = np.asarray(lengths, dtype=int)
+    starts = np.insert(np.cumsum(lengths), 0, 0)[:-1][lengths > 0]
+    idx = np.arange(len(mask))
+
+    # index of the last bin that breaks a run: a False bin, or the bin
+    # just before the start of an event
+    breaks = np.where(mask, -1, idx)
+    breaks[starts] = np.maximum(breaks[starts], starts - 1)
+    return idx - np.maximum.accumulate(breaks)
 
 def three_consecutive_bins_above_q(pvals, lengths, q=0.75, n_consecutive=3):
-    cumLengths = np.cumsum(lengths)
-    cumLengths = np.insert(cumLengths, 0, 0)
-
-    above_thresh = 100*(1 - pvals) > q
-    idx = []
-    for ii in range(len(lengths)):
-        LE = cumLengths[ii]
-        RE = cumLengths[ii+1]
-        temp = 0
-        for b in above_thresh[LE:RE]:
-            if b:
-                temp +=1
-            else:
-                temp = 0 # reset
-        if temp >= n_consecutive:
-            idx.append(ii)
+    """Return the indices of the events that end with a run of at least
+    n_consecutive bins above q.
 
-    return np.array(idx)
+    Parameters
+    ----------
+    pvals : array of shape (n_bins,)
+        p-values of all bins of all events, concatenated.
+    lengths : array of shape (n_events,)
+        Number of bins in every event.
+    q : float, optional
+        Percentile threshold, compared to 100*(1 - pvals).
+    n_consecutive : int, optional
+        Minimum run length.
+
+    Returns
+    -------
+    idx : array of shape (n_sig_events,)
+    """
+    lengths = np.asarray(lengths, dtype=int)
+    above_thresh = 100*(1 - np.asarray(pvals)) > q
+    run_lengths = _run_lengths(above_thresh, lengths)
+
+    ends = np.cumsum(lengths) - 1
+    nonempty = lengths > 0
+    sig = np.zeros(len(lengths), dtype=bool)
+    sig[nonempty] = run_lengths[ends[nonempty]] >= n_consecutive
+
+    return np.flatnonzero(sig)
 
-def _scoreOrderD_time_swap(hmm, state_sequences, lengths, n_shuffles=250, normalize=False):
+def _scoreOrderD_time_swap(hmm, state_sequences, lengths, n_shuffles=250, normalize=False, random_state=None):
     """Compute order score of state sequences
 
     A score of 0 means there's only one state.
+
+    The state sequences are concatenated, and the states of all shuffles
+    (permutations within each sequence) are generated and scored at once.
     """
 
-    scoresD = [] # scores with no adjacent duplicates
-    n_sequences = len(state_sequences)
-    shuffled = np.zeros((n_shuffles, n_sequences))
-
-    for seqid in range(n_sequences):
-        logP = np.log(hmm.transmat_)
-        pth = state_sequences[seqid]
-        plen = len(pth)
-        logPseq = 0
-        for ii in range(plen-1):
-            logPseq += logP[pth[ii],pth[ii+1]]
-        score = logPseq - np.log(plen)
-        scoresD.append(score)
-        for nn in range(n_shuffles):
-            logPseq = 0
-            pth = np.random.permutation(pth)
-            for ii in range(plen-1):
-                logPseq += logP[pth[ii],pth[ii+1]]
-            score = logPseq - np.log(plen)
-            shuffled[nn, seqid] = score
-
-    scoresD = np.array(scoresD)
+    states, offsets = scoring._concatenate_sequences(state_sequences)
+    logP = scoring._log_transmat(hmm)
+
+    scoresD = scoring._order_scores(logP, states, offsets)
+    shuffled_states = scoring._time_swap_states(states, offsets, n_shuffles, random_state=random_state)
+    shuffled = scoring._order_scores(logP, shuffled_states, offsets)
 
     if normalize:
         scoresD = scoresD/lengths
@@ -605,9 +889,9 @@ def _scoreOrderD_time_swap(hmm, state_sequences, lengths, n_shuffles=250, normal
 
     return scoresD, shuffled
 
-def score_hmm_order_time_swap(bst, hmm, n_shuffles=250, normalize=False):
+def score_hmm_order_time_swap(bst, hmm, n_shuffles=250, normalize=False, random_state=None):
     lp, paths, centers = hmm.decode(X=bst)
-    scores, shuffled = _scoreOrderD_time_swap(hmm, paths, lengths=bst.lengths, n_shuffles=n_shuffles, normalize=normalize)
+    scores, shuffled = _scoreOrderD_time_swap(hmm, paths, lengths=bst.lengths, n_shuffles=n_shuffles, normalize=normalize, random_state=random_state)
     if normalize:
         scores = scores/bst.lengths
         shuffled = shuffled/bst.lengths
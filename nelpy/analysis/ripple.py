@@ -0,0 +1,257 @@
+"""Sharp-wave ripple (SWR) detection from multi-tetrode LFP."""
+
+__all__ = ['detect_ripples']
+
+import os
+import tempfile
+import time
+import warnings
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .. import auxiliary
+from .. import core
+from ..filtering import ripple_band_filter, _n_workers
+from ..utils import signal_envelope1D, get_events_boundaries
+
+def _share_ydata(ydata, tmpdir):
+    """Return a description of a memmap from which workers can read ydata.
+
+    If ydata is already a (non-view) memmap, the workers simply re-open
+    the underlying file; otherwise ydata is written to a temporary .npy
+    file in tmpdir once, so that it is not pickled for every tetrode.
+    """
+    if isinstance(ydata, np.memmap) and ydata.filename is not None \
+            and not isinstance(ydata.base, np.ndarray) \
+            and (ydata.flags.c_contiguous or ydata.flags.f_contiguous):
+        order = 'C' if ydata.flags.c_contiguous else 'F'
+        return (ydata.filename, ydata.dtype.str, ydata.shape, ydata.offset, order)
+
+    filename = os.path.join(tmpdir, 'ydata.npy')
+    shared = np.lib.format.open_memmap(filename, mode='w+',
+                                       dtype=ydata.dtype, shape=ydata.shape)
+    shared[:] = ydata
+    shared.flush()
+    return (filename, ydata.dtype.str, ydata.shape, shared.offset, 'C')
+
+def _open_ydata(source):
+    """Inverse of _share_ydata(); also passes plain arrays through."""
+    if isinstance(source, np.ndarray):
+        return source
+    filename, dtype, shape, offset, order = source
+    return np.memmap(filename, dtype=dtype, mode='r', shape=shape,
+                     offset=offset, order=order)
+
+def _detect_tetrode_ripples(source, channels, fs, filter_kwargs,
+                            envelope_kwargs, event_kwargs):
+    """Run filter -> envelope -> z-score -> event detection for one
+    tetrode, and return the event bounds (sample indices), peak indices,
+    peak amplitudes (in SDs) and the time spent in each stage."""
+
+    timings = OrderedDict()
+
+    t0 = time.perf_counter()
+    ydata = _open_ydata(source)
+    data = np.asarray(ydata[channels,:], dtype=float)
+    timings['load'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    filtered = ripple_band_filter(data, fs=fs, **filter_kwargs)
+    timings['filter'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    envelope = np.mean([signal_envelope1D(channel, fs=fs, **envelope_kwargs)
+                        for channel in filtered], axis=0)
+    timings['envelope'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    zscored = (envelope - envelope.mean()) / envelope.std()
+    timings['zscore'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        bounds, _, _ = get_events_boundaries(zscored, ds=1/fs, **event_kwargs)
+    bounds = np.array(bounds, dtype=int).reshape(-1, 2)
+    peaks = np.array([start + np.argmax(zscored[start:stop+1])
+                      for start, stop in bounds], dtype=int)
+    amplitudes = zscored[peaks]
+    timings['detect'] = time.perf_counter() - t0
+
+    return bounds, peaks, amplitudes, timings
+
+def detect_ripples(lfp, *, tetrodes=None, fs=None, lowcut=None,
+                   highcut=None, numtaps=None, sigma=None,
+                   PrimaryThreshold=None, SecondaryThreshold=None,
+                   minThresholdLength=None, minLength=None,
+                   maxLength=None, n_jobs=None, verbose=False):
+    """Detect sharp-wave ripples on multiple tetrodes, and merge them.
+
+    For each tetrode, the LFP is ripple band filtered, the Hilbert
+    envelopes of its channels are smoothed and averaged, the envelope is
+    z-scored, and events are detected with get_events_boundaries().
+    Tetrodes are processed in a process pool; the input is shared with
+    the workers through a memmap (an existing memmap is re-used, and any
+    other data is written to a temporary file once). The per-tetrode
+    events are then merged with EpochArray set algebra (union).
+
+    Parameters
+    ----------
+    lfp : AnalogSignalArray
+        LFP with one signal per channel.
+    tetrodes : list of lists, optional
+        Signal (row) indices of the channels belonging to each tetrode.
+        Default is to treat every channel as a separate tetrode.
+    fs : float, optional
+        Sampling frequency (Hz). Default is lfp.fs.
+    lowcut, highcut : float, optional
+        Ripple band (default 150--250 Hz). See ripple_band_filter().
+    numtaps : int, optional
+        Number of filter taps. Default is determined automatically.
+    sigma : float, optional
+        Standard deviation (in seconds) of the Gaussian kernel used to
+        smooth the envelope. Default is 0.004 (4 ms).
+    PrimaryThreshold : float, optional
+        Threshold (in SDs) that must be reached during an event.
+        Default is 3.
+    SecondaryThreshold : float, optional
+        Threshold (in SDs) that defines the event boundaries. Default is 0.
+    minThresholdLength : float, optional
+        Minimum time (in seconds) above PrimaryThreshold. Default is
+        0.015 (15 ms).
+    minLength : float, optional
+        Minimum event duration (in seconds). Default is None.
+    maxLength : float, optional
+        Maximum event duration (in seconds). Default is 0.5 (500 ms).
+    n_jobs : int, optional
+        Number of processes. Default is None (serial); -1 uses all
+        available cores.
+    verbose : bool, optional
+        If True, print the time spent in each stage.
+
+    Returns
+    -------
+    results : ResultsContainer
+        With attributes
+            epochs : EpochArray
+                Merged ripple epochs.
+            peak_times : array of shape (n_epochs,)
+                Time of the largest envelope peak during each epoch.
+            peak_amplitudes : array of shape (n_epochs,)
+                Amplitude (in SDs) of that peak.
+            peak_tetrodes : array of shape (n_epochs,)
+                Tetrode on which that peak was observed.
+            tetrode_epochs : list of EpochArrays
+                Ripple epochs detected on each tetrode.
+            timings : OrderedDict
+                Wall time (in seconds) of each stage, summed across
+                tetrodes, as well as the total wall time.
+    """
+
+    if not isinstance(lfp, core.AnalogSignalArray):
+        raise TypeError("lfp must be an AnalogSignalArray!")
+    if fs is None:
+        fs = lfp.fs
+    if fs is None:
+        raise ValueError("fs must either be specified, or must be contained in lfp!")
+    if tetrodes is None:
+        tetrodes = [[ii] for ii in range(lfp.n_signals)]
+    tetrodes = [list(np.atleast_1d(channels)) for channels in tetrodes]
+
+    if sigma is None:
+        sigma = 0.004 # 4 ms standard deviation
+    if PrimaryThreshold is None:
+        PrimaryThreshold = 3
+    if SecondaryThreshold is None:
+        SecondaryThreshold = 0
+    if minThresholdLength is None:
+        minThresholdLength = 0.015 # 15 ms above PrimaryThreshold
+    if maxLength is None:
+        maxLength = 0.5 # 500 ms maximum event duration
+
+    filter_kwargs = {'lowcut' : lowcut,
+                     'highcut' : highcut,
+                     'numtaps' : numtaps}
+    envelope_kwargs = {'sigma' : sigma}
+    event_kwargs = {'PrimaryThreshold' : PrimaryThreshold,
+                    'SecondaryThreshold' : SecondaryThreshold,
+                    'minThresholdLength' : minThresholdLength,
+                    'minLength' : minLength,
+                    'maxLength' : maxLength}
+
+    timings = OrderedDict()
+    t_start = time.perf_counter()
+    n_workers = min(_n_workers(n_jobs), len(tetrodes))
+
+    if n_workers == 1:
+        results = [_detect_tetrode_ripples(lfp.ydata, channels, fs,
+                                           filter_kwargs, envelope_kwargs,
+                                           event_kwargs)
+                   for channels in tetrodes]
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            t0 = time.perf_counter()
+            source = _share_ydata(lfp.ydata, tmpdir)
+            timings['share'] = time.perf_counter() - t0
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(_detect_tetrode_ripples, source,
+                                           channels, fs, filter_kwargs,
+                                           envelope_kwargs, event_kwargs)
+                           for channels in tetrodes]
+                results = [future.result() for future in futures]
+
+    for _, _, _, tetrode_timings in results:
+        for stage, elapsed in tetrode_timings.items():
+            timings[stage] = timings.get(stage, 0) + elapsed
+
+    # merge events across tetrodes; stops are extended by 1/fs to obtain
+    # half-open intervals:
+    t0 = time.perf_counter()
+    tetrode_epochs = []
+    for bounds, _, _, _ in results:
+        if len(bounds) == 0:
+            tetrode_epochs.append(core.EpochArray(empty=True))
+            continue
+        epoch_times = lfp.time[bounds]
+        epoch_times[:,1] += 1/fs
+        tetrode_epochs.append(core.EpochArray(epoch_times))
+
+    epochs = core.EpochArray(empty=True)
+    for tetrode_epoch in tetrode_epochs:
+        if not tetrode_epoch.isempty:
+            epochs = epochs | tetrode_epoch
+
+    peak_times = np.array([])
+    peak_amplitudes = np.array([])
+    peak_tetrodes = np.array([], dtype=int)
+    if not epochs.isempty:
+        all_peaks = np.concatenate([peaks for _, peaks, _, _ in results])
+        all_amplitudes = np.concatenate([amplitudes for _, _, amplitudes, _ in results])
+        all_tetrodes = np.concatenate([np.full(len(peaks), tt, dtype=int)
+                                       for tt, (_, peaks, _, _) in enumerate(results)])
+        all_times = lfp.time[all_peaks]
+        # assign every tetrode peak to its merged epoch, and keep the
+        # largest peak per epoch:
+        epoch_idx = np.searchsorted(epochs.starts, all_times, side='right') - 1
+        order = np.lexsort((-all_amplitudes, epoch_idx))
+        first = np.insert(np.diff(epoch_idx[order]) != 0, 0, True)
+        best = order[first]
+        peak_times = all_times[best]
+        peak_amplitudes = all_amplitudes[best]
+        peak_tetrodes = all_tetrodes[best]
+    timings['merge'] = time.perf_counter() - t0
+    timings['total'] = time.perf_counter() - t_start
+
+    if verbose:
+        for stage, elapsed in timings.items():
+            print("{:>10s}: {:.3f} s".format(stage, elapsed))
+
+    return auxiliary.ResultsContainer(epochs=epochs,
+                                      peak_times=peak_times,
+                                      peak_amplitudes=peak_amplitudes,
+                                      peak_tetrodes=peak_tetrodes,
+                                      tetrode_epochs=tetrode_epochs,
+                                      timings=timings,
+                                      description="ripple detection")
@@ -1,4 +1,5 @@
-__all__ = ['TuningCurve1D', 'TuningCurve2D', 'DirectionalTuningCurve1D']
+__all__ = ['TuningCurve1D', 'TuningCurve2D', 'DirectionalTuningCurve1D',
+           'TuningCurveND', 'TuningCurveAccumulator']
 
 import copy
 import numpy as np
@@ -27,6 +28,88 @@ warnings.formatwarning = lambda message, category, filename, lineno, \
     line=None: formatwarning_orig(
         message, category, filename, lineno, line='')
 
+def _accumulate_by_bin(data, bin_idx, n_bins):
+    """Sum the columns of data that fall into each external bin.
+
+    Counts are accumulated with one np.bincount per unit (in time order,
+    so that the result is identical to summing bin by bin) instead of a
+    Python loop over time bins.
+
+    Parameters
+    ----------
+    data : array of shape (n_units, n_samples)
+    bin_idx : array of shape (n_samples,)
+        Zero-based (flattened) bin index of every sample.
+    n_bins : int
+
+    Returns
+    -------
+    out : array of shape (n_units, n_bins)
+    """
+    bin_idx = np.asarray(bin_idx).ravel()
+    data = np.atleast_2d(data)
+    out = np.empty((data.shape[0], n_bins))
+    for uu, counts in enumerate(data):
+        out[uu] = np.bincount(bin_idx, weights=counts, minlength=n_bins)
+    return out
+
+_EXT_CACHE_SIZE = 8 # maximum number of externs, and of entries per extern
+
+def _is_pointwise(trans_func):
+    """True for the default transform functions of the tuning curves in
+    this module, which interpolate extern pointwise (at every time in
+    'at' independently)."""
+    func = getattr(trans_func, '__func__', trans_func)
+    return getattr(func, '__name__', None) == '_trans_func' \
+        and getattr(func, '__module__', None) == __name__
+
+def _interp_extern(trans_func, extern, at, ext_cache=None):
+    """Return trans_func(extern, at=at), re-using cached interpolations.
+
+    ext_cache is a dict that can be shared between tuning curves built
+    from the same extern. Entries computed at the same 'at' are re-used
+    for any transform function. The default transform functions are
+    pointwise, so their entries computed at a superset of 'at' (e.g., at
+    the bin centers of a combined BinnedSpikeTrainArray) are also re-used
+    by indexing into them; user-supplied transform functions are not
+    assumed to be pointwise. The cache keeps the most recently used
+    _EXT_CACHE_SIZE externs, with at most _EXT_CACHE_SIZE entries each.
+    """
+    if ext_cache is None:
+        return trans_func(extern, at=at)
+
+    at = np.asanyarray(at)
+    func = getattr(trans_func, '__func__', trans_func)
+    pointwise = _is_pointwise(trans_func)
+
+    # least recently used externs are evicted first:
+    key = (id(extern), func)
+    entries = ext_cache.pop(key, [])
+    ext_cache[key] = entries
+    while len(ext_cache) > _EXT_CACHE_SIZE:
+        del ext_cache[next(iter(ext_cache))]
+
+    for ii, (cached_extern, cached_at, cached_ext) in enumerate(entries):
+        if cached_extern is not extern or len(cached_at) == 0:
+            continue
+        if not pointwise:
+            if len(cached_at) == len(at) and np.array_equal(cached_at, at):
+                entries.append(entries.pop(ii))
+                return cached_ext
+            continue
+        idx = np.searchsorted(cached_at, at)
+        if np.all(idx < len(cached_at)) and np.array_equal(cached_at[idx], at):
+            entries.append(entries.pop(ii))
+            if isinstance(cached_ext, tuple):
+                return tuple(np.asanyarray(ext)[..., idx] for ext in cached_ext)
+            return np.asanyarray(cached_ext)[..., idx]
+
+    ext = trans_func(extern, at=at)
+    entries.append((extern, at, ext))
+    if len(entries) > _EXT_CACHE_SIZE:
+        del entries[0]
+    return ext
+
 
 ########################################################################
 # class TuningCurve2D
@@ -48,7 +131,7 @@ class TuningCurve2D:
                  bw=None, ext_nx=None, ext_ny, transform_func=None,
                  minbgrate=None, ext_xmin=0, ext_ymin=0, ext_xmax=1, ext_ymax=1,
                  extlabels=None, unit_ids=None, unit_labels=None, unit_tags=None,
-                 label=None, empty=False):
+                 label=None, empty=False, ext_cache=None):
         """
 
         If sigma is nonzero, then smoothing is applied.
@@ -59,6 +142,13 @@ class TuningCurve2D:
             (3) n_extern, x_min, x_max, transform_func*
 
             transform_func operates on extern and returns a value that TuninCurve1D can interpret. If no transform is specified, the identity operator is assumed.
+
+        ext_cache is an optional dict in which the interpolated extern is
+        cached, so that it is computed only once for occupancy and
+        ratemap. Pass the same dict to tuning curves built from the same
+        extern to share interpolations between them. The results of a
+        user-supplied transform_func are only re-used at identical bin
+        centers, since it need not be pointwise.
         """
         # TODO: input validation
         if not empty:
@@ -117,6 +207,12 @@ class TuningCurve2D:
 
         if transform_func is None:
             self.trans_func = self._trans_func
+        else:
+            self.trans_func = transform_func
+
+        if ext_cache is None:
+            ext_cache = {}
+        self._ext_cache = ext_cache
 
         # compute occupancy
         self._occupancy = self._compute_occupancy()
@@ -139,6 +235,7 @@ class TuningCurve2D:
         """Detach bst and extern from tuning curve."""
         self._bst = None
         self._extern = None
+        self._ext_cache = None
 
     @property
     def n_bins(self):
@@ -181,9 +278,16 @@ class TuningCurve2D:
 
         return x, y
 
+    def _interp_extern(self):
+        """Interpolated extern at the bin centers of bst, computed at most
+        once per (extern, bin_centers) pair; see ext_cache."""
+        return _interp_extern(self.trans_func, self._extern,
+                              self._bst.bin_centers,
+                              getattr(self, '_ext_cache', None))
+
     def _compute_occupancy(self):
 
-        x, y = self.trans_func(self._extern, at=self._bst.bin_centers)
+        x, y = self._interp_extern()
 
         xmin = self.xbins[0]
         xmax = self.xbins[-1]
@@ -196,7 +300,7 @@ class TuningCurve2D:
 
     def _compute_ratemap(self):
 
-        x, y = self.trans_func(self._extern, at=self._bst.bin_centers)
+        x, y = self._interp_extern()
 
         ext_bin_idx_x = np.digitize(x, self.xbins, True)
         ext_bin_idx_y = np.digitize(y, self.ybins, True)
@@ -212,10 +316,10 @@ class TuningCurve2D:
         if ext_bin_idx_y.min() == 0:
             raise ValueError("ext values less than 'ext_ymin'")
 
-        ratemap = np.zeros((self.n_units, self.n_xbins, self.n_ybins))
-
-        for tt, (bidxx, bidxy) in enumerate(zip(ext_bin_idx_x, ext_bin_idx_y)):
-            ratemap[:,bidxx-1, bidxy-1] += self._bst.data[:,tt]
+        # flattened (row-major) index into the (n_xbins, n_ybins) grid:
+        ext_bin_idx = (ext_bin_idx_x - 1)*self.n_ybins + (ext_bin_idx_y - 1)
+        ratemap = _accumulate_by_bin(self._bst.data, ext_bin_idx, self.n_bins)
+        ratemap = ratemap.reshape(self.n_units, self.n_xbins, self.n_ybins)
 
         return ratemap / self._bst.ds
 
@@ -446,7 +550,7 @@ class TuningCurve1D:
 
     __attributes__ = ["_ratemap", "_occupancy",  "_unit_ids", "_unit_labels", "_unit_tags", "_label"]
 
-    def __init__(self, *, bst=None, extern=None, ratemap=None, sigma=None, bw=None, n_extern=None, transform_func=None, minbgrate=None, extmin=0, extmax=1, extlabels=None, unit_ids=None, unit_labels=None, unit_tags=None, label=None, empty=False):
+    def __init__(self, *, bst=None, extern=None, ratemap=None, sigma=None, bw=None, n_extern=None, transform_func=None, minbgrate=None, extmin=0, extmax=1, extlabels=None, unit_ids=None, unit_labels=None, unit_tags=None, label=None, empty=False, ext_cache=None):
         """
 
         If sigma is nonzero, then smoothing is applied.
@@ -457,6 +561,13 @@ class TuningCurve1D:
             (3) n_extern, x_min, x_max, transform_func*
 
             transform_func operates on extern and returns a value that TuninCurve1D can interpret. If no transform is specified, the identity operator is assumed.
+
+        ext_cache is an optional dict in which the interpolated extern is
+        cached, so that it is computed only once for occupancy and
+        ratemap. Pass the same dict to tuning curves built from the same
+        extern to share interpolations between them. The results of a
+        user-supplied transform_func are only re-used at identical bin
+        centers, since it need not be pointwise.
         """
         # TODO: input validation
         if not empty:
@@ -507,6 +618,12 @@ class TuningCurve1D:
 
         if transform_func is None:
             self.trans_func = self._trans_func
+        else:
+            self.trans_func = transform_func
+
+        if ext_cache is None:
+            ext_cache = {}
+        self._ext_cache = ext_cache
 
         # compute occupancy
         self._occupancy = self._compute_occupancy()
@@ -764,9 +881,16 @@ class TuningCurve1D:
 
         return ext
 
+    def _interp_extern(self):
+        """Interpolated extern at the bin centers of bst, computed at most
+        once per (extern, bin_centers) pair; see ext_cache."""
+        return _interp_extern(self.trans_func, self._extern,
+                              self._bst.bin_centers,
+                              getattr(self, '_ext_cache', None))
+
     def _compute_occupancy(self):
 
-        ext = self.trans_func(self._extern, at=self._bst.bin_centers)
+        ext = self._interp_extern()
 
         xmin = self.bins[0]
         xmax = self.bins[-1]
@@ -776,7 +900,7 @@ class TuningCurve1D:
 
     def _compute_ratemap(self):
 
-        ext = self.trans_func(self._extern, at=self._bst.bin_centers)
+        ext = self._interp_extern()
 
         ext_bin_idx = np.digitize(ext, self.bins, True)
         # make sure that all the events fit between extmin and extmax:
@@ -786,10 +910,7 @@ class TuningCurve1D:
         if ext_bin_idx.min() == 0:
             raise ValueError("ext values less than 'ext_min'")
 
-        ratemap = np.zeros((self.n_units, self.n_bins))
-
-        for tt, bidx in enumerate(ext_bin_idx):
-            ratemap[:,bidx-1] += self._bst.data[:,tt]
+        ratemap = _accumulate_by_bin(self._bst.data, ext_bin_idx - 1, self.n_bins)
 
         return ratemap / self._bst.ds
 
@@ -1134,6 +1255,7 @@ class TuningCurve1D:
         """Detach bst and extern from tuning curve."""
         self._bst = None
         self._extern = None
+        self._ext_cache = None
 
 #----------------------------------------------------------------------#
 #======================================================================#
@@ -1196,7 +1318,7 @@ class DirectionalTuningCurve1D(TuningCurve1D):
     __attributes__.extend(TuningCurve1D.__attributes__)
 
     def __init__(self, *, bst_l2r, bst_r2l, bst_combined, extern, sigma=None, bw=None, n_extern=None, transform_func=None, minbgrate=None, extmin=0, extmax=1, extlabels=None, unit_ids=None, unit_labels=None, unit_tags=None, label=None, empty=False,
-    min_peakfiringrate=None, max_avgfiringrate=None, unimodal=False):
+    min_peakfiringrate=None, max_avgfiringrate=None, unimodal=False, ext_cache=None):
         """
 
         If sigma is nonzero, then smoothing is applied.
@@ -1207,6 +1329,13 @@ class DirectionalTuningCurve1D(TuningCurve1D):
             (3) n_extern, x_min, x_max, transform_func*
 
             transform_func operates on extern and returns a value that TuninCurve1D can interpret. If no transform is specified, the identity operator is assumed.
+
+        ext_cache is an optional dict in which the interpolated extern is
+        cached, so that it is computed only once for occupancy and
+        ratemap. Pass the same dict to tuning curves built from the same
+        extern to share interpolations between them. The results of a
+        user-supplied transform_func are only re-used at identical bin
+        centers, since it need not be pointwise.
         """
         # TODO: input validation
 
@@ -1246,6 +1375,19 @@ class DirectionalTuningCurve1D(TuningCurve1D):
 
         if transform_func is None:
             self.trans_func = self._trans_func
+        else:
+            self.trans_func = transform_func
+
+        if ext_cache is None:
+            ext_cache = {}
+        self._ext_cache = ext_cache
+
+        # interpolate extern once, at the bin centers of all three bsts;
+        # the directional and combined tuning curves index into it:
+        if _is_pointwise(self.trans_func):
+            all_bin_centers = np.unique(np.concatenate(
+                [bst.bin_centers for bst in (bst_l2r, bst_r2l, bst_combined)]))
+            _interp_extern(self.trans_func, extern, all_bin_centers, self._ext_cache)
 
         # left to right:
         self._bst = bst_l2r
@@ -1341,4 +1483,580 @@ class DirectionalTuningCurve1D(TuningCurve1D):
 
     @property
     def unit_ids_r2l(self):
-        return self._unit_ids_r2l
\ No newline at end of file
+        return self._unit_ids_r2l
+#----------------------------------------------------------------------#
+#======================================================================#
+
+class TuningCurveAccumulator:
+    """Incrementally accumulated tuning curves (1- or 2-dimensional).
+
+    Running occupancy and spike count accumulators are updated with each
+    new batch of binned spikes and external correlates, so that tuning
+    curves can be updated as a session progresses (e.g., for closed-loop
+    decoding) in O(batch) time per update, and a TuningCurve1D or
+    TuningCurve2D snapshot can be taken at any time in O(n_units*n_bins).
+
+    For the same data, a snapshot is identical to the tuning curve built
+    from the complete BinnedSpikeTrainArray, except that samples whose
+    external correlate falls outside of the bins (or is NaN) are ignored
+    instead of raising an error.
+
+    Parameters
+    ----------
+    n_extern : int, optional
+        Number of bins for 1D tuning curves.
+    extmin, extmax : float, optional
+        Range of the 1D bins. Default is [0, 1].
+    ext_nx, ext_ny : int, optional
+        Number of x and y bins for 2D tuning curves.
+    ext_xmin, ext_xmax, ext_ymin, ext_ymax : float, optional
+        Range of the 2D bins. Default is [0, 1] x [0, 1].
+    transform_func : callable, optional
+        Function mapping (extern, at) onto the external correlate, as
+        for TuningCurve1D/2D. Only used when extern is passed to update().
+    sigma, bw, minbgrate :
+        Default smoothing and minimum background firing rate of
+        snapshots, as for TuningCurve1D/2D.
+
+    Attributes
+    ----------
+    occupancy : array of shape (n_bins,) or (n_xbins, n_ybins)
+        Number of time bins spent in each external bin.
+    counts : array of shape (n_units, n_bins) or (n_units, n_xbins, n_ybins)
+        Spike counts in each external bin.
+    n_samples : int
+        Number of time bins accumulated so far.
+    n_dropped : int
+        Number of time bins whose external correlate fell outside of the
+        bins (or was NaN).
+    """
+
+    def __init__(self, *, n_extern=None, extmin=0, extmax=1, ext_nx=None,
+                 ext_ny=None, ext_xmin=0, ext_xmax=1, ext_ymin=0, ext_ymax=1,
+                 transform_func=None, sigma=None, bw=None, minbgrate=None,
+                 label=None):
+
+        if ext_nx is not None or ext_ny is not None:
+            if n_extern is not None:
+                raise ValueError("either n_extern (1D) or ext_nx and ext_ny (2D) must be specified, but not both!")
+            if ext_nx is None or ext_ny is None:
+                raise ValueError("both ext_nx and ext_ny must be specified!")
+            self._bins = (np.linspace(ext_xmin, ext_xmax, ext_nx+1),
+                          np.linspace(ext_ymin, ext_ymax, ext_ny+1))
+        elif n_extern is not None:
+            self._bins = (np.linspace(extmin, extmax, n_extern+1),)
+        else:
+            raise ValueError("n_extern (1D) or ext_nx and ext_ny (2D) must be specified!")
+
+        if transform_func is None:
+            if self.is2d:
+                transform_func = TuningCurve2D._trans_func
+            else:
+                transform_func = TuningCurve1D._trans_func
+            # the default transform functions do not use self:
+            self.trans_func = lambda extern, at: transform_func(None, extern, at)
+        else:
+            self.trans_func = transform_func
+
+        if minbgrate is None:
+            minbgrate = 0.01 # Hz minimum background firing rate
+
+        self._sigma = sigma
+        self._bw = bw
+        self._minbgrate = minbgrate
+        self._label = label
+        self.reset()
+
+    def reset(self):
+        """Discard all accumulated data."""
+        self._occupancy = np.zeros(tuple(len(bins) - 1 for bins in self._bins))
+        self._counts = None
+        self._ds = None
+        self._unit_ids = None
+        self._unit_labels = None
+        self._unit_tags = None
+        self.n_samples = 0
+        self.n_dropped = 0
+
+    @property
+    def is2d(self):
+        return len(self._bins) == 2
+
+    @property
+    def shape(self):
+        """(tuple) The shape of the accumulated ratemap."""
+        n_units = 0 if self._counts is None else self._counts.shape[0]
+        return (n_units,) + tuple(len(bins) - 1 for bins in self._bins)
+
+    @property
+    def n_units(self):
+        """(int) The number of units."""
+        return self.shape[0]
+
+    @property
+    def occupancy(self):
+        return self._occupancy
+
+    @property
+    def counts(self):
+        return self._counts
+
+    def update(self, bst=None, extern=None, *, counts=None, ext=None, ds=None):
+        """Accumulate a new batch of binned spikes and external correlates.
+
+        Either bst and extern, or counts, ext and ds must be specified.
+
+        Parameters
+        ----------
+        bst : BinnedSpikeTrainArray, optional
+            Binned spikes of the new batch.
+        extern : AnalogSignalArray, optional
+            External correlate, which is evaluated at bst.bin_centers.
+        counts : array of shape (n_units, n_samples), optional
+            Spike counts of the new batch.
+        ext : array of shape (n_samples,) or (2, n_samples), optional
+            External correlate at each of the n_samples time bins.
+        ds : float, optional
+            Bin width (in seconds) of counts.
+
+        Returns
+        -------
+        self : TuningCurveAccumulator
+        """
+        if bst is not None:
+            if counts is not None or ext is not None:
+                raise ValueError("bst and counts cannot both be specified!")
+            if extern is None:
+                raise ValueError("extern must be specified with bst!")
+            if bst.isempty:
+                return self
+            counts = bst.data
+            ext = self.trans_func(extern, at=bst.bin_centers)
+            ds = bst.ds
+            unit_ids, unit_labels, unit_tags = bst.unit_ids, bst.unit_labels, bst.unit_tags
+        else:
+            if counts is None or ext is None or ds is None:
+                raise ValueError("either bst and extern, or counts, ext and ds must be specified!")
+            counts = np.atleast_2d(counts)
+            unit_ids = list(range(1, counts.shape[0] + 1))
+            unit_labels = unit_tags = None
+
+        if self.is2d:
+            x, y = ext
+            x, y = np.ravel(x), np.ravel(y)
+        else:
+            x = np.ravel(ext)
+
+        if counts.shape[1] != len(x):
+            raise ValueError("counts and ext must have the same number of samples!")
+
+        if self._counts is None:
+            self._counts = np.zeros((counts.shape[0],) + self._occupancy.shape)
+            self._ds = ds
+            self._unit_ids = list(unit_ids)
+            self._unit_labels = unit_labels
+            self._unit_tags = unit_tags
+        else:
+            if not np.isclose(ds, self._ds):
+                raise ValueError("bin width of new batch ({}) differs from that accumulated so far ({})!".format(ds, self._ds))
+            if counts.shape[0] != self.n_units:
+                raise ValueError("number of units of new batch ({}) differs from that accumulated so far ({})!".format(counts.shape[0], self.n_units))
+
+        # occupancy uses the same (histogram) bins as TuningCurve1D/2D:
+        if self.is2d:
+            occupancy, _, _ = np.histogram2d(x, y, bins=self._bins)
+        else:
+            occupancy, _ = np.histogram(x, bins=self._bins[0])
+        self._occupancy += occupancy
+
+        # ...and so do the spike counts (right-closed bins):
+        bin_idx = np.digitize(x, self._bins[0], True) - 1
+        valid = (bin_idx >= 0) & (bin_idx < len(self._bins[0]) - 1)
+        if self.is2d:
+            ybin_idx = np.digitize(y, self._bins[1], True) - 1
+            valid &= (ybin_idx >= 0) & (ybin_idx < len(self._bins[1]) - 1)
+            bin_idx = bin_idx*(len(self._bins[1]) - 1) + ybin_idx
+
+        n_bins = self._occupancy.size
+        self._counts += _accumulate_by_bin(counts[:, valid], bin_idx[valid],
+                                           n_bins).reshape(self._counts.shape)
+        self.n_samples += len(x)
+        self.n_dropped += int(np.count_nonzero(~valid))
+
+        return self
+
+    def snapshot(self, *, sigma=None, bw=None, minbgrate=None):
+        """Return the tuning curves accumulated so far.
+
+        Parameters
+        ----------
+        sigma, bw, minbgrate : optional
+            Override the smoothing and minimum background firing rate
+            specified at construction.
+
+        Returns
+        -------
+        tuningcurve : TuningCurve1D or TuningCurve2D
+        """
+        if sigma is None:
+            sigma = self._sigma
+        if bw is None:
+            bw = self._bw
+        if minbgrate is None:
+            minbgrate = self._minbgrate
+
+        if self.is2d:
+            out = TuningCurve2D(empty=True, ext_ny=None)
+            out._xbins, out._ybins = self._bins
+        else:
+            out = TuningCurve1D(empty=True)
+            out._bins = self._bins[0]
+
+        if self._counts is None:
+            return out
+
+        out._unit_ids = list(self._unit_ids)
+        out._unit_labels = self._unit_labels
+        out._unit_tags = self._unit_tags
+        out._label = self._label
+        out._occupancy = self._occupancy.copy()
+
+        denom = self._occupancy.copy()
+        denom[denom==0] = 1
+        out._ratemap = self._counts / self._ds / denom
+        out._ratemap[out._ratemap < minbgrate] = minbgrate
+
+        if sigma is not None:
+            if sigma > 0:
+                out.smooth(sigma=sigma, bw=bw, inplace=True)
+
+        return out
+
+#----------------------------------------------------------------------#
+#======================================================================#
+
+def _sparse_gaussian_pass(keys, values, shape, axis, sigma, bw):
+    """Smooth values, defined at flat indices keys of a grid with the
+    given shape, with a 1D Gaussian along axis (zero outside of keys).
+
+    Returns the (sorted) flat indices of the support of the result, which
+    grows by the kernel radius along axis, and the smoothed values there.
+    """
+    radius = int(bw*sigma + 0.5)
+    offsets = np.arange(-radius, radius+1)
+    weights = np.exp(-0.5*(offsets/sigma)**2)
+    weights /= weights.sum()
+
+    coords = np.array(np.unravel_index(keys, shape))
+    shifted = coords[axis][np.newaxis, :] + offsets[:, np.newaxis] # (n_offsets, n_keys)
+    valid = (shifted >= 0) & (shifted < shape[axis])
+
+    new_coords = np.repeat(coords[:, np.newaxis, :], len(offsets), axis=1)
+    new_coords[axis] = shifted
+    new_keys = np.ravel_multi_index(tuple(c[valid] for c in new_coords), shape)
+
+    support, inverse = np.unique(new_keys, return_inverse=True)
+    weighted = (values[:, np.newaxis, :] * weights[:, np.newaxis])[:, valid]
+    return support, _accumulate_by_bin(weighted, inverse, len(support))
+
+class TuningCurveND:
+    """Tuning curves (N-dimensional) of multiple units, over the occupied
+    bins only.
+
+    Only bins that were occupied are stored: their flat (row-major)
+    indices into the full grid, their occupancy, and a ratemap of shape
+    (n_units, n_occupied). This keeps tuning curves over, e.g., position
+    x head direction x speed compact when most of the joint space is never
+    visited. Spike counts are accumulated with a single pass over
+    flattened multi-indices.
+
+    Samples are binned as with np.histogramdd, i.e., bins are closed on
+    the left, except for the last bin along each dimension.
+
+    Parameters
+    ----------
+    bst : BinnedSpikeTrainArray
+    extern : AnalogSignalArray
+        External correlates, with one signal per dimension.
+    bins : list of arrays, optional
+        Bin edges along each dimension.
+    n_extern : sequence of int, optional
+        Number of bins along each dimension, if bins is not specified.
+    extmin, extmax : sequence of float, optional
+        Range along each dimension, if bins is not specified. Default is
+        [0, 1] for every dimension.
+    transform_func : callable, optional
+        Function mapping (extern, at) onto an array of shape (n_dims,
+        n_samples). Default evaluates extern at the bin centers of bst.
+    sigma : float or sequence of float, optional
+        Standard deviation (in units of extern) of the Gaussian smoothing
+        kernel, for all or for each dimension. See smooth().
+    bw : float, optional
+        Kernel bandwidth, in standard deviations. Default is 4.
+    minbgrate : float, optional
+        Minimum background firing rate (Hz). Default is 0.01.
+    ext_cache : dict, optional
+        Cache of interpolated externs; see TuningCurve1D.
+
+    Attributes
+    ----------
+    occupied : array of shape (n_occupied,)
+        Flat indices of the occupied bins into the full grid.
+    occupancy : array of shape (n_occupied,)
+        Number of time bins spent in each occupied bin.
+    ratemap : array of shape (n_units, n_occupied)
+        Firing rates (Hz) in each occupied bin.
+    """
+
+    __attributes__ = ["_ratemap", "_occupancy", "_occupied", "_bins",
+                      "_unit_ids", "_unit_labels", "_unit_tags", "_label"]
+
+    def __init__(self, *, bst=None, extern=None, bins=None, n_extern=None,
+                 extmin=None, extmax=None, transform_func=None, sigma=None,
+                 bw=None, minbgrate=None, unit_ids=None, unit_labels=None,
+                 unit_tags=None, label=None, empty=False, ext_cache=None):
+
+        # if an empty object is requested, return it:
+        if empty:
+            for attr in self.__attributes__:
+                exec("self." + attr + " = None")
+            return
+
+        assert bst is not None, "bst must be specified!"
+        assert extern is not None, "extern must be specified!"
+
+        if minbgrate is None:
+            minbgrate = 0.01 # Hz minimum background firing rate
+
+        if bins is None:
+            if n_extern is None:
+                raise ValueError("either bins or n_extern must be specified!")
+            n_extern = np.atleast_1d(n_extern)
+            n_dims = len(n_extern)
+            if extmin is None:
+                extmin = np.zeros(n_dims)
+            if extmax is None:
+                extmax = np.ones(n_dims)
+            extmin = np.broadcast_to(extmin, (n_dims,))
+            extmax = np.broadcast_to(extmax, (n_dims,))
+            bins = [np.linspace(lo, hi, int(nn)+1)
+                    for lo, hi, nn in zip(extmin, extmax, n_extern)]
+        self._bins = [np.asarray(edges, dtype=float) for edges in bins]
+
+        self._unit_ids = bst.unit_ids
+        self._unit_labels = bst.unit_labels
+        self._unit_tags = bst.unit_tags  # no input validation yet
+        self.label = label
+
+        if transform_func is None:
+            self.trans_func = self._trans_func
+        else:
+            self.trans_func = transform_func
+
+        ext = _interp_extern(self.trans_func, extern, bst.bin_centers, ext_cache)
+        ext = np.atleast_2d(ext)
+        if ext.shape[0] != self.n_dims:
+            raise ValueError("extern has {} dimensions, but bins were specified for {}!".format(ext.shape[0], self.n_dims))
+
+        flat_idx = self._flat_index(ext)
+
+        # occupancy and spike counts of the occupied bins only:
+        self._occupied, inverse, occupancy = np.unique(flat_idx,
+                                                       return_inverse=True,
+                                                       return_counts=True)
+        self._occupancy = occupancy
+        counts = _accumulate_by_bin(bst.data, inverse, len(self._occupied))
+
+        self._ratemap = counts / bst.ds / occupancy
+        self._ratemap[self._ratemap < minbgrate] = minbgrate
+
+        if sigma is not None:
+            if np.any(np.asarray(sigma) > 0):
+                self.smooth(sigma=sigma, bw=bw, inplace=True)
+
+    def _trans_func(self, extern, at):
+        """Default transform function to map extern into numerical bins"""
+
+        _, ext = extern.asarray(at=at)
+
+        return ext
+
+    def _flat_index(self, ext):
+        """Flat (row-major) bin index of every column of ext."""
+        multi_idx = []
+        for dim, (edges, values) in enumerate(zip(self._bins, ext)):
+            idx = np.searchsorted(edges, values, side='right') - 1
+            # the last bin is closed, as with np.histogram:
+            idx[values == edges[-1]] = len(edges) - 2
+            if np.any(idx < 0) or np.any(idx > len(edges) - 2) or np.any(np.isnan(values)):
+                raise ValueError("ext values outside of bins in dimension {}".format(dim))
+            multi_idx.append(idx)
+        return np.ravel_multi_index(multi_idx, self.grid_shape)
+
+    @property
+    def n_dims(self):
+        """(int) Number of dimensions of the external correlates."""
+        return len(self._bins)
+
+    @property
+    def bins(self):
+        """External correlate bin edges, one array per dimension."""
+        return self._bins
+
+    @property
+    def grid_shape(self):
+        """(tuple) Number of bins along each dimension."""
+        return tuple(len(edges) - 1 for edges in self._bins)
+
+    @property
+    def n_bins(self):
+        """(int) Number of bins in the full grid."""
+        return int(np.prod(self.grid_shape))
+
+    @property
+    def n_occupied(self):
+        """(int) Number of occupied bins."""
+        return len(self._occupied)
+
+    @property
+    def occupied(self):
+        return self._occupied
+
+    @property
+    def occupancy(self):
+        return self._occupancy
+
+    @property
+    def ratemap(self):
+        return self._ratemap
+
+    @property
+    def bin_centers(self):
+        """Bin centers of the occupied bins, with shape (n_dims, n_occupied)."""
+        multi_idx = np.unravel_index(self._occupied, self.grid_shape)
+        return np.array([((edges[1:] + edges[:-1])/2)[idx]
+                         for edges, idx in zip(self._bins, multi_idx)])
+
+    def to_dense(self, fill_value=np.nan):
+        """Return the ratemap on the full grid, with shape (n_units,
+        *grid_shape); unoccupied bins are set to fill_value."""
+        out = np.full((self.n_units, self.n_bins), fill_value, dtype=float)
+        out[:, self._occupied] = self._ratemap
+        return out.reshape((self.n_units,) + self.grid_shape)
+
+    def smooth(self, *, sigma=None, bw=None, inplace=False):
+        """Smooths the tuning curve over the occupied bins.
+
+        Separable Gaussian kernels are applied one dimension at a time
+        over the sparse support (which never requires the full grid), and
+        the result is normalized by the equally smoothed indicator of
+        occupied bins, so that unoccupied bins do not pull rates down.
+
+        Parameters
+        ----------
+        sigma : float or sequence of float, optional
+            Standard deviation (in units of extern) for all or for each
+            dimension; 0 skips a dimension. Default is 0.1.
+        bw : float, optional
+            Kernel bandwidth, in standard deviations. Default is 4.
+        """
+        if sigma is None:
+            sigma = 0.1 # in units of extern
+        if bw is None:
+            bw = 4
+
+        sigma = np.broadcast_to(sigma, (self.n_dims,))
+
+        if not inplace:
+            out = copy.deepcopy(self)
+        else:
+            out = self
+
+        # smooth the ratemap and the indicator of occupied bins together:
+        keys = self._occupied
+        values = np.vstack((self._ratemap, np.ones(self.n_occupied)))
+        for axis, (edges, sigma_d) in enumerate(zip(self._bins, sigma)):
+            if sigma_d <= 0:
+                continue
+            ds = (edges[-1] - edges[0])/(len(edges) - 1)
+            keys, values = _sparse_gaussian_pass(keys, values, self.grid_shape,
+                                                 axis, sigma_d/ds, bw)
+
+        # restrict back to the occupied bins:
+        idx = np.searchsorted(keys, self._occupied)
+        out._ratemap = values[:-1, idx] / values[-1, idx]
+
+        return out
+
+    @property
+    def n_units(self):
+        """(int) The number of units."""
+        try:
+            return len(self._unit_ids)
+        except TypeError: # when unit_ids is an integer
+            return 1
+        except AttributeError:
+            return 0
+
+    @property
+    def shape(self):
+        """(tuple) The shape of the TuningCurveND ratemap."""
+        if self.isempty:
+            return (self.n_units, 0)
+        return self.ratemap.shape
+
+    @property
+    def isempty(self):
+        """(bool) True if TuningCurveND is empty"""
+        try:
+            return len(self.ratemap) == 0
+        except TypeError: #TypeError should happen if ratemap = []
+            return True
+
+    def __len__(self):
+        return self.n_units
+
+    def __repr__(self):
+        address_str = " at " + str(hex(id(self)))
+        if self.isempty:
+            return "<empty TuningCurveND" + address_str + ">"
+        shapestr = " with shape (%s, %s) over %s of %s bins" % (
+            self.n_units, self.n_occupied, self.n_occupied, self.n_bins)
+        return "<TuningCurveND%s>%s" % (address_str, shapestr)
+
+    @property
+    def unit_ids(self):
+        """Unit IDs contained in the SpikeTrain."""
+        return self._unit_ids
+
+    @property
+    def unit_labels(self):
+        """Labels corresponding to units contained in the SpikeTrain."""
+        if self._unit_labels is None:
+            warnings.warn("unit labels have not yet been specified")
+        return self._unit_labels
+
+    @property
+    def unit_tags(self):
+        """Tags corresponding to units contained in the SpikeTrain"""
+        if self._unit_tags is None:
+            warnings.warn("unit tags have not yet been specified")
+        return self._unit_tags
+
+    @property
+    def label(self):
+        """Label pertaining to the source of the spike train."""
+        if self._label is None:
+            warnings.warn("label has not yet been specified")
+        return self._label
+
+    @label.setter
+    def label(self, val):
+        if val is not None:
+            try:  # cast to str:
+                label = str(val)
+            except TypeError:
+                raise TypeError("cannot convert label to string")
+        else:
+            label = val
+        self._label = label
@@ -16,7 +16,9 @@ from ..utils import is_sorted, \
                     PrettyDuration, \
                     PrettyBytes, \
                     PrettyInt, \
-                    gaussian_filter
+                    gaussian_filter, \
+                    signal_envelope, \
+                    signal_phase
 
 from ._epocharray import EpochArray
 
@@ -489,6 +491,58 @@ class AnalogSignalArray:
 
         return gaussian_filter(self, **kwargs)
 
+    def envelope(self, *, sigma=None, chunksize=None, overlap=None,
+                 dtype=None):
+        """Returns the (smoothed) Hilbert envelope of each signal.
+
+        The Hilbert transform is computed within each epoch, using fast
+        FFT sizes, and optionally in overlapping chunks for long epochs.
+
+        Parameters
+        ----------
+        sigma : float, optional
+            Standard deviation of Gaussian kernel, in seconds, with which
+            the envelope is smoothed. Default is 0.004 (4 ms); 0 means no
+            smoothing.
+        chunksize : int, optional
+            Maximum number of samples per Hilbert transform. Default is
+            None (each epoch is transformed in one go).
+        overlap : int, optional
+            Number of samples by which chunks are extended on either side.
+            Default is chunksize // 4.
+        dtype : np.dtype, optional
+            Data type of the envelope. Default is np.float32.
+
+        Returns
+        -------
+        out : AnalogSignalArray
+            An AnalogSignalArray with the envelope of each signal.
+        """
+        kwargs = {'sigma' : sigma,
+                  'chunksize' : chunksize,
+                  'overlap' : overlap,
+                  'dtype' : dtype}
+
+        return signal_envelope(self, **kwargs)
+
+    def phase(self, *, chunksize=None, overlap=None, dtype=None):
+        """Returns the instantaneous phase (in radians) of each signal.
+
+        See AnalogSignalArray.envelope() for a description of the
+        parameters.
+
+        Returns
+        -------
+        out : AnalogSignalArray
+            An AnalogSignalArray with the instantaneous phase of each
+            signal.
+        """
+        kwargs = {'chunksize' : chunksize,
+                  'overlap' : overlap,
+                  'dtype' : dtype}
+
+        return signal_phase(self, **kwargs)
+
     @property
     def lengths(self):
         """(list) The number of samples in each epoch."""
@@ -2,14 +2,25 @@
 
 __all__ = ['decode1D',
            'decode2D',
+           'decodeND',
+           'Decoder',
+           'StreamingDecoder',
+           'decoding_terms',
            'k_fold_cross_validation',
            'cumulative_dist_decoding_error_using_xval',
            'cumulative_dist_decoding_error',
            'get_mode_pth_from_array',
            'get_mean_pth_from_array']
 
+import numbers
+import time
 import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 from . import auxiliary
+from .filtering import _n_workers
 
 def get_mode_pth_from_array(posterior, tuningcurve=None):
     """If tuningcurve is provided, then we map it back to the external coordinates / units.
@@ -96,8 +107,9 @@ def decode1D(bst, ratemap, xmin=0, xmax=100, w=1, nospk_prior=None, _skip_empty_
     cum_posterior_lengths : array
 
     mode_pth :
-
+        Left edge of the bin with the largest posterior.
     mean_pth :
+        Posterior-weighted mean of the bin centers.
 
     Examples
     --------
@@ -124,7 +136,7 @@ def decode1D(bst, ratemap, xmin=0, xmax=100, w=1, nospk_prior=None, _skip_empty_
 
     if nospk_prior is None:
         nospk_prior = np.full(n_xbins, np.nan)
-    elif isinstance(nospk_priors, numbers.Number):
+    elif isinstance(nospk_prior, numbers.Number):
         nospk_prior = np.full(n_xbins, 1.0)
 
     assert nospk_prior.shape[0] == n_xbins, "prior must have length {}".format(n_xbins)
@@ -139,7 +151,7 @@ def decode1D(bst, ratemap, xmin=0, xmax=100, w=1, nospk_prior=None, _skip_empty_
     # first, we determine the number of bins we will decode. This requires us to scan over the epochs
     n_bins = 0
     cumlengths = np.cumsum(bst.lengths)
-    posterior_lengths = np.zeros(bst.n_epochs, dtype=np.int)
+    posterior_lengths = np.zeros(bst.n_epochs, dtype=int)
     prev_idx = 0
     for ii, to_idx in enumerate(cumlengths):
         datalen = to_idx - prev_idx
@@ -183,17 +195,73 @@ def decode1D(bst, ratemap, xmin=0, xmax=100, w=1, nospk_prior=None, _skip_empty_
     posterior = np.exp(posterior) / np.tile(np.exp(posterior).sum(axis=0),(n_xbins,1))
 
     _, bins = np.histogram([], bins=n_xbins, range=(xmin,xmax))
-    xbins = (bins + xmax/n_xbins)[:-1]
+    xbins = (bins[:-1] + bins[1:])/2
 
-    mode_pth = np.argmax(posterior, axis=0)*xmax/n_xbins
+    mode_pth = xmin + np.argmax(posterior, axis=0)*(xmax - xmin)/n_xbins
     mode_pth = np.where(np.isnan(posterior.sum(axis=0)), np.nan, mode_pth)
     mean_pth = (xbins * posterior.T).sum(axis=1)
     return posterior, cum_posterior_lengths, mode_pth, mean_pth
 
-def decode2D(bst, ratemap, xmin=0, xmax=100, ymin=0, ymax=100, w=1, nospk_prior=None, _skip_empty_bins=True):
+def _sliding_window_counts(data, lengths, w):
+    """Spike counts in windows of w bins, slid one bin at a time within
+    each epoch.
+
+    All windows of all epochs are computed as differences of one
+    cumulative sum over time, gathered with fancy indexing. When not even
+    one full window fits into an epoch, all of its bins form one
+    (partial) window.
+
+    Parameters
+    ----------
+    data : array of shape (n_units, n_bins)
+    lengths : array of shape (n_epochs,)
+        Number of bins in each epoch.
+    w : int
+        Number of bins per window.
+
+    Returns
+    -------
+    windowed : contiguous array of shape (n_windows, n_units)
+    window_lengths : array of shape (n_epochs,)
+        Number of windows in each epoch.
+    """
+    lengths = np.asarray(lengths, dtype=int)
+    window_lengths = np.maximum(lengths - w + 1, 1)
+
+    n_units, n_bins = data.shape
+    datacum = np.zeros((n_bins + 1, n_units))
+    np.cumsum(data.T, axis=0, out=datacum[1:])
+
+    starts = np.insert(np.cumsum(lengths), 0, 0)
+    epoch = np.repeat(np.arange(len(lengths)), window_lengths)
+    first_window = np.insert(np.cumsum(window_lengths), 0, 0)[:-1]
+    left = starts[epoch] + np.arange(window_lengths.sum()) - first_window[epoch]
+    right = np.minimum(left + w, starts[epoch + 1])
+
+    windowed = datacum[right]
+    windowed -= datacum[left]
+    return windowed, window_lengths
+
+def _windowed_counts(bst, w):
+    """Spike counts in every decoding window of w bins, per epoch.
+
+    Returns the counts, with shape (n_units, n_windows), and the
+    cumulative number of windows per epoch (starting at 0). When not even
+    one full window fits into an epoch, all of its bins form one
+    (partial) window.
+    """
+    windowed, window_lengths = _sliding_window_counts(np.atleast_2d(bst.data), bst.lengths, w)
+    cum_posterior_lengths = np.insert(np.cumsum(window_lengths), 0, 0)
+    return windowed.T, cum_posterior_lengths
+
+def decode2D(bst, ratemap, xmin=0, xmax=100, ymin=0, ymax=100, w=1, nospk_prior=None, _skip_empty_bins=True, chunksize=None):
     """Decodes binned spike trains using a ratemap with shape (n_units, ext_nx, ext_ny)
 
-    TODO: complete docstring
+    All decoding windows are evaluated as one matrix product of the
+    windowed spike counts against the flattened log ratemap, and are
+    normalized in log space (exp-normalize trick). Time is processed in
+    chunks of windows, so that temporary arrays have bounded size.
+
     TODO: what if we have higher dimensional external correlates? This
     function assumes a 2D correlate. Even if we linearize a 2D
     environment, for example, then mean_pth decoding no longer works as
@@ -214,6 +282,9 @@ def decode2D(bst, ratemap, xmin=0, xmax=100, ymin=0, ymax=100, w=1, nospk_prior=
         that will be used if no spikes are observed in a decoding window
         Default is np.nan.
         If nospk_prior is any scalar, then a uniform prior is assumed.
+    chunksize : int, optional
+        Number of windows decoded at a time. Default is chosen such that
+        each chunk of the posterior has about 10 million elements.
 
     _skip_empty_bins is only used to return the posterior regardless of
     whether any spikes were observed, so that we can understand the spatial
@@ -227,28 +298,20 @@ def decode2D(bst, ratemap, xmin=0, xmax=100, ymin=0, ymax=100, w=1, nospk_prior=
         event lengths.
     cum_posterior_lengths : array
 
-    mode_pth :
+    mode_pth : array of shape (2, n_posterior_bins)
 
-    mean_pth :
+    mean_pth : array of shape (2, n_posterior_bins)
 
     Examples
     --------
 
     """
 
-    def tile_obs(obs, nx, ny):
-        n_units = len(obs)
-        out = np.zeros((n_units, nx, ny))
-        for unit in range(n_units):
-            out[unit,:,:] = obs[unit]
-        return out
-
     if w is None:
         w=1
     assert float(w).is_integer(), "w must be a positive integer!"
     assert w > 0, "w must be a positive integer!"
-
-    n_units, t_bins = bst.data.shape
+    w = int(w)
 
     xbins = None
     ybins = None
@@ -262,72 +325,24 @@ def decode2D(bst, ratemap, xmin=0, xmax=100, ymin=0, ymax=100, w=1, nospk_prior=
         ratemap = ratemap.reorder_units_by_ids(bst.unit_ids)
         ratemap = ratemap.ratemap
 
-    _, n_xbins, n_ybins = ratemap.shape
+    n_units, n_xbins, n_ybins = ratemap.shape
 
     if nospk_prior is None:
         nospk_prior = np.full((n_xbins, n_ybins), np.nan)
-    elif isinstance(nospk_priors, numbers.Number):
+    elif isinstance(nospk_prior, numbers.Number):
         nospk_prior = np.full((n_xbins, n_ybins), 1.0)
 
     assert nospk_prior.shape == (n_xbins, n_ybins), "prior must have shape ({}, {})".format(n_xbins, n_ybins)
 
-    lfx = np.log(ratemap)
-
+    ratemap = ratemap.reshape(n_units, n_xbins*n_ybins)
+    lfx = np.log(ratemap).T # (n_xybins, n_units)
     eterm = -ratemap.sum(axis=0)*bst.ds*w
 
-    # if we decode using multiple bins at a time (w>1) then we have to decode each epoch separately:
-
-    # first, we determine the number of bins we will decode. This requires us to scan over the epochs
-    n_tbins = 0
-    cumlengths = np.cumsum(bst.lengths)
-    posterior_lengths = np.zeros(bst.n_epochs, dtype=np.int)
-    prev_idx = 0
-    for ii, to_idx in enumerate(cumlengths):
-        datalen = to_idx - prev_idx
-        prev_idx = to_idx
-        posterior_lengths[ii] = np.max((1,datalen - w + 1))
-
-    n_tbins = posterior_lengths.sum()
-
-    ########################################################################
-    posterior = np.zeros((n_xbins, n_ybins, n_tbins))
-
-    # next, we decode each epoch separately, one bin at a time
-    cum_posterior_lengths = np.insert(np.cumsum(posterior_lengths),0,0)
-    prev_idx = 0
-    for ii, to_idx in enumerate(cumlengths):
-        data = bst.data[:,prev_idx:to_idx]
-        prev_idx = to_idx
-        datacum = np.cumsum(data, axis=1) # ii'th data segment, with column of zeros prepended
-        datacum = np.hstack((np.zeros((n_units,1)), datacum))
-        re = w # right edge ptr
-        # TODO: check if datalen < w and act appropriately
-        if posterior_lengths[ii] > 1: # more than one full window fits into data length
-            for tt in range(posterior_lengths[ii]):
-                obs = datacum[:, re] - datacum[:, re-w] # spikes in window of size w
-                re+=1
-                post_idx = cum_posterior_lengths[ii] + tt
-                if obs.sum() == 0 and _skip_empty_bins:
-                    # no spikes to decode in window!
-                    posterior[:,:,post_idx] = nospk_prior
-                else:
-                    posterior[:,:,post_idx] = (tile_obs(obs, n_xbins, n_ybins) * lfx).sum(axis=0) + eterm
-        else: # only one window can fit in, and perhaps only partially. We just take all the data we can get,
-              # and ignore the scaling problem where the window size is now possibly less than bst.ds*w
-            post_idx = cum_posterior_lengths[ii]
-            obs = datacum[:, -1] # spikes in window of size at most w
-            if obs.sum() == 0 and _skip_empty_bins:
-                # no spikes to decode in window!
-                posterior[:,:,post_idx] = nospk_prior
-            else:
-                posterior[:,:,post_idx] = (tile_obs(obs, n_xbins, n_ybins) * lfx).sum(axis=0) + eterm
+    obs, cum_posterior_lengths = _windowed_counts(bst, w)
+    n_tbins = obs.shape[1]
 
-    # normalize posterior:
-    # see http://timvieira.github.io/blog/post/2014/02/11/exp-normalize-trick/
-    for tt in range(n_tbins):
-        posterior[:,:,tt] = posterior[:,:,tt] - posterior[:,:,tt].max()
-        posterior[:,:,tt] = np.exp(posterior[:,:,tt])
-        posterior[:,:,tt] = posterior[:,:,tt] / posterior[:,:,tt].sum()
+    if chunksize is None:
+        chunksize = max(int(1e7 // (n_xbins*n_ybins)), 1)
 
     if xbins is None:
         _, bins = np.histogram([], bins=n_xbins, range=(xmin,xmax))
@@ -335,23 +350,440 @@ def decode2D(bst, ratemap, xmin=0, xmax=100, ymin=0, ymax=100, w=1, nospk_prior=
     if ybins is None:
         _, bins = np.histogram([], bins=n_ybins, range=(ymin,ymax))
         ybins = (bins + ymax/n_ybins)[:-1]
+    xcoords = np.asarray(xbins)[:n_xbins]
+    ycoords = np.asarray(ybins)[:n_ybins]
+
+    posterior = np.empty((n_xbins*n_ybins, n_tbins))
+    mode_pth = np.empty((2, n_tbins))
+    mean_pth = np.empty((2, n_tbins))
+
+    for first in range(0, n_tbins, chunksize):
+        chunk = slice(first, min(first + chunksize, n_tbins))
+        logp = np.dot(lfx, obs[:, chunk]) + eterm[:, np.newaxis]
+        if _skip_empty_bins:
+            # no spikes to decode in window!
+            empty = obs[:, chunk].sum(axis=0) == 0
+            logp[:, empty] = nospk_prior.reshape(-1, 1)
+        # normalize posterior:
+        # see http://timvieira.github.io/blog/post/2014/02/11/exp-normalize-trick/
+        logp -= logp.max(axis=0)
+        np.exp(logp, out=logp)
+        logp /= logp.sum(axis=0)
+        posterior[:, chunk] = logp
+
+        nan_cols = np.isnan(logp.sum(axis=0))
+        x_, y_ = np.unravel_index(np.argmax(logp, axis=0), (n_xbins, n_ybins))
+        mode_pth[0, chunk] = np.where(nan_cols, np.nan, xcoords[x_])
+        mode_pth[1, chunk] = np.where(nan_cols, np.nan, ycoords[y_])
+
+        logp = logp.reshape(n_xbins, n_ybins, -1)
+        mean_pth[0, chunk] = np.dot(xcoords, logp.sum(axis=1))
+        mean_pth[1, chunk] = np.dot(ycoords, logp.sum(axis=0))
+
+    posterior = posterior.reshape(n_xbins, n_ybins, n_tbins)
 
-    mode_pth = np.zeros((2, n_tbins))
-    for tt in range(n_tbins):
-        if np.any(np.isnan(posterior[:,:,tt])):
-            mode_pth[0,tt] = np.nan
-            mode_pth[0,tt] = np.nan
-        else:
-            x_, y_ = np.unravel_index(np.argmax(posterior[:,:,tt]), (n_xbins, n_ybins))
-            mode_pth[0,tt] = xbins[x_]
-            mode_pth[1,tt] = ybins[y_]
+    return posterior, cum_posterior_lengths, mode_pth, mean_pth
+
+def decodeND(bst, tuningcurve, w=1, _skip_empty_bins=True):
+    """Decodes binned spike trains using a TuningCurveND.
+
+    The posterior is only evaluated over the occupied bins of the tuning
+    curve, so that the full (possibly very large) N-dimensional grid is
+    never materialized. Windows are decoded with a single matrix product
+    against the log ratemap.
+
+    Parameters
+    ----------
+    bst : BinnedSpikeTrainArray
+    tuningcurve : TuningCurveND
+        Units are matched to those of bst by unit_id.
+    w : int, optional
+        Number of bins of bst to decode at a time. Default is 1.
+
+    _skip_empty_bins is only used to return the posterior regardless of
+    whether any spikes were observed, so that we can understand the spatial
+    distribution in the absence of spikes, or at low firing rates.
+
+    Returns
+    -------
+    posteriors : array
+        Posterior distribution with shape (n_occupied, n_posterior_bins),
+        where n_posterior bins <= bst.n_bins, but depends on w and the
+        event lengths. Windows without spikes are NaN.
+    cum_posterior_lengths : array
+    mode_pth : array of shape (n_dims, n_posterior_bins)
+        Center of the occupied bin with the largest posterior.
+    mean_pth : array of shape (n_dims, n_posterior_bins)
+        Posterior-weighted mean of the occupied bin centers.
+    """
+
+    if w is None:
+        w=1
+    assert float(w).is_integer(), "w must be a positive integer!"
+    assert w > 0, "w must be a positive integer!"
+    w = int(w)
+
+    if not isinstance(tuningcurve, auxiliary.TuningCurveND):
+        raise TypeError("tuningcurve must be a TuningCurveND!")
+
+    # re-order units if necessary
+    tc_unit_ids = list(tuningcurve.unit_ids)
+    unit_idx = [tc_unit_ids.index(unit_id) for unit_id in bst.unit_ids]
+    ratemap = tuningcurve.ratemap[unit_idx, :]
+
+    lfx = np.log(ratemap)
+    eterm = -ratemap.sum(axis=0)*bst.ds*w
+
+    obs, cum_posterior_lengths = _windowed_counts(bst, w)
+
+    posterior = np.dot(lfx.T, obs) + eterm[:, np.newaxis]
+    # see http://timvieira.github.io/blog/post/2014/02/11/exp-normalize-trick/
+    posterior = np.exp(posterior - posterior.max(axis=0))
+    posterior /= posterior.sum(axis=0)
+
+    empty = np.zeros(obs.shape[1], dtype=bool)
+    if _skip_empty_bins:
+        empty = obs.sum(axis=0) == 0
+        posterior[:, empty] = np.nan
+
+    centers = tuningcurve.bin_centers
+    mode_pth = centers[:, np.argmax(posterior, axis=0)]
+    mode_pth[:, empty] = np.nan
+    mean_pth = np.dot(centers, posterior)
+
+    return posterior, cum_posterior_lengths, mode_pth, mean_pth
+
+def decoding_terms(tuningcurve, unit_ids=None, *, ds, w=1):
+    """Return the terms of the Poisson log posterior that only depend on
+    the tuning curve.
+
+    The log posterior of a window with spike counts obs (n_units,) is
+    np.dot(lfx, obs) + eterm, up to a constant.
+
+    Parameters
+    ----------
+    tuningcurve : TuningCurve1D
+    unit_ids : list, optional
+        Order of the units in the spike counts. Default is the unit_ids
+        of the tuning curve.
+    ds : float
+        Bin size (in seconds).
+    w : int, optional
+        Number of bins per window. Default is 1.
+
+    Returns
+    -------
+    lfx : array of shape (n_xbins, n_units)
+        Log ratemap, with units in the order of unit_ids.
+    eterm : array of shape (n_xbins,)
+        Expected spike count term, -sum(ratemap)*ds*w.
+    """
+    tc_unit_ids = list(tuningcurve.unit_ids)
+    if unit_ids is None:
+        unit_ids = tc_unit_ids
+    try:
+        unit_idx = [tc_unit_ids.index(unit_id) for unit_id in unit_ids]
+    except ValueError:
+        raise ValueError("all units to be decoded must be in the tuning curve!")
+    ratemap = np.atleast_2d(tuningcurve.ratemap)[unit_idx, :]
+    lfx = np.ascontiguousarray(np.log(ratemap).T)
+    eterm = -ratemap.sum(axis=0)*ds*w
+    return lfx, eterm
+
+class Decoder:
+    """Bayesian decoder that caches everything that only depends on the
+    tuning curve.
+
+    decode1D() re-orders (copies) the tuning curve, and recomputes the
+    log ratemap and the expected spike count term on every call. A
+    Decoder instead keeps the log ratemap and the expected count term,
+    aligned to the unit order of the data, in a cache keyed by (unit
+    order, ds, w), and decodes all windows with a single matrix product
+    per chunk. Posteriors and paths are the same as those of decode1D().
+
+    The cache is cleared automatically when the ratemap array or the
+    unit_ids of the tuning curve are replaced (e.g., by smooth(inplace=True)
+    or reorder_units_by_ids(inplace=True)). After modifying the ratemap
+    array in place, call invalidate().
+
+    Parameters
+    ----------
+    tuningcurve : TuningCurve1D
+    w : int, optional
+        Default number of bins to decode at a time. Default is 1.
+    nospk_prior : array_like or scalar, optional
+        As for decode1D(). Default is np.nan.
+
+    Examples
+    --------
+    >>> decoder = Decoder(tc)
+    >>> for event in events:
+    >>>     posterior, _, mode_pth, mean_pth = decoder.decode(event)
+    """
+
+    def __init__(self, tuningcurve, *, w=1, nospk_prior=None):
+        if not isinstance(tuningcurve, auxiliary.TuningCurve1D):
+            raise TypeError("tuningcurve must be a TuningCurve1D!")
+        self._tuningcurve = tuningcurve
+        self._w = w
+        self._nospk_prior = nospk_prior
+        self._cache = {}
+        self._ratemap = None
+        self._unit_ids = None
+
+    @property
+    def tuningcurve(self):
+        return self._tuningcurve
+
+    def invalidate(self):
+        """Clear all cached terms, e.g., after modifying the ratemap of
+        the tuning curve in place."""
+        self._cache = {}
+        self._ratemap = None
+        self._unit_ids = None
+
+    def _get_terms(self, unit_ids, ds, w):
+        """Return the log ratemap, with shape (n_xbins, n_units) and units
+        in the order of unit_ids, and the expected count term."""
+        # the ratemap itself is kept (not its id) so that the identity
+        # check cannot be fooled by a new array at a re-used address:
+        ratemap = self._tuningcurve.ratemap
+        tc_unit_ids = tuple(self._tuningcurve.unit_ids)
+        if ratemap is not self._ratemap or tc_unit_ids != self._unit_ids:
+            self._cache = {}
+            self._ratemap = ratemap
+            self._unit_ids = tc_unit_ids
+
+        cache_key = (tuple(unit_ids), ds, w)
+        try:
+            return self._cache[cache_key]
+        except KeyError:
+            pass
+
+        lfx, eterm = decoding_terms(self._tuningcurve, unit_ids, ds=ds, w=w)
+
+        self._cache[cache_key] = lfx, eterm
+        return lfx, eterm
+
+    def decode(self, bst, *, w=None, chunksize=None, _skip_empty_bins=True):
+        """Decode binned spike trains.
+
+        Parameters
+        ----------
+        bst : BinnedSpikeTrainArray
+        w : int, optional
+            Number of bins to decode at a time. Default is the w of the
+            Decoder.
+        chunksize : int, optional
+            Number of windows decoded at a time. Default is chosen such
+            that each chunk of the posterior has about 10 million
+            elements.
+
+        Returns
+        -------
+        posteriors : array
+            Posterior distribution with shape (n_ext, n_posterior_bins).
+        cum_posterior_lengths : array
+        mode_pth : array of shape (n_posterior_bins,)
+        mean_pth : array of shape (n_posterior_bins,)
+        """
+        if w is None:
+            w = self._w
+        assert float(w).is_integer(), "w must be a positive integer!"
+        assert w > 0, "w must be a positive integer!"
+        w = int(w)
+
+        lfx, eterm = self._get_terms(bst.unit_ids, bst.ds, w)
+        n_xbins = lfx.shape[0]
+
+        nospk_prior = self._nospk_prior
+        if nospk_prior is None:
+            nospk_prior = np.full(n_xbins, np.nan)
+        elif isinstance(nospk_prior, numbers.Number):
+            nospk_prior = np.full(n_xbins, 1.0)
+        assert nospk_prior.size == n_xbins, "prior must be a 1D array with length {}".format(n_xbins)
+
+        obs, cum_posterior_lengths = _windowed_counts(bst, w)
+        n_tbins = obs.shape[1]
+
+        if chunksize is None:
+            chunksize = max(int(1e7 // n_xbins), 1)
+
+        posterior = np.empty((n_xbins, n_tbins))
+        for first in range(0, n_tbins, chunksize):
+            chunk = slice(first, min(first + chunksize, n_tbins))
+            logp = np.dot(lfx, obs[:, chunk]) + eterm[:, np.newaxis]
+            if _skip_empty_bins:
+                # no spikes to decode in window!
+                empty = obs[:, chunk].sum(axis=0) == 0
+                logp[:, empty] = nospk_prior.reshape(-1, 1)
+            logp -= logp.max(axis=0)
+            np.exp(logp, out=logp)
+            logp /= logp.sum(axis=0)
+            posterior[:, chunk] = logp
+
+        # same paths as decode1D:
+        xmin = self._tuningcurve.bins[0]
+        xmax = self._tuningcurve.bins[-1]
+        _, bins = np.histogram([], bins=n_xbins, range=(xmin,xmax))
+        xbins = (bins[:-1] + bins[1:])/2
+
+        mode_pth = xmin + np.argmax(posterior, axis=0)*(xmax - xmin)/n_xbins
+        mode_pth = np.where(np.isnan(posterior.sum(axis=0)), np.nan, mode_pth)
+        mean_pth = np.dot(xbins, posterior)
+
+        return posterior, cum_posterior_lengths, mode_pth, mean_pth
 
-    # mean_pth = (xbins * posterior.T).sum(axis=1)
-    # return posterior, cum_posterior_lengths, mode_pth, mean_pth
+class StreamingDecoder:
+    """Bayesian decoder for spike counts that arrive one bin at a time.
 
-    return posterior, cum_posterior_lengths, mode_pth, []
+    A ring buffer holds the counts of the last w bins, and the windowed
+    counts are updated incrementally as each bin arrives (the newest bin
+    is added and the oldest one subtracted). All buffers are allocated
+    up front, so that update() takes a bounded amount of time and does
+    not allocate arrays, which makes it suitable for closed-loop use.
 
-def k_fold_cross_validation(X, k=None, randomize=False):
+    Until w bins have arrived, the posterior is computed from the bins
+    seen so far, with the expected spike count term scaled to the number
+    of bins received. Note that decode1D() instead uses w bins for the
+    expected count term of epochs shorter than w bins.
+
+    Parameters
+    ----------
+    tuningcurve : TuningCurve1D
+    ds : float
+        Bin size (in seconds) of the incoming counts.
+    w : int, optional
+        Number of bins in the decoding window. Default is 1.
+    unit_ids : list, optional
+        Order of the units in the incoming counts. Default is the
+        unit_ids of the tuning curve.
+    nospk_prior : array_like or scalar, optional
+        As for decode1D(). Default is np.nan.
+
+    Examples
+    --------
+    >>> decoder = StreamingDecoder(tc, ds=0.005, w=4)
+    >>> for counts in stream:
+    >>>     posterior = decoder.update(counts)
+    """
+
+    def __init__(self, tuningcurve, *, ds, w=1, unit_ids=None, nospk_prior=None):
+        assert float(w).is_integer(), "w must be a positive integer!"
+        assert w > 0, "w must be a positive integer!"
+        w = int(w)
+
+        if unit_ids is None:
+            unit_ids = tuningcurve.unit_ids
+        self._tuningcurve = tuningcurve
+        self._unit_ids = list(unit_ids)
+        self._ds = ds
+        self._w = w
+
+        lfx, eterm = decoding_terms(tuningcurve, self._unit_ids, ds=ds)
+        self._lfx = lfx
+        # expected count term for windows of 1, 2, ..., w bins:
+        self._eterms = np.outer(np.arange(1, w+1), eterm)
+
+        n_xbins = lfx.shape[0]
+        if nospk_prior is None:
+            self._nospk_posterior = np.full(n_xbins, np.nan)
+        elif isinstance(nospk_prior, numbers.Number):
+            self._nospk_posterior = np.full(n_xbins, 1/n_xbins)
+        else:
+            nospk_prior = np.asarray(nospk_prior, dtype=float)
+            assert nospk_prior.size == n_xbins, "prior must be a 1D array with length {}".format(n_xbins)
+            nospk_posterior = np.exp(nospk_prior - nospk_prior.max())
+            self._nospk_posterior = nospk_posterior / nospk_posterior.sum()
+
+        self._buffer = np.zeros((w, len(self._unit_ids)))
+        self._counts = np.zeros(len(self._unit_ids))
+        self._posterior = np.full(n_xbins, np.nan)
+        self.reset()
+
+    def reset(self):
+        """Empty the ring buffer."""
+        self._buffer[:] = 0
+        self._counts[:] = 0
+        self._posterior[:] = np.nan
+        self._pos = 0
+        self._n_filled = 0
+        self._n_spikes = 0
+        self.n_updates = 0
+
+    @property
+    def w(self):
+        return self._w
+
+    @property
+    def ds(self):
+        return self._ds
+
+    @property
+    def unit_ids(self):
+        return self._unit_ids
+
+    @property
+    def counts(self):
+        """Spike counts (n_units,) in the current decoding window."""
+        return self._counts
+
+    @property
+    def posterior(self):
+        """Posterior (n_xbins,) of the current decoding window."""
+        return self._posterior
+
+    @property
+    def mode(self):
+        """Bin center of the maximum of the current posterior."""
+        if np.isnan(self._posterior[0]):
+            return np.nan
+        return self._tuningcurve.bin_centers[np.argmax(self._posterior)]
+
+    @property
+    def mean(self):
+        """Posterior mean of the current decoding window."""
+        return np.dot(self._tuningcurve.bin_centers, self._posterior)
+
+    def update(self, counts):
+        """Add the spike counts of the next bin and decode.
+
+        Parameters
+        ----------
+        counts : array_like of shape (n_units,)
+            Spike counts of the newest bin, in the order of unit_ids.
+
+        Returns
+        -------
+        posterior : array of shape (n_xbins,)
+            Posterior of the window ending with this bin. The array is
+            reused (overwritten) by the next update; copy it to keep it.
+        """
+        counts = np.asarray(counts)
+        oldest = self._buffer[self._pos]
+        self._n_spikes += counts.sum() - oldest.sum()
+        np.subtract(self._counts, oldest, out=self._counts)
+        np.add(self._counts, counts, out=self._counts)
+        oldest[:] = counts
+        self._pos = (self._pos + 1) % self._w
+        if self._n_filled < self._w:
+            self._n_filled += 1
+        self.n_updates += 1
+
+        posterior = self._posterior
+        if self._n_spikes == 0:
+            # no spikes to decode in window!
+            posterior[:] = self._nospk_posterior
+            return posterior
+
+        np.dot(self._lfx, self._counts, out=posterior)
+        np.add(posterior, self._eterms[self._n_filled-1], out=posterior)
+        np.subtract(posterior, posterior.max(), out=posterior)
+        np.exp(posterior, out=posterior)
+        np.divide(posterior, posterior.sum(), out=posterior)
+        return posterior
+
+def k_fold_cross_validation(X, k=None, randomize=False, random_state=None):
     """
     Generates K (training, validation) pairs from the items in X.
 
@@ -370,6 +802,9 @@ def k_fold_cross_validation(X, k=None, randomize=False):
     randomize : bool
          If true, a copy of X is shuffled before partitioning, otherwise
          its order is preserved in training and validation.
+    random_state : int or RandomState, optional
+         Seed used to shuffle X if randomize is True, so that fold
+         assignment is reproducible.
 
     Returns
     -------
@@ -393,19 +828,66 @@ def k_fold_cross_validation(X, k=None, randomize=False):
         k=n_samples
 
     if randomize:
-        from random import shuffle
-        X=list(X)
-        shuffle(X)
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        X = [X[i] for i in random_state.permutation(n_samples)]
     for _k_ in range(k):
         training = [x for i, x in enumerate(X) if i % k != _k_]
         validation = [x for i, x in enumerate(X) if i % k == _k_]
         yield training, validation
 
-def cumulative_dist_decoding_error_using_xval(bst, extern,*, decodefunc=decode1D, tuningcurve=None, k=5, transfunc=None, n_extern=100, extmin=0, extmax=100, sigma=3, n_bins=None):
+def _trans_func(extern, at):
+    """Default transform function to map extern into numerical bins"""
+
+    _, ext = extern.asarray(at=at)
+
+    return ext
+
+# data shared by every cross-validation fold; set once per worker process
+_XVAL_DATA = None
+
+def _init_xval_worker(data):
+    global _XVAL_DATA
+    _XVAL_DATA = data
+
+def _xval_fold(training, validation, data=None):
+    """Estimate tuning curves on the training epochs, decode the
+    validation epochs, and return the histogram of decoding errors and
+    the time spent in each stage."""
+    if data is None:
+        data = _XVAL_DATA
+    bst, extern, decodefunc, transfunc, tc_kwargs, n_bins, max_error = data
+
+    timings = OrderedDict()
+
+    t0 = time.perf_counter()
+    # estimate place fields using bst[training]
+    tc = auxiliary.TuningCurve1D(bst=bst[training], extern=extern, **tc_kwargs)
+    timings['tuningcurve'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    # decode position using bst[validation]
+    bst_validation = bst[validation]
+    posterior, _, mode_pth, mean_pth = decodefunc(bst_validation, tc)
+    timings['decode'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    # calculate validation error (for current fold) by comapring
+    # decoded pos v target pos
+    target = transfunc(extern, at=bst_validation.bin_centers)
+    hist, bins = np.histogram(np.abs(target - mean_pth), bins=n_bins, range=(0, max_error))
+    timings['error'] = time.perf_counter() - t0
+
+    return hist, bins, timings
+
+def cumulative_dist_decoding_error_using_xval(bst, extern,*, decodefunc=decode1D, tuningcurve=None, k=5, transfunc=None, n_extern=100, extmin=0, extmax=100, sigma=3, n_bins=None, randomize=False, random_state=None, n_jobs=None, return_timings=False):
     """Cumulative distribution of decoding errors during epochs in
     BinnedSpikeTrainArray, evaluated using a k-fold cross-validation
     procedure.
 
+    Folds can be evaluated in a process pool; bst and extern are then
+    sent to each worker process once, rather than with every fold.
+
     Parameters
     ----------
     bst: BinnedSpikeTrainArray
@@ -422,6 +904,17 @@ def cumulative_dist_decoding_error_using_xval(bst, extern,*, decodefunc=decode1D
     n_bins : int
         Number of decoding error bins, ranging from tuningcurve.extmin
         to tuningcurve.extmax.
+    randomize : bool, optional
+        If True, epochs are randomly assigned to folds. Default is False.
+    random_state : int or RandomState, optional
+        Seed for the fold assignment when randomize is True.
+    n_jobs : int, optional
+        Number of processes. Default is None (serial); -1 uses all
+        available cores. decodefunc and transfunc must be picklable
+        (e.g., module-level functions) when n_jobs is not None.
+    return_timings : bool, optional
+        If True, also return the wall time (in seconds) spent in each
+        stage of every fold. Default is False.
 
     Returns
     -------
@@ -429,18 +922,14 @@ def cumulative_dist_decoding_error_using_xval(bst, extern,*, decodefunc=decode1D
     (error, cum_prob)
         (see Fig 3.(b) of "Analysis of Hippocampal Memory Replay Using
         Neural Population Decoding", Fabian Kloosterman, 2012)
+    timings : list of OrderedDicts, only if return_timings is True
+        Time spent estimating tuning curves, decoding, and computing
+        errors, for each fold.
 
     NOTE: should we allow for an optional tuning curve to be specified,
           or should we always recompute it ourselves?
     """
 
-    def _trans_func(extern, at):
-        """Default transform function to map extern into numerical bins"""
-
-        _, ext = extern.asarray(at=at)
-
-        return ext
-
     if transfunc is None:
         transfunc = _trans_func
 
@@ -449,20 +938,31 @@ def cumulative_dist_decoding_error_using_xval(bst, extern,*, decodefunc=decode1D
 
     max_error = extmax - extmin
 
+    tc_kwargs = {'n_extern' : n_extern,
+                 'extmin' : extmin,
+                 'extmax' : extmax,
+                 'sigma' : sigma}
+    data = (bst, extern, decodefunc, transfunc, tc_kwargs, n_bins, max_error)
+
     # indices of training and validation epochs / events
+    folds = list(k_fold_cross_validation(bst.n_epochs, k=k,
+                                         randomize=randomize,
+                                         random_state=random_state))
+
+    n_workers = min(_n_workers(n_jobs), len(folds))
+    if n_workers == 1:
+        results = [_xval_fold(training, validation, data)
+                   for training, validation in folds]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_xval_worker,
+                                 initargs=(data,)) as executor:
+            futures = [executor.submit(_xval_fold, training, validation)
+                       for training, validation in folds]
+            results = [future.result() for future in futures]
 
-    n_bins = n_bins # number of bins for error histogram
     hist = np.zeros(n_bins)
-    for training, validation in k_fold_cross_validation(bst.n_epochs, k=k):
-        # estimate place fields using bst[training]
-        tc = auxiliary.TuningCurve1D(bst=bst[training], extern=extern, n_extern=n_extern, extmin=extmin, extmax=extmax, sigma=sigma)
-        # decode position using bst[validation]
-        posterior, _, mode_pth, mean_pth = decodefunc(bst[validation], tc)
-        # calculate validation error (for current fold) by comapring
-        # decoded pos v target pos
-        target = transfunc(extern, at=bst[validation].bin_centers)
-
-        histnew, bins = np.histogram(np.abs(target - mean_pth), bins=n_bins, range=(0, max_error))
+    for histnew, bins, _ in results:
         hist = hist + histnew
 
     # build cumulative error distribution
@@ -478,6 +978,8 @@ def cumulative_dist_decoding_error_using_xval(bst, extern,*, decodefunc=decode1D
     cumhist = np.append(cumhist, 1)
     bincenters = np.append(bincenters, max_error)
 
+    if return_timings:
+        return cumhist, bincenters, [timings for _, _, timings in results]
     return cumhist, bincenters
 
 def cumulative_dist_decoding_error(bst, *, tuningcurve, extern,
@@ -507,13 +1009,6 @@ def cumulative_dist_decoding_error(bst, *, tuningcurve, extern,
 
     """
 
-    def _trans_func(extern, at):
-        """Default transform function to map extern into numerical bins"""
-
-        _, ext = extern.asarray(at=at)
-
-        return ext
-
     if transfunc is None:
         transfunc = _trans_func
     if n_bins is None:
@@ -21,11 +21,18 @@ __all__ = ['butter_bandpass_filter',
            'butter_lowpass_filtfilt',]
 
 import numpy as np
+import os
 import warnings
 
+from concurrent.futures import ThreadPoolExecutor
 from scipy.signal import butter, lfilter, filtfilt, firwin
 from math import log10, ceil
 
+try:
+    from scipy.signal import oaconvolve
+except ImportError: # scipy < 1.4.0
+    from scipy.signal import fftconvolve as oaconvolve
+
 from .core import AnalogSignalArray
 
 def butter_bandpass(lowcut, highcut, fs, order=5):
@@ -60,8 +67,148 @@ def butter_lowpass_filtfilt(data, *, cutoff, fs, order=5):
     y = filtfilt(b, a, data, padlen=150)
     return y
 
+def _n_workers(n_jobs):
+    """Translate an n_jobs argument into a number of workers.
+
+    None and 1 mean serial execution, and negative values count back
+    from the number of available cores (-1 uses all cores).
+    """
+    if n_jobs is None:
+        return 1
+    n_jobs = int(n_jobs)
+    if n_jobs < 0:
+        n_jobs = max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+    if n_jobs == 0:
+        raise ValueError("n_jobs must be nonzero!")
+    return n_jobs
+
+def _fft_filtfilt(b, x, padlen):
+    """Zero phase FIR filtering (filtfilt) using overlap-add convolution.
+
+    This reproduces filtfilt(b, 1, x, padlen=padlen) along the last axis
+    of x, including the odd extension at the boundaries and the steady
+    state initial conditions of each pass, but performs the convolutions
+    with FFTs, which is much faster for long kernels.
+    """
+    n_taps = len(b)
+    kernel = np.reshape(b, (1,)*(x.ndim-1) + (n_taps,))
+
+    if padlen > 0:
+        left = 2*x[...,[0]] - x[...,padlen:0:-1]
+        right = 2*x[...,[-1]] - x[...,-2:-(padlen+2):-1]
+        ext = np.concatenate((left, x, right), axis=-1)
+    else:
+        ext = x
+
+    def steady_state_pass(y):
+        # prepend (n_taps-1) copies of the first sample, which is what
+        # lfilter_zi amounts to for an FIR filter:
+        head = np.repeat(y[...,[0]], n_taps-1, axis=-1)
+        y = np.concatenate((head, y), axis=-1)
+        return oaconvolve(y, kernel, mode='valid', axes=-1)
+
+    y = steady_state_pass(ext)
+    y = steady_state_pass(y[...,::-1])[...,::-1]
+
+    if padlen > 0:
+        y = y[...,padlen:-padlen]
+    return y
+
+def _fir_filtfilt(b, data, *, n_jobs=None, chunksize=None, method=None):
+    """Apply a zero phase FIR filter along the last axis of data.
+
+    Channels (rows) are split across a thread pool (scipy releases the
+    GIL while filtering), and long signals can additionally be split into
+    overlapping time chunks. Since the impulse response of the forward-
+    backward filter is finite, an overlap of numtaps samples on either
+    side of each chunk makes the chunked result identical to filtering
+    the whole signal at once.
+
+    Parameters
+    ----------
+    b : array
+        FIR filter coefficients.
+    data : ndarray
+        Array of shape (n_samples,) or (n_signals, n_samples).
+    n_jobs : int, optional
+        Number of threads to use. Default is None (serial); -1 uses all
+        available cores.
+    chunksize : int, optional
+        Number of samples per time chunk. Default is None, in which case
+        each channel is filtered in one go.
+    method : string, optional in ['filtfilt', 'fft']; default 'filtfilt'
+        Use scipy.signal.filtfilt ('filtfilt'), or overlap-add FFT
+        convolution ('fft'), which is faster for long kernels.
+
+    Returns
+    -------
+    filtered : ndarray
+        Filtered data with the same shape as data.
+    """
+    if method is None:
+        method = 'filtfilt'
+    if method not in ['filtfilt', 'fft']:
+        raise NotImplementedError(
+            "method '{}' not understood for FIR filtering".format(str(method)))
+
+    data = np.asarray(data)
+    shape = data.shape
+    x = np.atleast_2d(data)
+    x = np.reshape(x, (-1, x.shape[-1]))
+    n_signals, n_samples = x.shape
+
+    n_taps = len(b)
+    padlen = 3*n_taps # scipy.signal.filtfilt default for a=1
+
+    def filt(arr):
+        if method == 'fft':
+            return _fft_filtfilt(b, arr, padlen=padlen)
+        return filtfilt(b, 1, arr, axis=-1, padlen=padlen)
+
+    n_workers = _n_workers(n_jobs)
+
+    if chunksize is None or chunksize >= n_samples:
+        chunks = [(0, n_samples)]
+    else:
+        chunksize = int(max(chunksize, padlen + 1))
+        starts = np.arange(0, n_samples, chunksize)
+        chunks = [(start, min(start + chunksize, n_samples)) for start in starts]
+
+    if n_workers == 1 and len(chunks) == 1:
+        return np.reshape(filt(x), shape)
+
+    # assign channels to workers in contiguous blocks, and pair each
+    # block with every time chunk:
+    n_blocks = min(n_signals, n_workers)
+    blocks = np.array_split(np.arange(n_signals), n_blocks)
+
+    out = np.empty(x.shape, dtype=np.result_type(x.dtype, np.asarray(b).dtype, float))
+
+    def work(block, start, stop):
+        ext_start = max(0, start - n_taps)
+        ext_stop = min(n_samples, stop + n_taps)
+        # make sure that short edge chunks can still be padded:
+        if ext_stop - ext_start <= padlen:
+            ext_start = max(0, ext_stop - padlen - 1)
+            ext_stop = min(n_samples, ext_start + padlen + 1)
+        rows = slice(block[0], block[-1] + 1)
+        y = filt(x[rows, ext_start:ext_stop])
+        out[rows, start:stop] = y[:, start - ext_start:stop - ext_start]
+
+    tasks = [(block, start, stop) for block in blocks for start, stop in chunks]
+
+    if n_workers == 1:
+        for task in tasks:
+            work(*task)
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # consume the iterator so that exceptions are propagated
+            list(executor.map(lambda task: work(*task), tasks))
+
+    return np.reshape(out, shape)
+
 def bandpass_filter(data, lowcut=None, highcut=None, *, numtaps=None,
-                    fs=None):
+                    fs=None, n_jobs=None, chunksize=None, method=None):
     """Band filter data using a zero phase FIR filter (filtfilt).
 
     Parameters
@@ -75,6 +222,16 @@ def bandpass_filter(data, lowcut=None, highcut=None, *, numtaps=None,
         Number of filter taps
     fs : float, optional if AnalogSignalArray is passed
         Sampling frequency (Hz)
+    n_jobs : int, optional
+        Number of threads across which channels (and time chunks) are
+        filtered. Default is None (serial); -1 uses all available cores.
+    chunksize : int, optional
+        If specified, long signals are filtered in overlapping chunks of
+        (approximately) chunksize samples, which can then also be
+        distributed across threads. Default is None (no chunking).
+    method : string, optional in ['filtfilt', 'fft']; default 'filtfilt'
+        Use scipy.signal.filtfilt, or FFT-based overlap-add convolution
+        ('fft'), which is much faster for filters with many taps.
 
     Returns
     -------
@@ -96,7 +253,8 @@ def bandpass_filter(data, lowcut=None, highcut=None, *, numtaps=None,
                    cutoff=[lowcut/(fs/2), highcut/(fs/2)],
                    pass_zero=False)
         # Filter raw data to get ripple data
-        ripple_data = filtfilt(b, 1, data)
+        ripple_data = _fir_filtfilt(b, data, n_jobs=n_jobs,
+                                    chunksize=chunksize, method=method)
         return ripple_data
     elif isinstance(data, AnalogSignalArray):
         if fs is None:
@@ -108,7 +266,8 @@ def bandpass_filter(data, lowcut=None, highcut=None, *, numtaps=None,
                    cutoff=[lowcut/(fs/2), highcut/(fs/2)],
                    pass_zero=False)
         # Filter raw data to get ripple data
-        ripple_data = filtfilt(b,1,data.ydata)
+        ripple_data = _fir_filtfilt(b, data.ydata, n_jobs=n_jobs,
+                                    chunksize=chunksize, method=method)
         # Return a copy of the AnalogSignalArray with the filtered data
         filtered_analogsignalarray = data.copy()
         filtered_analogsignalarray._ydata = ripple_data
@@ -118,7 +277,8 @@ def bandpass_filter(data, lowcut=None, highcut=None, *, numtaps=None,
           "Unknown data type {} to filter.".format(str(type(data))))
 
 def ripple_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
-                       fs=None, verbose=False):
+                       fs=None, verbose=False, n_jobs=None, chunksize=None,
+                       method=None):
     """Filter data to the ripple band (default 150--250 Hz).
 
     Parameters
@@ -132,6 +292,16 @@ def ripple_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
         Number of filter taps
     fs : float, optional if AnalogSignalArray is passed
         Sampling frequency (Hz)
+    n_jobs : int, optional
+        Number of threads across which channels (and time chunks) are
+        filtered. Default is None (serial); -1 uses all available cores.
+    chunksize : int, optional
+        If specified, long signals are filtered in overlapping chunks of
+        (approximately) chunksize samples, which can then also be
+        distributed across threads. Default is None (no chunking).
+    method : string, optional in ['filtfilt', 'fft']; default 'filtfilt'
+        Use scipy.signal.filtfilt, or FFT-based overlap-add convolution
+        ('fft'), which is much faster for filters with many taps.
 
     Returns
     -------
@@ -158,7 +328,10 @@ def ripple_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
                            lowcut=lowcut,
                            highcut=highcut,
                            numtaps=numtaps,
-                           fs=fs)
+                           fs=fs,
+                           n_jobs=n_jobs,
+                           chunksize=chunksize,
+                           method=method)
 
 def approx_number_of_taps(fs, delta_f, delta1=None, delta2=None, verbose=False):
     """Docstring goes here.
@@ -192,7 +365,8 @@ def approx_number_of_taps(fs, delta_f, delta1=None, delta2=None, verbose=False):
     return numtaps
 
 def delta_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
-                       fs=None, verbose=False):
+                       fs=None, verbose=False, n_jobs=None, chunksize=None,
+                       method=None):
     """Filter data to the rodent delta band (default 1--4 Hz).
 
     Parameters
@@ -206,6 +380,16 @@ def delta_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
         Number of filter taps
     fs : float, optional if AnalogSignalArray is passed
         Sampling frequency (Hz)
+    n_jobs : int, optional
+        Number of threads across which channels (and time chunks) are
+        filtered. Default is None (serial); -1 uses all available cores.
+    chunksize : int, optional
+        If specified, long signals are filtered in overlapping chunks of
+        (approximately) chunksize samples, which can then also be
+        distributed across threads. Default is None (no chunking).
+    method : string, optional in ['filtfilt', 'fft']; default 'filtfilt'
+        Use scipy.signal.filtfilt, or FFT-based overlap-add convolution
+        ('fft'), which is much faster for filters with many taps.
 
     Returns
     -------
@@ -234,10 +418,14 @@ def delta_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
                            lowcut=lowcut,
                            highcut=highcut,
                            numtaps=numtaps,
-                           fs=fs)
+                           fs=fs,
+                           n_jobs=n_jobs,
+                           chunksize=chunksize,
+                           method=method)
 
 def theta_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
-                       fs=None, verbose=False):
+                       fs=None, verbose=False, n_jobs=None, chunksize=None,
+                       method=None):
     """Filter data to the rodent theta band (default 6--12 Hz).
 
     Parameters
@@ -251,6 +439,16 @@ def theta_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
         Number of filter taps
     fs : float, optional if AnalogSignalArray is passed
         Sampling frequency (Hz)
+    n_jobs : int, optional
+        Number of threads across which channels (and time chunks) are
+        filtered. Default is None (serial); -1 uses all available cores.
+    chunksize : int, optional
+        If specified, long signals are filtered in overlapping chunks of
+        (approximately) chunksize samples, which can then also be
+        distributed across threads. Default is None (no chunking).
+    method : string, optional in ['filtfilt', 'fft']; default 'filtfilt'
+        Use scipy.signal.filtfilt, or FFT-based overlap-add convolution
+        ('fft'), which is much faster for filters with many taps.
 
     Returns
     -------
@@ -279,10 +477,14 @@ def theta_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
                            lowcut=lowcut,
                            highcut=highcut,
                            numtaps=numtaps,
-                           fs=fs)
+                           fs=fs,
+                           n_jobs=n_jobs,
+                           chunksize=chunksize,
+                           method=method)
 
 def gamma_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
-                       fs=None, verbose=False):
+                       fs=None, verbose=False, n_jobs=None, chunksize=None,
+                       method=None):
     """Filter data to the rodent gamma band (default 32--100 Hz).
 
     Parameters
@@ -296,6 +498,16 @@ def gamma_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
         Number of filter taps
     fs : float, optional if AnalogSignalArray is passed
         Sampling frequency (Hz)
+    n_jobs : int, optional
+        Number of threads across which channels (and time chunks) are
+        filtered. Default is None (serial); -1 uses all available cores.
+    chunksize : int, optional
+        If specified, long signals are filtered in overlapping chunks of
+        (approximately) chunksize samples, which can then also be
+        distributed across threads. Default is None (no chunking).
+    method : string, optional in ['filtfilt', 'fft']; default 'filtfilt'
+        Use scipy.signal.filtfilt, or FFT-based overlap-add convolution
+        ('fft'), which is much faster for filters with many taps.
 
     Returns
     -------
@@ -324,10 +536,14 @@ def gamma_band_filter(data, lowcut=None, highcut=None, *, numtaps=None,
                            lowcut=lowcut,
                            highcut=highcut,
                            numtaps=numtaps,
-                           fs=fs)
+                           fs=fs,
+                           n_jobs=n_jobs,
+                           chunksize=chunksize,
+                           method=method)
 
 def filter_lfp(data, band=None, *, lowcut=None, highcut=None,
-               numtaps=None, fs=None, verbose=False):
+               numtaps=None, fs=None, verbose=False, n_jobs=None,
+               chunksize=None, method=None):
     """Filter data with a zero phase FIR filtfilt filter.
 
     This is a convenience wrapper function for
@@ -350,6 +566,16 @@ def filter_lfp(data, band=None, *, lowcut=None, highcut=None,
         Number of filter taps
     fs : float, optional if AnalogSignalArray is passed
         Sampling frequency (Hz)
+    n_jobs : int, optional
+        Number of threads across which channels (and time chunks) are
+        filtered. Default is None (serial); -1 uses all available cores.
+    chunksize : int, optional
+        If specified, long signals are filtered in overlapping chunks of
+        (approximately) chunksize samples, which can then also be
+        distributed across threads. Default is None (no chunking).
+    method : string, optional in ['filtfilt', 'fft']; default 'filtfilt'
+        Use scipy.signal.filtfilt, or FFT-based overlap-add convolution
+        ('fft'), which is much faster for filters with many taps.
     verbose : bool, optional
 
     Returns
@@ -385,7 +611,10 @@ def filter_lfp(data, band=None, *, lowcut=None, highcut=None,
               'highcut' : highcut,
               'numtaps' : numtaps,
               'fs' : fs,
-              'verbose' : verbose}
+              'verbose' : verbose,
+              'n_jobs' : n_jobs,
+              'chunksize' : chunksize,
+              'method' : method}
 
     if band == 'ripple':
         return ripple_band_filter(**kwargs)
@@ -0,0 +1,374 @@
+"""Batched forward-backward and Viterbi recursions for hidden Markov
+models.
+
+Replay analyses score thousands of short (5--30 bin) events, and going
+through hmmlearn one sequence at a time makes the Python overhead per
+event dominate. Here, events are padded into a single array of shape
+(n_events, max_len, n_states), and the recursions run over all events
+at once, one time step at a time. Padded steps are masked out, so that
+the results of each event are the same as when it is decoded on its
+own.
+
+The transition matrix and initial state distribution may carry leading
+batch dimensions (e.g., one transition matrix per shuffle), which are
+broadcast against the events, so that many models can be evaluated on
+the same emissions in one pass.
+
+All computations are done in log space, using the max trick to turn
+each step of the recursion into a matrix product.
+
+ForwardFilter runs the same forward recursion online, one bin at a
+time, for Poisson emissions, with optional fixed-lag smoothing.
+"""
+
+__all__ = ['pad_sequences',
+           'unpad_sequences',
+           'forward',
+           'backward',
+           'posteriors',
+           'viterbi',
+           'ForwardFilter']
+
+import numpy as np
+
+from scipy.special import gammaln
+
+def _log(x):
+    with np.errstate(divide='ignore'):
+        return np.log(x)
+
+def pad_sequences(framelogprob, lengths):
+    """Pad concatenated sequences into an array with one row per event.
+
+    Parameters
+    ----------
+    framelogprob : array of shape (n_samples, n_states)
+        Emission log likelihoods of all events, concatenated in time.
+    lengths : array-like of shape (n_events,)
+        Number of samples in each event.
+
+    Returns
+    -------
+    padded : array of shape (n_events, max_len, n_states)
+        Emission log likelihoods, zero beyond the end of each event.
+    mask : boolean array of shape (n_events, max_len)
+        True for samples within an event.
+    """
+    lengths = np.asarray(lengths, dtype=int)
+    n_states = framelogprob.shape[-1]
+    max_len = lengths.max() if len(lengths) else 0
+    mask = np.arange(max_len) < lengths[:, np.newaxis]
+    padded = np.zeros((len(lengths), max_len, n_states))
+    padded[mask] = framelogprob
+    return padded, mask
+
+def unpad_sequences(padded, mask):
+    """Concatenate the unmasked samples of padded events in time.
+
+    Leading batch dimensions of padded, before (n_events, max_len), are
+    kept.
+    """
+    return padded[..., mask, :]
+
+def forward(log_startprob, log_transmat, padded, mask, return_lattice=True):
+    """Forward recursion for a batch of padded events.
+
+    Parameters
+    ----------
+    log_startprob : array of shape (..., n_states)
+    log_transmat : array of shape (..., n_states, n_states)
+        Log transition probabilities, where A_{ij} = Pr(S_{t+1}=j|S_t=i).
+        Leading dimensions are broadcast against the events, e.g., a
+        shape of (n_models, n_states, n_states) gives results of shape
+        (n_models, n_events, ...).
+    padded : array of shape (n_events, max_len, n_states)
+    mask : boolean array of shape (n_events, max_len)
+    return_lattice : bool, optional
+        If False, the forward lattice is not stored (and None is
+        returned instead), which saves memory when only the log
+        likelihoods are needed. Default is True.
+
+    Returns
+    -------
+    logprob : array of shape (..., n_events)
+        Log likelihood of each event.
+    fwdlattice : array of shape (..., n_events, max_len, n_states)
+        Forward log probabilities; beyond the end of an event, the last
+        valid values are repeated.
+    """
+    n_events, max_len, n_states = padded.shape
+    batch_shape = np.broadcast_shapes(np.shape(log_startprob)[:-1],
+                                      np.shape(log_transmat)[:-2])
+    transmat = np.exp(log_transmat)[..., np.newaxis, :, :]
+
+    fwdlattice = None
+    if return_lattice:
+        fwdlattice = np.empty(batch_shape + (n_events, max_len, n_states))
+    if max_len == 0:
+        return np.zeros(batch_shape + (n_events,)), fwdlattice
+
+    alpha = np.asarray(log_startprob)[..., np.newaxis, :] + padded[:, 0]
+    alpha = np.broadcast_to(alpha, batch_shape + (n_events, n_states)).copy()
+    if return_lattice:
+        fwdlattice[..., 0, :] = alpha
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for t in range(1, max_len):
+            amax = alpha.max(axis=-1, keepdims=True)
+            amax[~np.isfinite(amax)] = 0
+            step = _log(np.matmul(np.exp(alpha - amax)[..., np.newaxis, :], transmat)[..., 0, :])
+            step += amax + padded[:, t]
+            alpha = np.where(mask[:, t, np.newaxis], step, alpha)
+            if return_lattice:
+                fwdlattice[..., t, :] = alpha
+
+        amax = alpha.max(axis=-1, keepdims=True)
+        amax[~np.isfinite(amax)] = 0
+        logprob = (_log(np.exp(alpha - amax).sum(axis=-1, keepdims=True)) + amax)[..., 0]
+    return logprob, fwdlattice
+
+def backward(log_transmat, padded, mask):
+    """Backward recursion for a batch of padded events.
+
+    Parameters are as for forward().
+
+    Returns
+    -------
+    bwdlattice : array of shape (..., n_events, max_len, n_states)
+        Backward log probabilities; zero at and beyond the last sample
+        of each event.
+    """
+    n_events, max_len, n_states = padded.shape
+    batch_shape = np.shape(log_transmat)[:-2]
+    transmat = np.exp(log_transmat)[..., np.newaxis, :, :]
+
+    bwdlattice = np.zeros(batch_shape + (n_events, max_len, n_states))
+    beta = np.zeros(batch_shape + (n_events, n_states))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for t in range(max_len - 2, -1, -1):
+            obs = padded[:, t+1] + beta
+            omax = obs.max(axis=-1, keepdims=True)
+            omax[~np.isfinite(omax)] = 0
+            step = _log(np.matmul(transmat, np.exp(obs - omax)[..., np.newaxis])[..., 0])
+            step += omax
+            beta = np.where(mask[:, t+1, np.newaxis], step, 0)
+            bwdlattice[..., t, :] = beta
+    return bwdlattice
+
+def posteriors(fwdlattice, bwdlattice, mask):
+    """State posteriors of the unmasked samples, concatenated in time.
+
+    Returns
+    -------
+    posteriors : array of shape (..., n_samples, n_states)
+    """
+    log_gamma = unpad_sequences(fwdlattice + bwdlattice, mask)
+    log_gamma -= log_gamma.max(axis=-1, keepdims=True)
+    gamma = np.exp(log_gamma)
+    gamma /= gamma.sum(axis=-1, keepdims=True)
+    return gamma
+
+def viterbi(log_startprob, log_transmat, padded, mask):
+    """Most likely state sequence of each event in a batch.
+
+    Parameters are as for forward(), but log_startprob and log_transmat
+    may not have leading batch dimensions.
+
+    Returns
+    -------
+    logprob : array of shape (n_events,)
+        Log probability of the most likely state sequence of each event.
+    state_sequences : array of shape (n_samples,)
+        Most likely states of all events, concatenated in time.
+    """
+    n_events, max_len, n_states = padded.shape
+    lengths = mask.sum(axis=1)
+    if max_len == 0:
+        return np.zeros(n_events), np.zeros(0, dtype=int)
+
+    backpointers = np.zeros((n_events, max_len, n_states), dtype=int)
+    delta = log_startprob + padded[:, 0]
+    for t in range(1, max_len):
+        # (n_events, from, to)
+        trans = delta[:, :, np.newaxis] + log_transmat
+        backpointers[:, t] = trans.argmax(axis=1)
+        step = np.take_along_axis(trans, backpointers[:, t][:, np.newaxis], axis=1)[:, 0]
+        step += padded[:, t]
+        delta = np.where(mask[:, t, np.newaxis], step, delta)
+
+    events = np.arange(n_events)
+    states = np.zeros((n_events, max_len), dtype=int)
+    state = delta.argmax(axis=1)
+    logprob = delta[events, state]
+    states[events, np.maximum(lengths - 1, 0)] = state
+    for t in range(max_len - 2, -1, -1):
+        within = t < lengths - 1
+        state = np.where(within, backpointers[events, t+1, state], state)
+        states[within, t] = state[within]
+
+    return logprob, states[mask]
+
+class ForwardFilter:
+    """Online forward filter for an HMM with independent Poisson
+    emissions.
+
+    Each call to update() advances the filter by one bin, in O(K^2 +
+    K*n_units) time for K states, using buffers that are allocated up
+    front. The recursion is run in probability space, with the state
+    distribution renormalized at every step, and the log likelihood of
+    all bins so far is accumulated from the normalization constants.
+
+    With lag > 0, the filter also keeps the last lag+1 steps, and
+    smooths the state distribution of the bin lag steps in the past
+    with a backward pass over the newer bins, in O(lag*K^2) time.
+
+    Parameters
+    ----------
+    startprob : array of shape (n_states,)
+    transmat : array of shape (n_states, n_states)
+        Transition probabilities, where A_{ij} = Pr(S_{t+1}=j|S_t=i).
+    means : array of shape (n_states, n_units)
+        Expected spike counts per bin.
+    lag : int, optional
+        Number of bins for fixed-lag smoothing. Default is 0 (filtering
+        only).
+
+    Examples
+    --------
+    >>> ff = ForwardFilter(hmm.startprob_, hmm.transmat_, hmm.means_, lag=3)
+    >>> for counts in stream:
+    >>>     filtered = ff.update(counts)
+    >>>     smoothed = ff.smoothed  # state distribution 3 bins ago
+    """
+
+    def __init__(self, startprob, transmat, means, *, lag=0):
+        self._startprob = np.array(startprob, dtype=float)
+        self._transmat = np.array(transmat, dtype=float)
+        means = np.asarray(means, dtype=float)
+        # log rates with xlogy semantics: a zero rate contributes 0 to the
+        # log likelihood of a zero count, and rules the state out for a
+        # nonzero count (instead of 0*-inf = NaN in the dot product)
+        zero_rates = means == 0
+        self._log_means = np.log(np.where(zero_rates, 1, means))
+        self._zero_rates = zero_rates.astype(float) if zero_rates.any() else None
+        self._sum_means = means.sum(axis=1)
+
+        assert float(lag).is_integer() and lag >= 0, "lag must be a non-negative integer!"
+        self._lag = int(lag)
+
+        n_states = len(self._startprob)
+        self._alpha = np.empty(n_states)
+        self._logb = np.empty(n_states)
+        self._b = np.empty(n_states)
+        # ring buffers of the last lag+1 filtered distributions and
+        # (scaled) emission likelihoods:
+        self._alphas = np.empty((self._lag + 1, n_states))
+        self._bs = np.empty((self._lag + 1, n_states))
+        self._beta = np.empty(n_states)
+        self._tmp = np.empty(n_states)
+        self._counts = np.empty(means.shape[1])
+        self._ruled_out = np.empty(n_states, dtype=bool)
+        self._smoothed = np.full(n_states, np.nan)
+        self.reset()
+
+    def reset(self):
+        """Start a new sequence."""
+        self._alpha[:] = np.nan
+        self._smoothed[:] = np.nan
+        self._pos = -1
+        self.n_updates = 0
+        self.logprob = 0.0
+
+    @property
+    def lag(self):
+        return self._lag
+
+    @property
+    def filtered(self):
+        """Filtered state distribution Pr(S_t|x_1..x_t) of the newest bin."""
+        return self._alpha
+
+    @property
+    def smoothed(self):
+        """Smoothed state distribution Pr(S_{t-lag}|x_1..x_t), or NaNs
+        while fewer than lag+1 bins have been seen."""
+        return self._smoothed
+
+    def update(self, counts):
+        """Add the spike counts of the next bin.
+
+        Parameters
+        ----------
+        counts : array_like of shape (n_units,)
+
+        Returns
+        -------
+        filtered : array of shape (n_states,)
+            Filtered state distribution of this bin. The array is reused
+            (overwritten) by the next update; copy it to keep it.
+
+        Raises
+        ------
+        ValueError
+            If the counts have zero probability under every reachable
+            state, e.g., when a unit with a zero rate in all states
+            spikes. The filter is left unchanged, so that the stream can
+            be continued, or restarted with reset().
+        """
+        alpha, logb, b, tmp = self._alpha, self._logb, self._b, self._tmp
+        # (integer) counts are copied into a float buffer, without
+        # allocating a new array
+        np.copyto(self._counts, counts)
+        counts = self._counts
+
+        # Poisson log likelihood of counts under every state
+        np.dot(self._log_means, counts, out=logb)
+        np.subtract(logb, self._sum_means, out=logb)
+        if self._zero_rates is not None:
+            # states with a zero rate for a unit that spiked:
+            np.dot(self._zero_rates, counts, out=b)
+            np.greater(b, 0, out=self._ruled_out)
+            np.copyto(logb, -np.inf, where=self._ruled_out)
+        logb_max = logb.max()
+        if logb_max == -np.inf:
+            raise ValueError("the counts have zero probability under every state!")
+        np.subtract(logb, logb_max, out=logb)
+        np.exp(logb, out=b)
+
+        if self.n_updates == 0:
+            np.multiply(self._startprob, b, out=tmp)
+        else:
+            np.dot(alpha, self._transmat, out=tmp)
+            np.multiply(tmp, b, out=tmp)
+        scale = tmp.sum()
+        if scale == 0:
+            raise ValueError("the counts have zero probability under every reachable state!")
+        np.divide(tmp, scale, out=alpha)
+        np.add(counts, 1, out=counts)
+        gammaln(counts, out=counts)
+        self.logprob += np.log(scale) + logb_max - counts.sum()
+        self.n_updates += 1
+
+        if self._lag > 0:
+            self._pos = (self._pos + 1) % (self._lag + 1)
+            self._alphas[self._pos] = alpha
+            self._bs[self._pos] = b
+            if self.n_updates > self._lag:
+                self._smooth()
+        else:
+            self._smoothed[:] = alpha
+
+        return alpha
+
+    def _smooth(self):
+        """Backward pass from the newest bin to the bin lag steps ago."""
+        beta, tmp = self._beta, self._tmp
+        n_slots = self._lag + 1
+        beta[:] = 1
+        for ss in range(self._lag):
+            idx = (self._pos - ss) % n_slots
+            np.multiply(self._bs[idx], beta, out=tmp)
+            np.dot(self._transmat, tmp, out=beta)
+            np.divide(beta, beta.sum(), out=beta)
+        oldest = (self._pos + 1) % n_slots
+        np.multiply(self._alphas[oldest], beta, out=self._smoothed)
+        np.divide(self._smoothed, self._smoothed.sum(), out=self._smoothed)
@@ -11,14 +11,26 @@ with hmmlearn.
 from hmmlearn.hmm import PoissonHMM as PHMM
 from .core import BinnedSpikeTrainArray # may have to be from . import core, and then core.BinnedSpikeTrainArray
 from .utils import swap_cols, swap_rows
+from .decoding import _sliding_window_counts, k_fold_cross_validation
+from .auxiliary import ResultsContainer
+from .filtering import _n_workers
+from . import hmmbatch
 from warnings import warn
 import numpy as np
-from pandas import unique
 from . import plotting
 from matplotlib.pyplot import subplots
+from scipy import sparse
+from scipy.special import logsumexp
 import copy
+import time
+import weakref
 
-__all__ = ['PoissonHMM']
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+__all__ = ['PoissonHMM',
+           'model_selection']
 
 class PoissonHMM(PHMM):
     """Nelpy extension of PoissonHMM: Hidden Markov Model with
@@ -125,6 +137,10 @@ class PoissonHMM(PHMM):
         self._extern_ = None
         # self._extern_map = None
 
+        # emission log likelihoods of recently used BinnedSpikeTrainArrays
+        self._emission_cache = OrderedDict()
+        self._emission_cache_size = 4
+
         # create shortcuts to super() methods that are overridden in
         # this class
         self._fit = PHMM.fit
@@ -136,6 +152,28 @@ class PoissonHMM(PHMM):
 
         self._sample = PHMM.sample
 
+    def __getstate__(self):
+        # cached emission log likelihoods are not pickled: they hold weak
+        # references to BinnedSpikeTrainArrays, and can be recomputed
+        try:
+            state = super().__getstate__()
+        except AttributeError:
+            state = self.__dict__
+        state = dict(state)
+        state['_emission_cache'] = OrderedDict()
+        return state
+
+    def __deepcopy__(self, memo):
+        # deep copies (e.g., with shuffled transition matrices) share the
+        # emission cache, whose keys include the means of the model
+        cls = self.__class__
+        result = cls.__new__(cls)
+        memo[id(self)] = result
+        memo[id(self._emission_cache)] = self._emission_cache
+        for attr, value in self.__dict__.items():
+            setattr(result, attr, copy.deepcopy(value, memo))
+        return result
+
     def __repr__(self):
         try:
             rep = super().__repr__()
@@ -336,7 +374,10 @@ class PoissonHMM(PHMM):
     def _sliding_window_array(self, bst, w=1):
         """Returns an unwrapped data array by sliding w bins one bin at a time.
 
-        If w==1, then bins are non-overlapping.
+        If w==1, then bins are non-overlapping. Windows never cross epoch
+        boundaries, and an epoch shorter than w bins contributes one
+        (partial) window with all of its bins. This is the same windowing
+        as used by the decoders in nelpy.decoding.
 
         Parameters
         ----------
@@ -344,8 +385,9 @@ class PoissonHMM(PHMM):
 
         Returns
         -------
-        unwrapped : new data array of shape (n_sliding_bins, n_units)
-        lengths : array of shape (n_sliding_bins,)
+        unwrapped : contiguous data array of shape (n_sliding_bins, n_units)
+        lengths : array of shape (n_epochs,)
+            Number of sliding bins in each epoch.
         """
 
         if w is None:
@@ -361,51 +403,80 @@ class PoissonHMM(PHMM):
         if not self._has_same_unit_id_order(bst.unit_ids):
             self._reorder_units_by_ids(bst.unit_ids)
 
-        if w == 1:
-            return bst.data.T, bst.lengths
-
-        n_units, t_bins = bst.data.shape
-
-        # if we decode using multiple bins at a time (w>1) then we have to decode each epoch separately:
-
-        # first, we determine the number of bins we will decode. This requires us to scan over the epochs
-        n_bins = 0
-        cumlengths = np.cumsum(bst.lengths)
-        lengths = np.zeros(bst.n_epochs, dtype=np.int)
-        prev_idx = 0
-        for ii, to_idx in enumerate(cumlengths):
-            datalen = to_idx - prev_idx
-            prev_idx = to_idx
-            lengths[ii] = np.max((1,datalen - w + 1))
-
-        n_bins = lengths.sum()
-
-        unwrapped = np.zeros((n_units, n_bins))
-
-        # next, we decode each epoch separately, one bin at a time
-        cum_lengths = np.insert(np.cumsum(lengths),0,0)
-
-        prev_idx = 0
-        for ii, to_idx in enumerate(cumlengths):
-            data = bst.data[:,prev_idx:to_idx]
-            prev_idx = to_idx
-            datacum = np.cumsum(data, axis=1) # ii'th data segment, with column of zeros prepended
-            datacum = np.hstack((np.zeros((n_units,1)), datacum))
-            re = w # right edge ptr
-            # TODO: check if datalen < w and act appropriately
-            if lengths[ii] > 1: # more than one full window fits into data length
-                for tt in range(lengths[ii]):
-                    obs = datacum[:, re] - datacum[:, re-w] # spikes in window of size w
-                    re+=1
-                    post_idx = lengths[ii] + tt
-                    unwrapped[:,post_idx] = obs
-            else: # only one window can fit in, and perhaps only partially. We just take all the data we can get,
-                # and ignore the scaling problem where the window size is now possibly less than bst.ds*w
-                post_idx = cum_lengths[ii]
-                obs = datacum[:, -1] # spikes in window of size at most w
-                unwrapped[:,post_idx] = obs
-
-        return unwrapped.T, lengths
+        return _sliding_window_counts(np.atleast_2d(bst.data), bst.lengths, int(w))
+
+    def _padded_framelogprob(self, bst, w=None):
+        """Emission log likelihoods of the sliding windows of all epochs
+        in bst, padded for nelpy.hmmbatch.
+
+        The emission log likelihoods are cached per (bst, w, means_), so
+        that repeated scoring of the same BinnedSpikeTrainArray, and
+        models that differ only in their transition matrix or initial
+        state distribution (e.g., transmat shuffles of a deep copy),
+        only re-run the recursions. The cache holds the most recently
+        used BinnedSpikeTrainArrays, and assumes that their data are not
+        modified in place.
+
+        Returns
+        -------
+        padded : array of shape (n_epochs, max_len, n_components)
+        mask : boolean array of shape (n_epochs, max_len)
+        lengths : array of shape (n_epochs,)
+        """
+        if w is None:
+            w = 1
+
+        # re-order units first, so that the key reflects the means used
+        if not self._has_same_unit_id_order(bst.unit_ids):
+            self._reorder_units_by_ids(bst.unit_ids)
+
+        means = np.ascontiguousarray(self.means_)
+        key = (id(bst), int(w), means.shape, hash(means.tobytes()))
+        cache = self._emission_cache
+        if key in cache:
+            bst_ref, padded, mask, lengths = cache[key]
+            # the weak reference guards against a re-used id()
+            if bst_ref() is bst:
+                cache.move_to_end(key)
+                return padded, mask, lengths
+
+        windowed_arr, lengths = self._sliding_window_array(bst=bst, w=w)
+        framelogprob = self._compute_log_likelihood(windowed_arr)
+        padded, mask = hmmbatch.pad_sequences(framelogprob, lengths)
+
+        cache[key] = (weakref.ref(bst), padded, mask, lengths)
+        while len(cache) > self._emission_cache_size:
+            cache.popitem(last=False)
+        return padded, mask, lengths
+
+    def clear_emission_cache(self):
+        """Discard all cached emission log likelihoods."""
+        self._emission_cache.clear()
+
+    def _log_params(self):
+        """Log initial state and transition probabilities."""
+        with np.errstate(divide='ignore'):
+            return np.log(self.startprob_), np.log(self.transmat_)
+
+    def forward_filter(self, lag=0):
+        """Return an online forward filter for this model.
+
+        The filter takes the spike counts of one bin at a time, with
+        units in the order of self.unit_ids, and keeps the filtered (and,
+        if lag > 0, fixed-lag smoothed) state distribution up to date.
+        It uses a copy of the current model parameters.
+
+        Parameters
+        ----------
+        lag : int, optional
+            Number of bins for fixed-lag smoothing. Default is 0.
+
+        Returns
+        -------
+        ff : nelpy.hmmbatch.ForwardFilter
+        """
+        return hmmbatch.ForwardFilter(self.startprob_, self.transmat_,
+                                      self.means_, lag=lag)
 
     def decode(self, X, lengths=None, w=None, algorithm=None):
         """Find most likely state sequence corresponding to ``X``.
@@ -451,17 +522,24 @@ class PoissonHMM(PHMM):
                 raise NotImplementedError ("sliding window decoding for feature matrices not yet implemented!")
             return self._decode(self, X=X, lengths=lengths), None
         else:
-            # we have a BinnedSpikeTrainArray
-            logprobs = []
-            state_sequences = []
-            centers = []
-            for seq in X:
-                windowed_arr, lengths = self._sliding_window_array(bst=seq, w=w)
-                logprob, state_sequence = self._decode(self, windowed_arr, lengths=lengths, algorithm=algorithm)
-                logprobs.append(logprob)
-                state_sequences.append(state_sequence)
-                centers.append(seq.centers)
-            return logprobs, state_sequences, centers
+            # we have a BinnedSpikeTrainArray; all epochs are decoded at once
+            if (algorithm or self.algorithm) != 'viterbi':
+                logprobs = []
+                state_sequences = []
+                centers = []
+                for seq in X:
+                    windowed_arr, lengths = self._sliding_window_array(bst=seq, w=w)
+                    logprob, state_sequence = self._decode(self, windowed_arr, lengths=lengths, algorithm=algorithm)
+                    logprobs.append(logprob)
+                    state_sequences.append(state_sequence)
+                    centers.append(seq.centers)
+                return logprobs, state_sequences, centers
+            padded, mask, lengths = self._padded_framelogprob(X, w=w)
+            logprobs, state_sequences = hmmbatch.viterbi(*self._log_params(), padded, mask)
+            bdries = np.cumsum(lengths)[:-1]
+            state_sequences = np.split(state_sequences, bdries)
+            centers = np.split(X.bin_centers, np.cumsum(X.lengths)[:-1])
+            return list(logprobs), state_sequences, centers
 
     def predict_proba(self, X, lengths=None, w=None, returnLengths=False):
         """Compute the posterior probability for each state in the model.
@@ -483,7 +561,6 @@ class PoissonHMM(PHMM):
         """
 
         if not isinstance(X, BinnedSpikeTrainArray):
-            print("we have a " + str(type(X)))
             # assume we have a feature matrix
             if w is not None:
                 raise NotImplementedError ("sliding window decoding for feature matrices not yet implemented!")
@@ -491,11 +568,15 @@ class PoissonHMM(PHMM):
                 return np.transpose(self._predict_proba(self, X, lengths=lengths)), lengths
             return np.transpose(self._predict_proba(self, X, lengths=lengths))
         else:
-            # we have a BinnedSpikeTrainArray
-            windowed_arr, lengths = self._sliding_window_array(bst=X, w=w)
+            # we have a BinnedSpikeTrainArray; all epochs are scored at once
+            padded, mask, lengths = self._padded_framelogprob(X, w=w)
+            log_startprob, log_transmat = self._log_params()
+            _, fwdlattice = hmmbatch.forward(log_startprob, log_transmat, padded, mask)
+            bwdlattice = hmmbatch.backward(log_transmat, padded, mask)
+            posteriors = np.transpose(hmmbatch.posteriors(fwdlattice, bwdlattice, mask))
             if returnLengths:
-                return np.transpose(self._predict_proba(self, windowed_arr, lengths=lengths)), lengths
-            return np.transpose(self._predict_proba(self, windowed_arr, lengths=lengths))
+                return posteriors, lengths
+            return posteriors
 
     def predict(self, X, lengths=None, w=None):
         """Find most likely state sequence corresponding to ``X``.
@@ -587,15 +668,14 @@ class PoissonHMM(PHMM):
                 raise NotImplementedError ("sliding window decoding for feature matrices not yet implemented!")
             return self._score_samples(self, X, lengths=lengths)
         else:
-            # we have a BinnedSpikeTrainArray
-            logprobs = []
-            posteriors = []
-            for seq in X:
-                windowed_arr, lengths = self._sliding_window_array(bst=seq, w=w)
-                logprob, posterior = self._score_samples(self, X=windowed_arr, lengths=lengths)
-                logprobs.append(logprob)
-                posteriors.append(posterior.T)
-            return logprobs, posteriors
+            # we have a BinnedSpikeTrainArray; all epochs are scored at once
+            padded, mask, lengths = self._padded_framelogprob(X, w=w)
+            log_startprob, log_transmat = self._log_params()
+            logprobs, fwdlattice = hmmbatch.forward(log_startprob, log_transmat, padded, mask)
+            bwdlattice = hmmbatch.backward(log_transmat, padded, mask)
+            posteriors = hmmbatch.posteriors(fwdlattice, bwdlattice, mask)
+            posteriors = [posterior.T for posterior in np.split(posteriors, np.cumsum(lengths)[:-1])]
+            return list(logprobs), posteriors
 
     def score(self, X, lengths=None, w=None):
         """Compute the log probability under the model.
@@ -630,13 +710,10 @@ class PoissonHMM(PHMM):
                 raise NotImplementedError ("sliding window decoding for feature matrices not yet implemented!")
             return self._score(self, X, lengths=lengths)
         else:
-            # we have a BinnedSpikeTrainArray
-            logprobs = []
-            for seq in X:
-                windowed_arr, lengths = self._sliding_window_array(bst=seq, w=w)
-                logprob = self._score(self, X=windowed_arr, lengths=lengths)
-                logprobs.append(logprob)
-        return logprobs
+            # we have a BinnedSpikeTrainArray; all epochs are scored at once
+            padded, mask, _ = self._padded_framelogprob(X, w=w)
+            logprobs, _ = hmmbatch.forward(*self._log_params(), padded, mask)
+        return list(logprobs)
 
     def _cum_score_per_bin(self, X, lengths=None, w=None):
         """Compute the log probability under the model, cumulatively for each bin per event."""
@@ -647,15 +724,12 @@ class PoissonHMM(PHMM):
                 raise NotImplementedError ("sliding window decoding for feature matrices not yet implemented!")
             return self._score(self, X, lengths=lengths)
         else:
-            # we have a BinnedSpikeTrainArray
-            logprobs = []
-            for seq in X:
-                windowed_arr, lengths = self._sliding_window_array(bst=seq, w=w)
-                n_bins, _ = windowed_arr.shape
-                for ii in range(1, n_bins+1):
-                    logprob = self._score(self, X=windowed_arr[:ii,:])
-                    logprobs.append(logprob)
-        return logprobs
+            # we have a BinnedSpikeTrainArray; the log probability of the
+            # first ii bins of an event is given by its forward lattice
+            padded, mask, _ = self._padded_framelogprob(X, w=w)
+            _, fwdlattice = hmmbatch.forward(*self._log_params(), padded, mask)
+            logprobs = logsumexp(hmmbatch.unpad_sequences(fwdlattice, mask), axis=-1)
+        return list(logprobs)
 
     def fit(self, X, lengths=None, w=None):
         """Estimate model parameters using nelpy objects.
@@ -699,25 +773,29 @@ class PoissonHMM(PHMM):
         """Learn a mapping from the internal state space, to an external
         augmented space (e.g. position).
 
-        X : BinnedSpikeTrainArray
+        The state posteriors of all bins are accumulated into external
+        bins with one sparse matrix product, of the posteriors with a
+        one-hot encoding of the external bin of every (non-NaN) sample.
+
+        X : BinnedSpikeTrainArray, or feature matrix (n_samples, n_units)
 
         ext : array-like
-            array of external correlates (n_bins, )
-        n_extern : int
-            number of extern variables, with range 0,.. n_extern-1
+            array of external correlates (n_bins, ), with integer values
+            in 0,.. n_extern-1 (NaN values are ignored); or, for a 2D
+            external correlate, (n_bins, 2) with integer values in
+            0,.. n_extern[0]-1 and 0,.. n_extern[1]-1.
+        n_extern : int, or tuple of two ints for a 2D external correlate
+            number of extern variables, with range 0,.. n_extern-1. If
+            None, the distinct values in ext (1D only) are used, in
+            sorted order.
 
         save : bool
             stores extern in PoissonHMM if true, discards it if not
 
-        self.extern_ of size (n_components, n_extern)
+        self.extern_ of size (n_components, n_extern), or
+        (n_components, n_extern[0], n_extern[1]) for a 2D correlate
         """
 
-        ext_map = np.arange(n_extern)
-        if n_extern is None:
-            n_extern = len(unique(ext))
-            for ii, ele in enumerate(unique(ext)):
-                ext_map[ele] = ii
-
         # idea: here, ext can be anything, and n_extern should be range
         # we can e.g., define extern correlates {leftrun, rightrun} and
         # fit the mapping. This is not expexted to be good at all for
@@ -733,28 +811,44 @@ class PoissonHMM(PHMM):
         # xx_mid = np.linspace(x0,xl,n_extern+1)[:-1]; xx_mid += (xx_mid[1]-xx_mid[0])/2
         # ext = np.digitize(xpos, xx_left) - 1 # spatial bin numbers
 
-        extern = np.zeros((self.n_components, n_extern))
+        ext = np.asarray(ext, dtype=float)
+        if ext.ndim == 1:
+            valid = ~np.isnan(ext)
+            if n_extern is None:
+                ext_values, ext_idx = np.unique(ext[valid], return_inverse=True)
+                n_extern = len(ext_values)
+            else:
+                ext_idx = ext[valid].astype(int)
+            shape = (int(n_extern),)
+        elif ext.ndim == 2 and ext.shape[1] == 2:
+            if n_extern is None or np.size(n_extern) != 2:
+                raise ValueError("n_extern must be a tuple (n_x, n_y) for a 2D external correlate!")
+            shape = tuple(int(n) for n in n_extern)
+            valid = ~np.isnan(ext).any(axis=1)
+            ext_idx = np.ravel_multi_index(ext[valid].astype(int).T, shape)
+        else:
+            raise ValueError("ext must have shape (n_bins,) or (n_bins, 2)!")
 
-        if not isinstance(X, BinnedSpikeTrainArray):
+        if isinstance(X, BinnedSpikeTrainArray):
+            posteriors = self.predict_proba(X=X, lengths=lengths, w=w)
+        else:
             # assume we have a feature matrix
             if w is not None:
                 raise NotImplementedError ("sliding window decoding for feature matrices not yet implemented!")
-            posteriors = self.predict_proba(X=X, lengths=lengths, w=w)
-        else:
-            # we have a BinnedSpikeTrainArray
-            posteriors = self.predict_proba(X=X, lengths=lengths, w=w)
-        posteriors = np.vstack(posteriors.T)  # 1D array of states, of length n_bins
+            posteriors = self.predict_proba(X=X, lengths=lengths)
+        # posteriors has shape (n_components, n_bins)
 
-        if len(posteriors) != len(ext):
+        if posteriors.shape[1] != len(ext):
             raise ValueError("ext must have same length as decoded state sequence!")
 
-        for ii, posterior in enumerate(posteriors):
-            if not np.isnan(ext[ii]):
-                extern[:,ext_map[int(ext[ii])]] += np.transpose(posterior)
+        n_bins = int(np.prod(shape))
+        onehot = sparse.csr_matrix((np.ones(len(ext_idx)), (np.arange(len(ext_idx)), ext_idx)),
+                                   shape=(len(ext_idx), n_bins))
+        extern = np.asarray((onehot.T @ posteriors[:, valid].T).T)
 
         # normalize extern tuning curves:
-        colsum = np.tile(extern.sum(axis=1),(n_extern,1)).T
-        extern = extern/colsum
+        extern = extern / extern.sum(axis=1, keepdims=True)
+        extern = extern.reshape((self.n_components,) + shape)
 
         if save:
             self._extern_ = extern
@@ -792,6 +886,9 @@ class PoissonHMM(PHMM):
 
         ext_posteriors : array, shape (n_extern, n_samples)
             State-membership probabilities for each sample in ``X``.
+            For a 2D external mapping, the posterior distribution over
+            external bins, of shape (n_x, n_y, n_samples), with mode_pth
+            and mean_pth of shape (2, n_samples) (each in range 0 to 1).
 
         See Also
         --------
@@ -801,21 +898,30 @@ class PoissonHMM(PHMM):
         score : Compute the log probability under the model.
         """
 
-        _, n_extern = self._extern_.shape
-
         if not isinstance(X, BinnedSpikeTrainArray):
             # assume we have a feature matrix
-            raise NotImplementedError("not implemented yet.")
             if w is not None:
                 raise NotImplementedError ("sliding window decoding for feature matrices not yet implemented!")
-        else:
-            # we have a BinnedSpikeTrainArray
-            pass
+            X = np.asarray(X)
+            if lengths is None:
+                lengths = [len(X)]
         state_posteriors, lengths = self.predict_proba(X=X, lengths=lengths, w=w, returnLengths=True)
-        fixy = np.mean(self._extern_ * np.arange(n_extern), axis=1)
-        mean_pth = np.sum(state_posteriors.T*fixy, axis=1) # range 0 to 1
-        ext_posteriors = np.dot((self._extern_ * np.arange(n_extern)).T, state_posteriors)
-        mode_pth = np.argmax(ext_posteriors, axis=0)/n_extern # range 0 to n_extern
+
+        if self._extern_.ndim == 3:
+            # 2D external mapping; (n_x, n_y, n_samples)
+            _, n_x, n_y = self._extern_.shape
+            ext_posteriors = np.tensordot(self._extern_, state_posteriors, axes=(0, 0))
+            flat = ext_posteriors.reshape(n_x*n_y, -1)
+            mode_pth = np.array(np.unravel_index(np.argmax(flat, axis=0), (n_x, n_y)), dtype=float)
+            mode_pth /= np.array([[n_x], [n_y]])
+            mean_pth = np.vstack((np.dot(np.arange(n_x), ext_posteriors.sum(axis=1)) / n_x,
+                                  np.dot(np.arange(n_y), ext_posteriors.sum(axis=0)) / n_y))
+        else:
+            _, n_extern = self._extern_.shape
+            fixy = np.mean(self._extern_ * np.arange(n_extern), axis=1)
+            mean_pth = np.sum(state_posteriors.T*fixy, axis=1) # range 0 to 1
+            ext_posteriors = np.dot((self._extern_ * np.arange(n_extern)).T, state_posteriors)
+            mode_pth = np.argmax(ext_posteriors, axis=0)/n_extern # range 0 to n_extern
 
         bdries = np.cumsum(lengths)
 
@@ -863,6 +969,203 @@ class PoissonHMM(PHMM):
 
         return fig, ax
 
+# data shared by every fit of a model selection sweep; set once per
+# worker process
+_MODEL_SELECTION_ARGS = None
+
+def _init_model_selection_worker(shm_name, shape, dtype, lengths, w, n_iter):
+    global _MODEL_SELECTION_ARGS
+    shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    # keep a reference to shm, so that the buffer stays mapped
+    _MODEL_SELECTION_ARGS = (data, lengths, w, n_iter, shm)
+
+def _epoch_windows(data, lengths, epochs, w):
+    """Sliding windows (n_windows, n_units) of a subset of epochs."""
+    starts = np.insert(np.cumsum(lengths), 0, 0)
+    bins = np.concatenate([np.arange(starts[ee], starts[ee+1]) for ee in epochs])
+    return _sliding_window_counts(data[:, bins], lengths[epochs], w)
+
+def _fit_hmm_task(task, args=None):
+    """Fit a PoissonHMM on the training epochs of task, and score it on
+    the validation epochs.
+
+    Returns the fitted model if task is a refit, and otherwise
+    (validation logprob, n_validation_windows), together with the wall
+    time (in seconds), number of EM iterations and convergence of the
+    fit.
+    """
+    if args is None:
+        args = _MODEL_SELECTION_ARGS[:4]
+    data, lengths, w, n_iter = args
+    n_components, seed, training, validation, refit = task
+
+    X, X_lengths = _epoch_windows(data, lengths, training, w)
+    hmm = PoissonHMM(n_components=n_components, n_iter=n_iter, random_state=seed)
+    t0 = time.perf_counter()
+    hmm.fit(X, lengths=X_lengths)
+    elapsed = time.perf_counter() - t0
+    fit_info = (elapsed, hmm.monitor_.iter, hmm.monitor_.converged)
+
+    if refit:
+        return hmm, fit_info
+
+    X, X_lengths = _epoch_windows(data, lengths, validation, w)
+    return (hmm.score(X, lengths=X_lengths), len(X)), fit_info
+
+def model_selection(bst, n_components, *, n_restarts=10, k=5, w=None,
+                    n_iter=None, randomize=False, random_state=None,
+                    n_jobs=None):
+    """Select the number of states and the initialization of a PoissonHMM
+    by cross-validated log likelihood.
+
+    For every number of states, n_restarts random initializations are
+    fit and scored in k-fold cross-validation over the epochs of bst.
+    The restart with the highest total validation log likelihood is then
+    refit on all epochs. All fits (n_components x restarts x folds, and
+    the final refits) can be run in a process pool, in which case the
+    spike counts are placed in shared memory instead of being copied to
+    every worker.
+
+    Parameters
+    ----------
+    bst : BinnedSpikeTrainArray
+    n_components : int or array-like
+        Number(s) of states to consider.
+    n_restarts : int, optional
+        Number of random initializations per number of states. Default
+        is 10.
+    k : int, or str, optional
+        Number of cross-validation folds over the epochs of bst, with
+        2 <= k <= bst.n_epochs; k='loo' or 'LOO' for leave-one-out
+        cross-validation (k == bst.n_epochs). Default is 5.
+    w : int, optional
+        Number of bins per (sliding) observation window. Default is 1.
+    n_iter : int, optional
+        Maximum number of EM iterations per fit. Default is that of
+        PoissonHMM.
+    randomize : bool, optional
+        If True, epochs are shuffled before being assigned to folds.
+    random_state : int or RandomState, optional
+        Seed for the initializations (and fold assignment).
+    n_jobs : int, optional
+        Number of processes. Default is None (serial); -1 uses all
+        available cores.
+
+    Returns
+    -------
+    results : ResultsContainer
+        With attributes
+            n_components : array of shape (n_settings,)
+            models : list of PoissonHMM
+                Best model per number of states, fit on all epochs.
+            best_n_components : int
+                Number of states with the highest validation log
+                likelihood.
+            best_restart : array of shape (n_settings,)
+            seeds : array of shape (n_settings, n_restarts)
+                random_state of every restart.
+            folds : list of (training, validation) epoch indices
+            cv_logprob : array of shape (n_settings, n_restarts, k)
+                Validation log likelihood of every fit.
+            cv_logprob_per_bin : array of shape (n_settings, n_restarts)
+                Total validation log likelihood over all folds, divided
+                by the number of observation windows.
+            fit_times, n_iterations, converged : arrays of shape (n_settings, n_restarts, k)
+                Wall time (in seconds), number of EM iterations, and
+                convergence of every cross-validation fit.
+            final_fit_times, final_n_iterations : arrays of shape (n_settings,)
+                The same for the final fits on all epochs.
+    """
+    if not isinstance(bst, BinnedSpikeTrainArray):
+        raise NotImplementedError ("support for other datatypes not yet implemented!")
+    if w is None:
+        w = 1
+    n_epochs = int(bst.n_epochs)
+    if k is None:
+        k = 5
+    elif k == 'loo' or k == 'LOO':
+        k = n_epochs
+    if not 2 <= k <= n_epochs:
+        raise ValueError("k must be between 2 and the number of epochs ({}), "
+                         "but {} was given!".format(n_epochs, k))
+
+    n_components = np.atleast_1d(n_components).astype(int)
+    n_settings = len(n_components)
+
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    seeds = random_state.randint(np.iinfo(np.int32).max, size=(n_settings, n_restarts))
+    folds = list(k_fold_cross_validation(n_epochs, k=k,
+                                         randomize=randomize,
+                                         random_state=random_state))
+
+    tasks = [(int(n_components[ii]), int(seeds[ii, rr]), training, validation, False)
+             for ii in range(n_settings)
+             for rr in range(n_restarts)
+             for training, validation in folds]
+
+    data = np.ascontiguousarray(np.atleast_2d(bst.data))
+    lengths = np.asarray(bst.lengths, dtype=int)
+
+    def _final_tasks(best_restart):
+        all_epochs = list(range(n_epochs))
+        return [(int(n_components[ii]), int(seeds[ii, best_restart[ii]]), all_epochs, [], True)
+                for ii in range(n_settings)]
+
+    def _summarize(results):
+        shape = (n_settings, n_restarts, len(folds))
+        cv_logprob = np.array([res[0] for res, _ in results]).reshape(shape)
+        n_windows = np.array([res[1] for res, _ in results]).reshape(shape)
+        fit_info = np.array([info for _, info in results], dtype=float).reshape(shape + (3,))
+        total = cv_logprob.sum(axis=2)
+        return (cv_logprob, total / n_windows.sum(axis=2), fit_info,
+                np.argmax(total, axis=1))
+
+    n_workers = min(_n_workers(n_jobs), max(len(tasks), 1))
+    if n_workers == 1:
+        args = (data, lengths, w, n_iter)
+        cv_logprob, per_bin, fit_info, best_restart = _summarize(
+            [_fit_hmm_task(task, args) for task in tasks])
+        final = [_fit_hmm_task(task, args) for task in _final_tasks(best_restart)]
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        try:
+            np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+            with ProcessPoolExecutor(max_workers=n_workers,
+                                     initializer=_init_model_selection_worker,
+                                     initargs=(shm.name, data.shape, data.dtype,
+                                               lengths, w, n_iter)) as executor:
+                cv_logprob, per_bin, fit_info, best_restart = _summarize(
+                    list(executor.map(_fit_hmm_task, tasks)))
+                final = list(executor.map(_fit_hmm_task, _final_tasks(best_restart)))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    models = []
+    for hmm, _ in final:
+        hmm.assume_attributes(bst)
+        models.append(hmm)
+    final_info = np.array([info for _, info in final], dtype=float).reshape(n_settings, 3)
+
+    best = np.argmax(per_bin[np.arange(n_settings), best_restart])
+
+    return ResultsContainer(n_components=n_components,
+                            models=models,
+                            best_n_components=int(n_components[best]),
+                            best_restart=best_restart,
+                            seeds=seeds,
+                            folds=folds,
+                            cv_logprob=cv_logprob,
+                            cv_logprob_per_bin=per_bin,
+                            fit_times=fit_info[..., 0],
+                            n_iterations=fit_info[..., 1].astype(int),
+                            converged=fit_info[..., 2].astype(bool),
+                            final_fit_times=final_info[:, 0],
+                            final_n_iterations=final_info[:, 1].astype(int),
+                            description="PoissonHMM model selection")
+
 # def score_samples_ext(self, X, lengths=None):
 #         """Compute the log probability under the model and compute posteriors.
 
@@ -903,4 +1206,4 @@ class PoissonHMM(PHMM):
 #                 logprob, posterior = self._score_samples(self, seq.data.T)
 #                 logprobs.append(logprob)
 #                 posteriors.append(posterior)
-#             return logprobs, posteriors
\ No newline at end of file
+#             return logprobs, posteriors
@@ -1,57 +1,114 @@
 """Temporary scoring functions. Needs a lot of work. DEPRECATED"""
 
 import numpy as np
-from itertools import groupby
+
+def _log_transmat(hmm):
+    with np.errstate(divide='ignore'):
+        return np.log(hmm.transmat_)
+
+def _concatenate_sequences(state_sequences, remove_adjacent_duplicates=False):
+    """Concatenate state sequences into one array, with offsets.
+
+    Parameters
+    ----------
+    state_sequences : list of array-like
+    remove_adjacent_duplicates : bool, optional
+        If True, runs of the same state within a sequence are reduced to
+        a single state.
+
+    Returns
+    -------
+    states : array of shape (n_total,)
+    offsets : array of shape (n_sequences+1,)
+        Sequence ii is states[offsets[ii]:offsets[ii+1]].
+    """
+    lengths = np.array([len(seq) for seq in state_sequences], dtype=int)
+    if lengths.sum() > 0:
+        states = np.concatenate([np.asarray(seq, dtype=int).ravel() for seq in state_sequences])
+    else:
+        states = np.zeros(0, dtype=int)
+    offsets = np.insert(np.cumsum(lengths), 0, 0)
+
+    if remove_adjacent_duplicates and len(states):
+        keep = np.ones(len(states), dtype=bool)
+        keep[1:] = states[1:] != states[:-1]
+        keep[offsets[:-1][lengths > 0]] = True # first state of every sequence
+        seq_ids = np.repeat(np.arange(len(lengths)), lengths)
+        lengths = np.bincount(seq_ids[keep], minlength=len(lengths))
+        states = states[keep]
+        offsets = np.insert(np.cumsum(lengths), 0, 0)
+
+    return states, offsets
+
+def _sequence_logprob(logP, states, offsets):
+    """Sum of the log transition probabilities within every sequence.
+
+    All transitions are gathered with one fancy index into logP, the
+    transitions across sequence boundaries are zeroed, and the sums per
+    sequence are taken with np.add.reduceat. states may have leading
+    (e.g., shuffle) dimensions, giving results of shape (..., n_sequences).
+    """
+    n_sequences = len(offsets) - 1
+    out = np.zeros(states.shape[:-1] + (n_sequences,))
+    n_total = states.shape[-1]
+    if n_total == 0:
+        return out
+
+    # transitions[..., ii] is from states[..., ii] to states[..., ii+1]; the
+    # last entry of every sequence is a boundary (or the very end):
+    transitions = np.zeros(states.shape)
+    transitions[..., :-1] = logP[states[..., :-1], states[..., 1:]]
+    ends = offsets[1:] - 1
+    transitions[..., ends[ends >= 0]] = 0
+
+    nonempty = offsets[1:] > offsets[:-1]
+    out[..., nonempty] = np.add.reduceat(transitions, offsets[:-1][nonempty], axis=-1)
+    return out
+
+def _time_swap_states(states, offsets, n_shuffles, random_state=None):
+    """Permute the states within every sequence, for all shuffles at once.
+
+    Returns an array of shape (n_shuffles, n_total).
+    """
+    if random_state is None:
+        random_state = np.random
+    elif not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    lengths = np.diff(offsets)
+    seq_ids = np.repeat(np.arange(len(lengths)), lengths)
+    # random keys in [0, 1) offset by the sequence id only sort within sequences
+    keys = random_state.rand(n_shuffles, len(states)) + seq_ids
+    return states[np.argsort(keys, axis=1)]
+
+def _order_scores(logP, states, offsets, average=True):
+    """Order scores of concatenated state sequences."""
+    scores = _sequence_logprob(logP, states, offsets)
+    if average:
+        with np.errstate(divide='ignore'):
+            scores = scores - np.log(np.diff(offsets))
+    return scores
 
 def scoreOrderND(hmm, state_sequences):
     """Compute order score with no adjacent duplicates in state sequences
 
     A score of 0 means there's only one state.
     """
+    states, offsets = _concatenate_sequences(state_sequences, remove_adjacent_duplicates=True)
+    return _order_scores(_log_transmat(hmm), states, offsets)
 
-    scoresND = [] # scores with no adjacent duplicates
-
-    for seqid in range(len(state_sequences)):
-        logP = np.log(hmm.transmat_)
-        pth = [x[0] for x in groupby(state_sequences[seqid])] # remove adjacent duplicates
-        plen = len(pth)
-        logPseq = 0
-        for ii in range(plen-1):
-            logPseq += logP[pth[ii],pth[ii+1]]
-        score = logPseq - np.log(plen)
-        scoresND.append(score)
-
-    return np.array(scoresND)
-
-def scoreOrderD_time_swap(hmm, state_sequences, n_shuffles=250):
+def scoreOrderD_time_swap(hmm, state_sequences, n_shuffles=250, random_state=None):
     """Compute order score of state sequences
 
     A score of 0 means there's only one state.
-    """
 
-    scoresD = [] # scores with no adjacent duplicates
-    n_sequences = len(state_sequences)
-    shuffled = np.zeros((n_shuffles, n_sequences))
-
-    for seqid in range(n_sequences):
-        logP = np.log(hmm.transmat_)
-        pth = state_sequences[seqid]
-        plen = len(pth)
-        logPseq = 0
-        for ii in range(plen-1):
-            logPseq += logP[pth[ii],pth[ii+1]]
-        score = logPseq - np.log(plen)
-        scoresD.append(score)
-        for nn in range(n_shuffles):
-            logPseq = 0
-            pth = np.random.permutation(pth)
-            for ii in range(plen-1):
-                logPseq += logP[pth[ii],pth[ii+1]]
-            score = logPseq - np.log(plen)
-            shuffled[nn, seqid] = score
-
-    scoresD = np.array(scoresD)
-    return scoresND, shuffled
+    All shuffles (permutations of the states within each sequence) are
+    generated and scored at once.
+    """
+    states, offsets = _concatenate_sequences(state_sequences)
+    logP = _log_transmat(hmm)
+    scoresD = _order_scores(logP, states, offsets)
+    shuffled = _order_scores(logP, _time_swap_states(states, offsets, n_shuffles, random_state), offsets)
+    return scoresD, shuffled
 
 # def scoreOrderD_trans_mat_shuffle(hmm, state_sequences, n_shuffles=5):
 #     """Compute order score of state sequences
@@ -78,109 +135,62 @@ def scoreOrderD(hmm, state_sequences):
 
     A score of 0 means there's only one state.
     """
-
-    scoresND = [] # scores with no adjacent duplicates
-    for seqid in range(len(state_sequences)):
-        logP = np.log(hmm.transmat_)
-        pth = state_sequences[seqid]
-        plen = len(pth)
-        logPseq = 0
-        for ii in range(plen-1):
-            logPseq += logP[pth[ii],pth[ii+1]]
-        score = logPseq - np.log(plen)
-        scoresND.append(score)
-
-    return np.array(scoresND)
+    states, offsets = _concatenate_sequences(state_sequences)
+    return _order_scores(_log_transmat(hmm), states, offsets)
 
 def scoreOrderNAND(hmm, state_sequences):
     """Compute order score of state sequences, not averaging, but with adj dupes removed
 
     A score of 0 means there's only one state.
     """
-
-    scoresND = [] # scores with no adjacent duplicates
-
-    for seqid in range(len(state_sequences)):
-        logP = np.log(hmm.transmat_)
-        pth = [x[0] for x in groupby(state_sequences[seqid])] # remove adjacent duplicates
-        plen = len(pth)
-        logPseq = 0
-        for ii in range(plen-1):
-            logPseq += logP[pth[ii],pth[ii+1]]
-        score = logPseq
-        scoresND.append(score)
-
-    return np.array(scoresND)
+    states, offsets = _concatenate_sequences(state_sequences, remove_adjacent_duplicates=True)
+    return _order_scores(_log_transmat(hmm), states, offsets, average=False)
 
 def scoreOrderNA(hmm, state_sequences):
     """Compute order score of state sequences, not averaging
 
     A score of 0 means there's only one state.
     """
-
-    scoresND = [] # scores with no adjacent duplicates
-
-    for seqid in range(len(state_sequences)):
-        logP = np.log(hmm.transmat_)
-        pth = state_sequences[seqid]
-        plen = len(pth)
-        logPseq = 0
-        for ii in range(plen-1):
-            logPseq += logP[pth[ii],pth[ii+1]]
-        score = logPseq
-        scoresND.append(score)
-
-    return np.array(scoresND)
+    states, offsets = _concatenate_sequences(state_sequences)
+    return _order_scores(_log_transmat(hmm), states, offsets, average=False)
 
 def score_plen(hmm, state_sequences):
     """returns path length
     """
-    plens = [] # scores with no adjacent duplicates
-
-    for seqid in range(len(state_sequences)):
-        pth = state_sequences[seqid]
-        plen = len(pth)
-        plens.append(plen)
-
-    return np.array(plens)
+    return np.array([len(seq) for seq in state_sequences])
 
 def score_plenND(hmm, state_sequences):
     """returns path length, no adjacent duplicates
     """
-    plens = [] # scores with no adjacent duplicates
-
-    for seqid in range(len(state_sequences)):
-        pth = [x[0] for x in groupby(state_sequences[seqid])] # remove adjacent duplicates
-        plen = len(pth)
-        plens.append(plen)
-
-    return np.array(plens)
+    _, offsets = _concatenate_sequences(state_sequences, remove_adjacent_duplicates=True)
+    return np.diff(offsets)
 
 def score_SD(hmm, state_sequences):
     """returns State Diversity --- number of unique decoded states
     """
-    plens = [] # scores with no adjacent duplicates
-
-    for seqid in range(len(state_sequences)):
-        pth = state_sequences[seqid]
-        sd = len(set(pth))
-        plens.append(sd)
-
-    return np.array(plens)
+    states, offsets = _concatenate_sequences(state_sequences)
+    seq_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    pairs = np.unique(np.vstack((seq_ids, states)), axis=1)
+    return np.bincount(pairs[0], minlength=len(offsets) - 1)
 
 def bigscore(hmm, state_sequences):
-    scorefuncs = [score_SD,
-                  score_plenND,
-                  scoreOrderND,
-                  scoreOrderNAND,
-                  scoreOrderD,
-                  scoreOrderNA,
-                  score_plen]
-    scores = []
-    for scorefunc in scorefuncs:
-        scores.append(scorefunc(hmm, state_sequences))
+    # the sequences are concatenated, and the log transition matrix
+    # computed, only once for all scores:
+    logP = _log_transmat(hmm)
+    states, offsets = _concatenate_sequences(state_sequences)
+    statesND, offsetsND = _concatenate_sequences(state_sequences, remove_adjacent_duplicates=True)
+    seq_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    pairs = np.unique(np.vstack((seq_ids, states)), axis=1)
+
+    scores = [np.bincount(pairs[0], minlength=len(offsets) - 1), # score_SD
+              np.diff(offsetsND), # score_plenND
+              _order_scores(logP, statesND, offsetsND), # scoreOrderND
+              _order_scores(logP, statesND, offsetsND, average=False), # scoreOrderNAND
+              _order_scores(logP, states, offsets), # scoreOrderD
+              _order_scores(logP, states, offsets, average=False), # scoreOrderNA
+              np.diff(offsets)] # score_plen
 
     # comboscore = ((-scoresND+scoresNAND-scoresD+scoresNA)/scoresplenND)+scoresSD
     comboscore = ((-scores[2]+scores[3]-scores[4]+scores[5])/scores[1])+scores[0]
 
-    return comboscore, scores
\ No newline at end of file
+    return comboscore, scores
@@ -0,0 +1,296 @@
+#encoding : utf-8
+"""This module implements spectral estimation for core nelpy objects.
+
+Power spectral densities and spectrograms are estimated from windowed
+segments that never straddle epoch boundaries. All segments (for all
+signals, windows and tapers) in a batch are transformed with a single
+rfft call, and batches of windows are processed one at a time, so that
+long (e.g., memmapped) recordings can be processed in bounded memory.
+"""
+
+__all__ = ['psd',
+           'spectrogram',
+           'band_power']
+
+import numpy as np
+
+from collections import namedtuple
+from scipy.signal import get_window
+
+from . import core
+from .utils import _epoch_sample_bounds
+
+PowerSpectrum = namedtuple('PowerSpectrum', ['freqs', 'power'])
+Spectrogram = namedtuple('Spectrogram', ['freqs', 'time', 'power'])
+
+def _get_tapers(nperseg, *, window=None, NW=None, n_tapers=None):
+    """Return an array of tapers with shape (n_tapers, nperseg).
+
+    If NW is None, a single (Welch) window is returned; otherwise
+    n_tapers (default 2*NW-1) discrete prolate spheroidal sequences with
+    time-halfbandwidth product NW are returned (multitaper estimation).
+    """
+    if NW is None:
+        if window is None:
+            window = 'hann'
+        if isinstance(window, (str, tuple)):
+            taper = get_window(window, nperseg)
+        else:
+            taper = np.asarray(window, dtype=float)
+            if len(taper) != nperseg:
+                raise ValueError("window must have length nperseg!")
+        return np.atleast_2d(taper)
+
+    try:
+        from scipy.signal.windows import dpss
+    except ImportError:
+        raise ImportError("multitaper estimation requires scipy >= 1.1.0")
+    if n_tapers is None:
+        n_tapers = max(int(2*NW) - 1, 1)
+    return np.atleast_2d(dpss(nperseg, NW, Kmax=n_tapers))
+
+def _segment_starts(bounds, nperseg, step):
+    """Return the start index of every full segment within each epoch."""
+    starts = [np.arange(start, stop - nperseg + 1, step) for start, stop in bounds]
+    if len(starts) == 0:
+        return np.array([], dtype=int)
+    return np.concatenate(starts).astype(int)
+
+def _iter_power(ydata, seg_starts, *, fs, nperseg, tapers, nfft, detrend,
+                scaling, chunksize):
+    """Generator yielding (slice, power) for batches of chunksize
+    segments, where power has shape (n_signals, n_segments, n_freqs)."""
+
+    if scaling == 'density':
+        scale = 1.0 / (fs * (tapers**2).sum(axis=1))
+    elif scaling == 'spectrum':
+        scale = 1.0 / tapers.sum(axis=1)**2
+    else:
+        raise ValueError("unknown scaling '{}'".format(str(scaling)))
+
+    n_freqs = nfft // 2 + 1
+    # one-sided spectrum: double everything but DC (and Nyquist):
+    onesided = np.full(n_freqs, 2.0)
+    onesided[0] = 1.0
+    if nfft % 2 == 0:
+        onesided[-1] = 1.0
+
+    for first in range(0, len(seg_starts), chunksize):
+        batch = slice(first, min(first + chunksize, len(seg_starts)))
+        starts = seg_starts[batch]
+        lo, hi = starts[0], starts[-1] + nperseg
+        # only read the samples needed for this batch (e.g., from a
+        # memmap), and gather the (n_signals, n_segments, nperseg)
+        # segments from them:
+        block = np.asarray(ydata[:, lo:hi], dtype=float)
+        idx = (starts - lo)[:, np.newaxis] + np.arange(nperseg)
+        segments = block[:, idx]
+        if detrend == 'constant':
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+        elif detrend == 'linear':
+            from scipy.signal import detrend as _detrend
+            segments = _detrend(segments, axis=-1, type='linear')
+        elif detrend:
+            raise ValueError("unknown detrend '{}'".format(str(detrend)))
+
+        # (n_signals, n_segments, n_tapers, nperseg) --> single rfft:
+        tapered = segments[:, :, np.newaxis, :] * tapers
+        spectra = np.fft.rfft(tapered, n=nfft, axis=-1)
+        power = (spectra.real**2 + spectra.imag**2) * scale[:, np.newaxis]
+        power = power.mean(axis=2) * onesided
+
+        yield batch, power
+
+def _prepare(data, *, fs, nperseg, noverlap, window, NW, n_tapers, nfft):
+    if isinstance(data, core.AnalogSignalArray):
+        if fs is None:
+            fs = data.fs
+        ydata = data.ydata
+        bounds = _epoch_sample_bounds(data)
+        time = data.time
+    elif isinstance(data, (np.ndarray, list)):
+        if fs is None:
+            raise ValueError("sampling frequency must be specified!")
+        ydata = np.atleast_2d(np.asarray(data))
+        bounds = np.array([[0, ydata.shape[-1]]])
+        time = np.arange(ydata.shape[-1]) / fs
+    else:
+        raise TypeError(
+          "Unknown data type {}.".format(str(type(data))))
+
+    if nperseg is None:
+        nperseg = 256
+    nperseg = int(nperseg)
+    if noverlap is None:
+        noverlap = nperseg // 2
+    if noverlap >= nperseg:
+        raise ValueError("noverlap must be less than nperseg!")
+    if nfft is None:
+        nfft = nperseg
+    if nfft < nperseg:
+        raise ValueError("nfft must be greater than or equal to nperseg!")
+
+    tapers = _get_tapers(nperseg, window=window, NW=NW, n_tapers=n_tapers)
+    seg_starts = _segment_starts(bounds, nperseg, nperseg - noverlap)
+    if len(seg_starts) == 0:
+        raise ValueError("no epoch is long enough for a single segment of nperseg samples!")
+
+    return ydata, fs, time, tapers, seg_starts, nperseg, nfft
+
+def psd(data, *, fs=None, nperseg=None, noverlap=None, window=None,
+        NW=None, n_tapers=None, nfft=None, detrend='constant',
+        scaling='density', chunksize=None):
+    """Estimate the power spectral density of every signal.
+
+    Welch's method (or its multitaper generalization), averaging over all
+    segments of all epochs; segments never straddle epoch boundaries.
+    For a single epoch and default parameters, this is equivalent to
+    scipy.signal.welch.
+
+    Parameters
+    ----------
+    data : AnalogSignalArray, ndarray, or list
+        Array data should have shape (n_samples,) or (n_signals,
+        n_samples), and is treated as a single epoch.
+    fs : float, optional if AnalogSignalArray is passed
+        Sampling frequency (Hz)
+    nperseg : int, optional
+        Length of each segment. Default is 256.
+    noverlap : int, optional
+        Number of samples to overlap between segments. Default is
+        nperseg // 2.
+    window : str, tuple, or array, optional
+        Window (see scipy.signal.get_window). Default is 'hann'. Ignored
+        for multitaper estimates.
+    NW : float, optional
+        Time-halfbandwidth product. If specified, DPSS tapers are used
+        (multitaper estimation). Default is None (Welch).
+    n_tapers : int, optional
+        Number of DPSS tapers. Default is 2*NW-1.
+    nfft : int, optional
+        Length of the FFT (zero padded if nfft > nperseg). Default is
+        nperseg.
+    detrend : {'constant', 'linear', False}, optional
+        How to detrend each segment. Default is 'constant'.
+    scaling : {'density', 'spectrum'}, optional
+        Power spectral density (V**2/Hz) or power spectrum (V**2).
+        Default is 'density'.
+    chunksize : int, optional
+        Number of segments that are transformed at once. Default is 1000.
+
+    Returns
+    -------
+    out : (freqs, power)
+        namedtuple with arrays of frequencies (n_freqs,), and power
+        (n_signals, n_freqs).
+    """
+    if chunksize is None:
+        chunksize = 1000
+
+    ydata, fs, _, tapers, seg_starts, nperseg, nfft = _prepare(
+        data, fs=fs, nperseg=nperseg, noverlap=noverlap, window=window,
+        NW=NW, n_tapers=n_tapers, nfft=nfft)
+
+    total = 0
+    for _, power in _iter_power(ydata, seg_starts, fs=fs, nperseg=nperseg,
+                                tapers=tapers, nfft=nfft, detrend=detrend,
+                                scaling=scaling, chunksize=chunksize):
+        total = total + power.sum(axis=1)
+
+    freqs = np.fft.rfftfreq(nfft, d=1/fs)
+    return PowerSpectrum(freqs=freqs, power=total / len(seg_starts))
+
+def spectrogram(data, *, fs=None, nperseg=None, noverlap=None, window=None,
+                NW=None, n_tapers=None, nfft=None, detrend='constant',
+                scaling='density', chunksize=None, dtype=None):
+    """Compute the spectrogram of every signal.
+
+    See psd() for a description of the parameters; segments never
+    straddle epoch boundaries.
+
+    Additional parameters
+    ---------------------
+    dtype : np.dtype, optional
+        Data type of the spectrogram. Default is np.float32.
+
+    Returns
+    -------
+    out : (freqs, time, power)
+        namedtuple with arrays of frequencies (n_freqs,), segment center
+        times (n_segments,) and power (n_signals, n_freqs, n_segments).
+    """
+    if chunksize is None:
+        chunksize = 1000
+    if dtype is None:
+        dtype = np.float32
+
+    ydata, fs, time, tapers, seg_starts, nperseg, nfft = _prepare(
+        data, fs=fs, nperseg=nperseg, noverlap=noverlap, window=window,
+        NW=NW, n_tapers=n_tapers, nfft=nfft)
+
+    freqs = np.fft.rfftfreq(nfft, d=1/fs)
+    out = np.empty((ydata.shape[0], len(freqs), len(seg_starts)), dtype=dtype)
+    for batch, power in _iter_power(ydata, seg_starts, fs=fs,
+                                    nperseg=nperseg, tapers=tapers,
+                                    nfft=nfft, detrend=detrend,
+                                    scaling=scaling, chunksize=chunksize):
+        out[:, :, batch] = np.swapaxes(power, 1, 2)
+
+    seg_time = time[seg_starts] + nperseg / (2*fs)
+    return Spectrogram(freqs=freqs, time=seg_time, power=out)
+
+def band_power(data, band, *, fs=None, nperseg=None, noverlap=None,
+               window=None, NW=None, n_tapers=None, nfft=None,
+               detrend='constant', chunksize=None, dtype=None):
+    """Compute the power in a frequency band over time, for every signal.
+
+    The spectrogram is reduced to the band as each batch of segments is
+    transformed, so that the full spectrogram is never held in memory.
+    See psd() for a description of the parameters.
+
+    Parameters
+    ----------
+    data : AnalogSignalArray
+    band : (float, float)
+        Lower and upper frequency (Hz) of the band, inclusive.
+
+    Returns
+    -------
+    power : AnalogSignalArray
+        Mean power (density) in the band, sampled at the segment centers,
+        with the same support as data.
+    """
+    if not isinstance(data, core.AnalogSignalArray):
+        raise TypeError("band_power requires an AnalogSignalArray!")
+    if chunksize is None:
+        chunksize = 1000
+    if dtype is None:
+        dtype = np.float32
+
+    ydata, fs, time, tapers, seg_starts, nperseg, nfft = _prepare(
+        data, fs=fs, nperseg=nperseg, noverlap=noverlap, window=window,
+        NW=NW, n_tapers=n_tapers, nfft=nfft)
+
+    freqs = np.fft.rfftfreq(nfft, d=1/fs)
+    in_band = (freqs >= band[0]) & (freqs <= band[1])
+    if not in_band.any():
+        raise ValueError("no frequencies in band {}!".format(band))
+
+    out = np.empty((ydata.shape[0], len(seg_starts)), dtype=dtype)
+    for batch, power in _iter_power(ydata, seg_starts, fs=fs,
+                                    nperseg=nperseg, tapers=tapers,
+                                    nfft=nfft, detrend=detrend,
+                                    scaling='density', chunksize=chunksize):
+        out[:, batch] = power[:, :, in_band].mean(axis=-1)
+
+    if noverlap is None:
+        noverlap = nperseg // 2
+
+    asa = core.AnalogSignalArray([], empty=True)
+    asa._support = data.support
+    asa._time = time[seg_starts] + nperseg / (2*fs)
+    asa._ydata = out
+    asa._fs = fs / (nperseg - noverlap)
+    asa._labels = data.labels
+
+    return asa
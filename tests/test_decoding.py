@@ -0,0 +1,169 @@
+import nelpy as nel
+import numpy as np
+
+from nelpy.decoding import (Decoder, StreamingDecoder, decode1D, decode2D,
+                            decoding_terms, k_fold_cross_validation,
+                            cumulative_dist_decoding_error_using_xval,
+                            _sliding_window_counts)
+
+def _bst(n_units=4, duration=20):
+    rng = np.random.RandomState(0)
+    spikes = np.sort(rng.uniform(0, duration, size=(n_units, 100)), axis=1)
+    st = nel.SpikeTrainArray(spikes.tolist(), support=nel.EpochArray([0, duration]), fs=1)
+    return st.bin(ds=0.1)
+
+class TestSlidingWindowCounts:
+
+    def test_windows_per_epoch(self):
+        """Windows stay within epochs, and short epochs give one partial window"""
+        data = np.arange(12).reshape(2, 6)
+        windowed, window_lengths = _sliding_window_counts(data, [4, 2], w=3)
+
+        assert windowed.flags['C_CONTIGUOUS']
+        assert np.array_equal(window_lengths, [2, 1])
+        assert np.array_equal(windowed, [[0+1+2, 6+7+8],
+                                         [1+2+3, 7+8+9],
+                                         [4+5, 10+11]])
+
+class TestDecode2D:
+
+    def test_posterior(self):
+        """decode2D matches the Poisson posterior computed bin by bin"""
+        bst = _bst()
+        ratemap = np.random.RandomState(1).uniform(0.1, 10, size=(bst.n_units, 5, 7))
+        posterior, cum_lengths, mode_pth, mean_pth = decode2D(bst, ratemap, xmax=1, ymax=1, chunksize=13)
+
+        assert posterior.shape == (5, 7, bst.n_bins)
+        assert mode_pth.shape == mean_pth.shape == (2, bst.n_bins)
+        for tt in range(bst.n_bins):
+            obs = bst.data[:, tt]
+            if obs.sum() == 0:
+                assert np.all(np.isnan(posterior[:, :, tt]))
+                continue
+            logp = (obs[:, np.newaxis, np.newaxis] * np.log(ratemap)).sum(axis=0) - ratemap.sum(axis=0)*bst.ds
+            expected = np.exp(logp - logp.max())
+            assert np.allclose(posterior[:, :, tt], expected / expected.sum())
+
+class TestDecoder:
+
+    def test_matches_decode1d(self):
+        """Decoder gives the same results as decode1D, also after the
+        tuning curve changes"""
+        bst = _bst()
+        t = np.arange(0, 20, 0.05)
+        pos = nel.AnalogSignalArray([((np.sin(t) + 1)/2*0.98 + 0.01).tolist()],
+                                    timestamps=t.tolist(), fs=20)
+        tc = nel.TuningCurve1D(bst=bst, extern=pos, n_extern=10, sigma=0.1)
+        decoder = Decoder(tc)
+
+        for w in (1, 3):
+            expected = decode1D(bst, tc, w=w)
+            result = decoder.decode(bst, w=w, chunksize=7)
+            for a, b in zip(expected, result):
+                assert np.allclose(a, b, equal_nan=True)
+
+        tc.smooth(sigma=0.2, inplace=True)
+        assert np.allclose(decoder.decode(bst)[0], decode1D(bst, tc)[0], equal_nan=True)
+
+        # in-place modifications of the ratemap need an explicit invalidate():
+        tc.ratemap[:] = tc.ratemap[::-1]
+        decoder.invalidate()
+        assert np.allclose(decoder.decode(bst)[0], decode1D(bst, tc)[0], equal_nan=True)
+
+    def test_mode_pth_offset(self):
+        """The mode path is the left edge of the most probable bin, also
+        for tuning curves that do not start at 0"""
+        bst = _bst()
+        ratemap = np.random.RandomState(1).uniform(0.1, 10, size=(bst.n_units, 6))
+        tc = nel.TuningCurve1D(ratemap=ratemap, extmin=10, extmax=22)
+        posterior, _, mode_pth, _ = Decoder(tc).decode(bst)
+
+        nonempty = ~np.isnan(posterior[0])
+        expected = 10 + 2*np.argmax(posterior[:, nonempty], axis=0)
+        assert np.allclose(mode_pth[nonempty], expected)
+
+    def test_mean_pth_offset(self):
+        """The mean path is the posterior-weighted mean of the bin
+        centers, also for tuning curves that do not start at 0"""
+        bst = _bst()
+        ratemap = np.random.RandomState(1).uniform(0.1, 10, size=(bst.n_units, 6))
+        tc = nel.TuningCurve1D(ratemap=ratemap, extmin=10, extmax=22)
+        posterior, _, _, mean_pth = Decoder(tc).decode(bst)
+
+        centers = 11 + 2*np.arange(6)
+        assert np.allclose(mean_pth, np.dot(centers, posterior), equal_nan=True)
+        assert np.allclose(decode1D(bst, ratemap, xmin=10, xmax=22)[3], mean_pth, equal_nan=True)
+
+class TestStreamingDecoder:
+
+    def test_matches_decoder(self):
+        """Bin-by-bin updates give the posteriors of Decoder.decode"""
+        bst = _bst()
+        ratemap = np.random.RandomState(1).uniform(0.1, 10, size=(bst.n_units, 6))
+        tc = nel.TuningCurve1D(ratemap=ratemap)
+        w = 3
+
+        expected = Decoder(tc).decode(bst, w=w)[0]
+        decoder = StreamingDecoder(tc, ds=bst.ds, w=w)
+        for tt, counts in enumerate(bst.data.T.astype(float)):
+            posterior = decoder.update(counts)
+            if tt >= w - 1:
+                assert np.allclose(posterior, expected[:, tt - w + 1], equal_nan=True)
+        assert posterior is decoder.posterior
+
+    def test_list_counts_and_partial_windows(self):
+        """Counts can be lists, and windows that are not yet full use the
+        expected count term of the bins received"""
+        ratemap = np.random.RandomState(1).uniform(0.1, 10, size=(3, 5))
+        tc = nel.TuningCurve1D(ratemap=ratemap)
+        decoder = StreamingDecoder(tc, ds=0.1, w=3)
+        decoder.update([1, 0, 0])
+        posterior = decoder.update([0, 2, 1])
+
+        lfx, eterm = decoding_terms(tc, ds=0.1, w=2)
+        logp = np.dot(lfx, [1, 2, 1]) + eterm
+        expected = np.exp(logp - logp.max())
+        assert np.allclose(posterior, expected/expected.sum())
+
+class TestKFoldCrossValidation:
+
+    def test_random_state(self):
+        """Randomized folds partition X and are reproducible"""
+        folds = list(k_fold_cross_validation(23, k=4, randomize=True, random_state=0))
+        again = list(k_fold_cross_validation(23, k=4, randomize=True, random_state=0))
+        assert folds == again
+        validation = sorted(x for _, fold in folds for x in fold)
+        assert validation == list(range(23))
+        for training, fold in folds:
+            assert sorted(training + fold) == list(range(23))
+
+class TestDecodingErrorUsingXval:
+
+    def test_serial_matches_pool(self):
+        """Folds evaluated in a process pool give the serial error
+        distribution, with one timing entry per fold"""
+        rng = np.random.RandomState(0)
+        starts = np.arange(0, 40, 4)
+        # the same number of spikes per unit in every epoch:
+        spikes = np.sort(np.hstack([rng.uniform(a, a + 3, size=(4, 30)) for a in starts]), axis=1)
+        st = nel.SpikeTrainArray(spikes.tolist(), support=nel.EpochArray([0, 40]), fs=1)
+        bst = st[nel.EpochArray([[a, a + 3] for a in starts])].bin(ds=0.1)
+        t = np.arange(0, 40, 0.05)
+        pos = nel.AnalogSignalArray([((np.sin(t) + 1)/2*0.98 + 0.01).tolist()],
+                                    timestamps=t.tolist(), fs=20)
+        kwargs = dict(k=4, n_extern=10, extmin=0, extmax=1, sigma=0.1, n_bins=20,
+                      randomize=True, random_state=0, return_timings=True)
+
+        cumhist, bincenters, timings = cumulative_dist_decoding_error_using_xval(bst, pos, **kwargs)
+        pooled = cumulative_dist_decoding_error_using_xval(bst, pos, n_jobs=2, **kwargs)
+        again = cumulative_dist_decoding_error_using_xval(bst, pos, **kwargs)
+
+        assert cumhist.shape == bincenters.shape == (22,)
+        assert np.allclose(cumhist, pooled[0])
+        assert np.allclose(bincenters, pooled[1])
+        assert np.allclose(cumhist, again[0])
+        for fold_timings in (timings, pooled[2]):
+            assert len(fold_timings) == 4
+            for stages in fold_timings:
+                assert list(stages) == ['tuningcurve', 'decode', 'error']
+                assert all(elapsed >= 0 for elapsed in stages.values())
@@ -0,0 +1,44 @@
+import numpy as np
+import scipy.sparse as sp
+
+from nelpy.analysis import ergodic
+
+class TestErgodic:
+
+    def test_stacked_matches_single(self):
+        """Stacked transition matrices give the results of each matrix alone"""
+        rng = np.random.RandomState(0)
+        P = rng.uniform(0.1, 1, size=(5, 4, 4))
+        P /= P.sum(axis=-1, keepdims=True)
+
+        ss = ergodic.steady_state(P)
+        M = ergodic.fmpt(P)
+        V = ergodic.var_fmpt(P)
+        assert ss.shape == (5, 4) and M.shape == V.shape == (5, 4, 4)
+        for ii in range(5):
+            assert np.allclose(np.dot(ss[ii], P[ii]), ss[ii])
+            assert np.allclose(ergodic.fmpt(np.matrix(P[ii])), M[ii])
+            assert np.allclose(ergodic.var_fmpt(np.matrix(P[ii])), V[ii])
+            # the mean recurrence time is the inverse of the steady state
+            assert np.allclose(np.diag(M[ii]), 1/ss[ii])
+
+    def test_oz(self):
+        """Land of Oz example of Kemeny and Snell"""
+        p = np.matrix([[.5, .25, .25], [.5, 0, .5], [.25, .25, .5]])
+        assert np.allclose(ergodic.steady_state(p), [[0.4], [0.2], [0.4]])
+        assert np.allclose(ergodic.fmpt(p), [[2.5, 4, 10/3], [8/3, 5, 8/3], [10/3, 4, 2.5]])
+        assert np.allclose(ergodic.var_fmpt(p)[0], [67/12, 12, 62/9])
+
+    def test_sparse(self):
+        """Sparse solvers agree with the dense steady state"""
+        rng = np.random.RandomState(0)
+        k = 20
+        P = np.zeros((k, k))
+        P[np.arange(k), (np.arange(k) + 1) % k] = rng.uniform(0.1, 1, size=k)
+        P[np.arange(k), (np.arange(k) - 1) % k] = rng.uniform(0.1, 1, size=k)
+        P[np.arange(k), np.arange(k)] = rng.uniform(0.1, 1, size=k)
+        P /= P.sum(axis=1, keepdims=True)
+
+        expected = ergodic.steady_state(P)
+        assert np.allclose(ergodic.steady_state_sparse(sp.csr_matrix(P)), expected)
+        assert np.allclose(ergodic.steady_state_sparse(P, method='power'), expected, atol=1e-8)
@@ -0,0 +1,31 @@
+from nelpy.filtering import _fir_filtfilt
+import numpy as np
+from scipy.signal import filtfilt, firwin
+
+class TestFIRFiltering:
+
+    def setup_method(self):
+        self.b = firwin(numtaps=101, cutoff=[0.1, 0.2], pass_zero=False)
+        self.data = np.random.RandomState(0).randn(3, 5000)
+        self.expected = filtfilt(self.b, 1, self.data)
+
+    def test_threaded(self):
+        """Filtering channels across threads matches filtfilt"""
+        filtered = _fir_filtfilt(self.b, self.data, n_jobs=2)
+        assert np.allclose(filtered, self.expected)
+
+    def test_chunked(self):
+        """Filtering in overlapping time chunks matches filtfilt"""
+        filtered = _fir_filtfilt(self.b, self.data, n_jobs=2, chunksize=700)
+        assert np.allclose(filtered, self.expected)
+
+    def test_fft(self):
+        """Overlap-add FFT filtering matches filtfilt"""
+        filtered = _fir_filtfilt(self.b, self.data, method='fft')
+        assert np.allclose(filtered, self.expected)
+
+    def test_1D(self):
+        """1D input gives 1D output"""
+        filtered = _fir_filtfilt(self.b, self.data[0], chunksize=700, method='fft')
+        assert filtered.shape == self.data[0].shape
+        assert np.allclose(filtered, self.expected[0])
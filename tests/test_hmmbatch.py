@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+from scipy.special import gammaln, logsumexp
+from scipy.stats import poisson
+
+from nelpy import hmmbatch
+
+def _model(n_states=4, random_state=0):
+    rng = np.random.RandomState(random_state)
+    startprob = rng.dirichlet(np.ones(n_states))
+    transmat = rng.dirichlet(np.ones(n_states), size=n_states)
+    lengths = rng.randint(1, 10, size=25)
+    framelogprob = 3*rng.randn(lengths.sum(), n_states)
+    return np.log(startprob), np.log(transmat), framelogprob, lengths
+
+class TestHMMBatch:
+
+    def test_forward_backward(self):
+        """Batched recursions match a sequence-by-sequence forward-backward"""
+        log_startprob, log_transmat, framelogprob, lengths = _model()
+        padded, mask = hmmbatch.pad_sequences(framelogprob, lengths)
+        logprob, fwdlattice = hmmbatch.forward(log_startprob, log_transmat, padded, mask)
+        bwdlattice = hmmbatch.backward(log_transmat, padded, mask)
+        posteriors = hmmbatch.posteriors(fwdlattice, bwdlattice, mask)
+
+        for ee, seq in enumerate(np.split(framelogprob, np.cumsum(lengths)[:-1])):
+            alpha = [log_startprob + seq[0]]
+            for obs in seq[1:]:
+                alpha.append(logsumexp(alpha[-1][:, np.newaxis] + log_transmat, axis=0) + obs)
+            beta = [np.zeros_like(log_startprob)]
+            for obs in seq[:0:-1]:
+                beta.insert(0, logsumexp(log_transmat + obs + beta[0], axis=1))
+            gamma = np.array(alpha) + np.array(beta)
+            gamma = np.exp(gamma - logsumexp(gamma, axis=1, keepdims=True))
+
+            assert np.isclose(logprob[ee], logsumexp(alpha[-1]))
+            first = lengths[:ee].sum()
+            assert np.allclose(posteriors[first:first+lengths[ee]], gamma)
+
+    def test_batched_transmats(self):
+        """Leading transition matrix dimensions are broadcast over events"""
+        log_startprob, log_transmat, framelogprob, lengths = _model()
+        _, other, _, _ = _model(random_state=1)
+        padded, mask = hmmbatch.pad_sequences(framelogprob, lengths)
+        logprob, _ = hmmbatch.forward(log_startprob, np.stack([log_transmat, other]), padded, mask)
+
+        assert logprob.shape == (2, len(lengths))
+        assert np.allclose(logprob[1], hmmbatch.forward(log_startprob, other, padded, mask)[0])
+
+    def test_viterbi(self):
+        """Batched Viterbi matches exhaustive search over state sequences"""
+        log_startprob, log_transmat, framelogprob, lengths = _model(n_states=3)
+        lengths = np.minimum(lengths, 5)
+        framelogprob = framelogprob[:lengths.sum()]
+        padded, mask = hmmbatch.pad_sequences(framelogprob, lengths)
+        logprob, states = hmmbatch.viterbi(log_startprob, log_transmat, padded, mask)
+
+        for ee, seq in enumerate(np.split(framelogprob, np.cumsum(lengths)[:-1])):
+            paths = np.array(np.meshgrid(*[range(3)]*len(seq), indexing='ij')).reshape(len(seq), -1).T
+            scores = (log_startprob[paths[:, 0]]
+                      + log_transmat[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+                      + seq[np.arange(len(seq)), paths].sum(axis=1))
+            first = lengths[:ee].sum()
+            assert np.isclose(logprob[ee], scores.max())
+            assert np.array_equal(states[first:first+len(seq)], paths[scores.argmax()])
+
+class TestForwardFilter:
+
+    def test_matches_forward_backward(self):
+        """Online filtering and fixed-lag smoothing match the batched
+        recursions on the same bins"""
+        rng = np.random.RandomState(0)
+        n_states, n_units, n_bins, lag = 4, 6, 30, 3
+        startprob = rng.dirichlet(np.ones(n_states))
+        transmat = rng.dirichlet(np.ones(n_states), size=n_states)
+        means = rng.uniform(0.1, 3, size=(n_states, n_units))
+        counts = rng.poisson(1, size=(n_bins, n_units)).astype(float)
+
+        ff = hmmbatch.ForwardFilter(startprob, transmat, means, lag=lag)
+        filtered = np.array([ff.update(bin_counts).copy() for bin_counts in counts])
+
+        framelogprob = (np.dot(counts, np.log(means).T) - means.sum(axis=1)
+                        - gammaln(counts + 1).sum(axis=1, keepdims=True))
+        padded, mask = hmmbatch.pad_sequences(framelogprob, [n_bins])
+        logprob, fwdlattice = hmmbatch.forward(np.log(startprob), np.log(transmat), padded, mask)
+        bwdlattice = hmmbatch.backward(np.log(transmat), padded, mask)
+
+        expected = np.exp(fwdlattice[0] - logsumexp(fwdlattice[0], axis=1, keepdims=True))
+        assert np.allclose(filtered, expected)
+        assert np.isclose(ff.logprob, logprob[0])
+        assert np.allclose(ff.smoothed, hmmbatch.posteriors(fwdlattice, bwdlattice, mask)[n_bins - 1 - lag])
+
+    def test_zero_rates(self):
+        """States with zero rates are handled as poisson.logpmf does:
+        silent units do not produce NaNs, and spikes rule the state out"""
+        ff = hmmbatch.ForwardFilter([.5, .5], [[.9, .1], [.2, .8]], [[0, 2], [1, 1]])
+        # Pr(0;0)Pr(3;2) : Pr(0;1)Pr(3;1) = 8 : 1
+        assert np.allclose(ff.update([0, 3]), [8/9, 1/9])
+        assert np.allclose(ff.update([1, 0]), [0, 1])
+        assert np.isfinite(ff.logprob)
+
+        rng = np.random.RandomState(1)
+        n_states, n_units, n_bins = 4, 5, 40
+        startprob = rng.dirichlet(np.ones(n_states))
+        transmat = rng.dirichlet(np.ones(n_states), size=n_states)
+        means = rng.uniform(0.1, 3, size=(n_states, n_units))
+        means[0, :2] = 0
+        means[1, 2] = 0
+        counts = rng.poisson(1, size=(n_bins, n_units))
+
+        ff = hmmbatch.ForwardFilter(startprob, transmat, means)
+        filtered = np.array([ff.update(list(bin_counts)).copy() for bin_counts in counts])
+
+        framelogprob = poisson.logpmf(counts[:, np.newaxis, :], means).sum(axis=-1)
+        padded, mask = hmmbatch.pad_sequences(framelogprob, [n_bins])
+        logprob, fwdlattice = hmmbatch.forward(np.log(startprob), np.log(transmat), padded, mask)
+
+        expected = np.exp(fwdlattice[0] - logsumexp(fwdlattice[0], axis=1, keepdims=True))
+        assert np.allclose(filtered, expected)
+        assert np.isclose(ff.logprob, logprob[0])
+
+    def test_impossible_counts(self):
+        """Counts with zero probability under every (reachable) state
+        raise, and leave the filter unchanged"""
+        # both states are ruled out by the spike of unit 0:
+        ruled_out = hmmbatch.ForwardFilter([.5, .5], [[.9, .1], [.2, .8]], [[0, 2], [0, 1]])
+        # state 0 is ruled out, and state 1 is unreachable:
+        unreachable = hmmbatch.ForwardFilter([1, 0], [[1, 0], [0, 1]], [[0, 2], [1, 1]])
+        for ff in (ruled_out, unreachable):
+            ff.update(np.array([0, 3]))
+            filtered, logprob = ff.filtered.copy(), ff.logprob
+            with pytest.raises(ValueError):
+                ff.update([1, 0])
+            assert np.array_equal(ff.filtered, filtered)
+            assert ff.logprob == logprob and ff.n_updates == 1
+            assert np.all(np.isfinite(ff.update([0, 1])))
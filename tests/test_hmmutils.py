@@ -0,0 +1,183 @@
+import copy
+import pickle
+import nelpy as nel
+import numpy as np
+import pytest
+
+pytest.importorskip('hmmlearn')
+
+from nelpy.hmmutils import PoissonHMM, model_selection, _epoch_windows
+
+def _events_and_hmm(n_units=6, n_components=4):
+    rng = np.random.RandomState(0)
+    starts = np.arange(0, 40, 4)
+    # the same number of spikes per unit in every event:
+    spikes = np.sort(np.hstack([rng.uniform(a, a + 0.5, size=(n_units, 6)) for a in starts]), axis=1)
+    st = nel.SpikeTrainArray(spikes.tolist(), support=nel.EpochArray([0, 40]), fs=1)
+    events = st[nel.EpochArray([[a, a + 0.5] for a in starts])].bin(ds=0.05)
+
+    hmm = PoissonHMM(n_components=n_components)
+    hmm.means_ = rng.uniform(0.1, 2, size=(n_components, n_units))
+    hmm.transmat_ = rng.dirichlet(np.ones(n_components), size=n_components)
+    hmm.startprob_ = rng.dirichlet(np.ones(n_components))
+    return events, hmm
+
+class TestEmissionCache:
+
+    def test_hit_and_miss(self):
+        """Emission log likelihoods are re-used until means_ changes"""
+        events, hmm = _events_and_hmm()
+        padded, _, _ = hmm._padded_framelogprob(events)
+        assert hmm._padded_framelogprob(events)[0] is padded
+        assert hmm._padded_framelogprob(events, w=2)[0] is not padded
+
+        hmm.means_ = hmm.means_*1.1
+        changed, _, _ = hmm._padded_framelogprob(events)
+        assert changed is not padded
+        assert not np.allclose(changed, padded)
+
+    def test_clear(self):
+        """clear_emission_cache() discards all entries"""
+        events, hmm = _events_and_hmm()
+        padded, _, _ = hmm._padded_framelogprob(events)
+        hmm.clear_emission_cache()
+        assert len(hmm._emission_cache) == 0
+        again, _, _ = hmm._padded_framelogprob(events)
+        assert again is not padded
+        assert np.allclose(again, padded)
+
+    def test_pickle_after_scoring(self):
+        """Models with a filled cache can be pickled; the cache is not"""
+        events, hmm = _events_and_hmm()
+        logprob = hmm.score(events)
+        assert len(hmm._emission_cache) > 0
+
+        unpickled = pickle.loads(pickle.dumps(hmm))
+        assert len(unpickled._emission_cache) == 0
+        assert np.allclose(unpickled.score(events), logprob)
+
+    def test_deepcopy_shares_cache(self):
+        """Deep copies share the cache instead of copying its arrays"""
+        events, hmm = _events_and_hmm()
+        hmm.score(events)
+        hmm_copy = copy.deepcopy(hmm)
+        assert hmm_copy._emission_cache is hmm._emission_cache
+        assert hmm_copy.means_ is not hmm.means_
+        assert np.allclose(hmm_copy.score(events), hmm.score(events))
+
+class TestModelSelection:
+
+    def test_epoch_windows(self):
+        """Windows of a subset of epochs match those of the sliced bst"""
+        events, hmm = _events_and_hmm()
+        data = np.atleast_2d(events.data)
+        lengths = np.asarray(events.lengths)
+        for w in (1, 3):
+            windows, window_lengths = _epoch_windows(data, lengths, [1, 4, 7], w)
+            expected, expected_lengths = hmm._sliding_window_array(events[[1, 4, 7]], w=w)
+            assert np.array_equal(windows, expected)
+            assert np.array_equal(window_lengths, expected_lengths)
+
+    def test_serial_matches_pool(self):
+        """Fits in a process pool give the serial results, with the
+        documented shapes"""
+        events, _ = _events_and_hmm()
+        kwargs = dict(n_restarts=2, k=3, n_iter=5, random_state=0)
+        serial = model_selection(events, [2, 3], **kwargs)
+        pooled = model_selection(events, [2, 3], n_jobs=2, **kwargs)
+
+        assert serial.cv_logprob.shape == (2, 2, 3)
+        assert serial.cv_logprob_per_bin.shape == serial.seeds.shape == (2, 2)
+        assert serial.fit_times.shape == serial.n_iterations.shape == serial.converged.shape == (2, 2, 3)
+        assert serial.final_fit_times.shape == serial.best_restart.shape == (2,)
+        assert [model.n_components for model in serial.models] == [2, 3]
+        assert serial.best_n_components in (2, 3)
+        assert len(serial.folds) == 3
+
+        assert np.allclose(serial.cv_logprob, pooled.cv_logprob)
+        assert np.array_equal(serial.best_restart, pooled.best_restart)
+        assert np.array_equal(serial.seeds, pooled.seeds)
+        assert serial.best_n_components == pooled.best_n_components
+        for model, pooled_model in zip(serial.models, pooled.models):
+            assert np.allclose(model.means_, pooled_model.means_)
+
+    def test_number_of_folds(self):
+        """k must be between 2 and the number of epochs; 'loo' uses one
+        fold per epoch"""
+        events, _ = _events_and_hmm()
+        for k in (1, events.n_epochs + 1):
+            with pytest.raises(ValueError):
+                model_selection(events, 2, n_restarts=1, k=k, n_iter=2)
+
+        results = model_selection(events, 2, n_restarts=1, k='loo', n_iter=2, random_state=0)
+        assert results.cv_logprob.shape == (1, 1, events.n_epochs)
+        assert all(len(validation) == 1 for _, validation in results.folds)
+
+class TestExternalMapping:
+
+    def setup_method(self):
+        self.events, self.hmm = _events_and_hmm()
+        self.X = np.atleast_2d(self.events.data).T
+        self.lengths = np.asarray(self.events.lengths)
+        rng = np.random.RandomState(2)
+        self.ext = rng.randint(0, 5, size=len(self.X)).astype(float)
+        self.ext[rng.rand(len(self.X)) < 0.2] = np.nan
+
+    def _loop_fit_ext(self, ext_idx, n_extern):
+        """Per-bin accumulation of state posteriors into external bins"""
+        posteriors = self.hmm.predict_proba(self.X, lengths=self.lengths)
+        extern = np.zeros((self.hmm.n_components, n_extern))
+        for ii, posterior in enumerate(posteriors.T):
+            if not np.isnan(ext_idx[ii]):
+                extern[:, int(ext_idx[ii])] += posterior
+        return extern / extern.sum(axis=1, keepdims=True)
+
+    def test_fit_ext_feature_matrix(self):
+        """The sparse one-hot accumulation matches the per-bin loop, with
+        NaN ext values ignored"""
+        extern = self.hmm.fit_ext(self.X, self.ext, n_extern=5, lengths=self.lengths)
+        assert extern.shape == (self.hmm.n_components, 5)
+        assert np.allclose(extern, self._loop_fit_ext(self.ext, 5))
+        assert np.allclose(self.hmm.fit_ext(self.events, self.ext, n_extern=5), extern)
+
+    def test_fit_ext_rank_mapping(self):
+        """Without n_extern, the distinct ext values are used in sorted order"""
+        extern = self.hmm.fit_ext(self.X, 10*self.ext + 3, lengths=self.lengths)
+        assert np.allclose(extern, self._loop_fit_ext(self.ext, 5))
+
+    def test_fit_ext_2d(self):
+        """2D external correlates give (n_components, n_x, n_y) mappings"""
+        rng = np.random.RandomState(3)
+        ext = np.column_stack((rng.randint(0, 3, size=len(self.X)),
+                               rng.randint(0, 4, size=len(self.X)))).astype(float)
+        ext[::7, 1] = np.nan
+        extern = self.hmm.fit_ext(self.X, ext, n_extern=(3, 4), lengths=self.lengths)
+
+        flat_idx = np.where(np.isnan(ext).any(axis=1), np.nan, 4*ext[:, 0] + ext[:, 1])
+        assert extern.shape == (self.hmm.n_components, 3, 4)
+        assert np.allclose(extern.reshape(-1, 12), self._loop_fit_ext(flat_idx, 12))
+
+    def test_decode_ext_2d(self):
+        """2D mode and mean paths match the external posterior computed
+        bin by bin"""
+        n_x, n_y = 3, 4
+        extern = np.random.RandomState(4).dirichlet(np.ones(n_x*n_y), size=self.hmm.n_components)
+        self.hmm._extern_ = extern.reshape(-1, n_x, n_y)
+        ext_posteriors, bdries, mode_pth, mean_pth = self.hmm.decode_ext(self.X, lengths=self.lengths)
+
+        state_posteriors = self.hmm.predict_proba(self.X, lengths=self.lengths)
+        assert ext_posteriors.shape == (n_x, n_y, len(self.X))
+        assert np.array_equal(bdries, np.cumsum(self.lengths))
+        for tt, state_posterior in enumerate(state_posteriors.T):
+            posterior = np.zeros((n_x, n_y))
+            for state, probability in enumerate(state_posterior):
+                posterior += probability*self.hmm._extern_[state]
+            assert np.allclose(ext_posteriors[:, :, tt], posterior)
+            x, y = np.unravel_index(np.argmax(posterior), (n_x, n_y))
+            assert np.allclose(mode_pth[:, tt], [x/n_x, y/n_y])
+            assert np.allclose(mean_pth[:, tt], [np.dot(np.arange(n_x), posterior.sum(axis=1))/n_x,
+                                                 np.dot(np.arange(n_y), posterior.sum(axis=0))/n_y])
+
+        # the same results from the BinnedSpikeTrainArray:
+        for result, expected in zip(self.hmm.decode_ext(self.events), (ext_posteriors, bdries, mode_pth, mean_pth)):
+            assert np.allclose(result, expected)
@@ -0,0 +1,31 @@
+import copy
+import nelpy as nel
+import numpy as np
+
+from nelpy.analysis import spatial_information_shuffle
+
+class TestSpatialInformationShuffle:
+
+    def test_shuffles_match_shifted_tuningcurves(self):
+        """Shuffled spatial information equals that of a TuningCurve1D
+        built from circularly shifted counts"""
+        rng = np.random.RandomState(0)
+        duration = 200
+        spikes = np.sort(rng.uniform(0, duration, size=(3, 400)), axis=1)
+        st = nel.SpikeTrainArray(spikes.tolist(), support=nel.EpochArray([0, duration]), fs=1)
+        bst = st.bin(ds=0.1)
+        t = np.arange(0, duration, 0.05)
+        pos = nel.AnalogSignalArray([((np.sin(t/7) + 1)/2*0.98 + 0.01).tolist()],
+                                    timestamps=t.tolist(), fs=20)
+
+        results = spatial_information_shuffle(bst, pos, n_extern=20, sigma=0.05,
+                                              n_shuffles=10, batchsize=3,
+                                              random_state=0)
+        assert results.si_shuffled.shape == (10, 3)
+        assert np.all((results.si_pvalues > 0) & (results.si_pvalues <= 1))
+
+        shifted = copy.deepcopy(bst)
+        shifted._data = np.roll(bst.data, results.shifts[4], axis=1)
+        tc = nel.TuningCurve1D(bst=shifted, extern=pos, n_extern=20, sigma=0.05)
+        assert np.allclose(results.si_shuffled[4], tc.spatial_information())
+        assert np.allclose(results.sparsity_shuffled[4], tc.spatial_sparsity())
@@ -0,0 +1,186 @@
+import copy
+import nelpy as nel
+import numpy as np
+import pytest
+
+from scipy.special import logsumexp
+
+from nelpy.analysis import replay
+
+def _events_and_tuningcurve(n_units=8):
+    rng = np.random.RandomState(0)
+    starts = np.arange(0, 40, 4)
+    # the same number of spikes per unit in every event:
+    spikes = np.sort(np.hstack([rng.uniform(a, a + 0.5, size=(n_units, 6)) for a in starts]), axis=1)
+    st = nel.SpikeTrainArray(spikes.tolist(), support=nel.EpochArray([0, 40]), fs=1)
+    t = np.arange(0, 40, 0.05)
+    pos = nel.AnalogSignalArray([((np.sin(t) + 1)/2*0.98 + 0.01).tolist()],
+                                timestamps=t.tolist(), fs=20)
+    tc = nel.TuningCurve1D(bst=st.bin(ds=0.1), extern=pos, n_extern=12, sigma=0.1)
+    events = st[nel.EpochArray([[a, a + 0.5] for a in starts])].bin(ds=0.05)
+    return events, tc
+
+class TestUnitIdShuffle:
+
+    def test_scores(self):
+        """Unshuffled scores match trajectory_score_bst and linregress_bst,
+        and shuffles are reproducible"""
+        events, tc = _events_and_tuningcurve()
+        scores, r2values, scores_shuffled, r2values_shuffled = \
+            replay.trajectory_score_unit_id_shuffle(events, tc, w=1, n_shuffles=6,
+                                                    random_state=0, batchsize=4)
+
+        assert np.allclose(scores, replay.trajectory_score_bst(events, tc, w=1, n_shuffles=0),
+                           equal_nan=True)
+        assert np.allclose(r2values, replay.linregress_bst(events, tc)[2], equal_nan=True)
+        assert scores_shuffled.shape == r2values_shuffled.shape == (6, events.n_epochs)
+
+        again = replay.trajectory_score_unit_id_shuffle(events, tc, w=1, n_shuffles=6,
+                                                        random_state=0)
+        assert np.allclose(scores_shuffled, again[2], equal_nan=True)
+
+    def test_shuffles_match_permuted_tuningcurves(self):
+        """Every shuffle scores as re-decoding with the ratemap rows
+        (units) permuted"""
+        events, tc = _events_and_tuningcurve()
+        _, _, scores_shuffled, r2values_shuffled = \
+            replay.trajectory_score_unit_id_shuffle(events, tc, w=1, n_shuffles=4,
+                                                    random_state=0, batchsize=3)
+
+        # the permutations drawn by trajectory_score_unit_id_shuffle:
+        perms = np.argsort(np.random.RandomState(0).rand(4, tc.n_units), axis=1)
+        for perm, scores, r2values in zip(perms, scores_shuffled, r2values_shuffled):
+            tc_shuffled = copy.copy(tc)
+            tc_shuffled._ratemap = tc.ratemap[perm]
+            expected = replay.trajectory_score_bst(events, tc_shuffled, w=1, n_shuffles=0)
+            assert np.allclose(scores, expected, equal_nan=True)
+            assert np.allclose(r2values, replay.linregress_bst(events, tc_shuffled)[2],
+                               equal_nan=True)
+
+    def test_w_must_be_integer(self):
+        """A non-integer band width is rejected"""
+        events, tc = _events_and_tuningcurve()
+        with pytest.raises(ValueError):
+            replay.trajectory_score_unit_id_shuffle(events, tc, w=1.5, n_shuffles=1)
+
+class TestShuffleTransmat:
+
+    def test_batch(self):
+        """Batched shuffles permute the off-diagonal entries of every row"""
+        transmat = np.random.RandomState(0).dirichlet(np.ones(5), size=5)
+        shuffled = replay.shuffle_transmat(transmat, n_shuffles=20, random_state=0)
+
+        assert shuffled.shape == (20, 5, 5)
+        assert np.allclose(np.diagonal(shuffled, axis1=1, axis2=2), np.diag(transmat))
+        assert np.allclose(np.sort(shuffled, axis=-1), np.sort(transmat, axis=-1))
+        assert not np.allclose(shuffled[0], shuffled[1])
+        assert replay.shuffle_transmat(transmat).shape == (5, 5)
+
+class TestTransmatShuffleScoring:
+
+    def setup_method(self):
+        pytest.importorskip('hmmlearn')
+        from nelpy.hmmutils import PoissonHMM
+
+        self.events, _ = _events_and_tuningcurve(n_units=6)
+        rng = np.random.RandomState(1)
+        self.hmm = PoissonHMM(n_components=4)
+        self.hmm.means_ = rng.uniform(0.1, 2, size=(4, 6))
+        self.hmm.transmat_ = rng.dirichlet(np.ones(4), size=4)
+        self.hmm.startprob_ = rng.dirichlet(np.ones(4))
+        # the shuffles drawn with random_state=0:
+        self.transmats = replay.shuffle_transmat(self.hmm.transmat_, n_shuffles=5, random_state=0)
+
+    def _cumulative_logprob(self, transmat):
+        """Log likelihood of the first b bins of every event, with a
+        separate forward recursion per event"""
+        with np.errstate(divide='ignore'):
+            log_startprob = np.log(self.hmm.startprob_)
+            log_transmat = np.log(transmat)
+        cumulative = []
+        for event in self.events:
+            X, lengths = self.hmm._sliding_window_array(event)
+            framelogprob = self.hmm._compute_log_likelihood(X)
+            alpha = log_startprob + framelogprob[0]
+            cumulative.append(logsumexp(alpha))
+            for frame in framelogprob[1:]:
+                alpha = logsumexp(alpha[:, np.newaxis] + log_transmat, axis=0) + frame
+                cumulative.append(logsumexp(alpha))
+        return np.array(cumulative)
+
+    def test_transmat_shuffle(self):
+        """Batched (and pooled) scores match scoring each shuffled matrix"""
+        last_bins = np.cumsum(self.events.lengths) - 1
+        expected = np.array([self._cumulative_logprob(transmat)[last_bins]
+                             for transmat in self.transmats])
+
+        for n_jobs in (None, 2):
+            scores, shuffled = replay.score_hmm_transmat_shuffle(
+                self.events, self.hmm, n_shuffles=5, random_state=0,
+                batchsize=2, n_jobs=n_jobs)
+            assert np.allclose(scores, self._cumulative_logprob(self.hmm.transmat_)[last_bins])
+            assert np.allclose(shuffled, expected)
+
+    def test_time_resolved(self):
+        """Time-resolved scores match per-shuffle forward recursions"""
+        lengths = self.events.lengths
+        first_bins = np.insert(np.cumsum(lengths), 0, 0)[:-1]
+        position = np.arange(lengths.sum()) - np.repeat(first_bins, lengths) + 1
+
+        for normalize in (False, True):
+            Lraw = self._cumulative_logprob(self.hmm.transmat_)
+            Lshuffled = np.array([self._cumulative_logprob(transmat)
+                                  for transmat in self.transmats])
+            if normalize:
+                Lraw = Lraw / position
+                Lshuffled = Lshuffled / position
+            Lprev = np.insert(Lraw[:-1], 0, 0)
+            Lprev[first_bins] = 0
+
+            for n_jobs in (None, 2):
+                scores, shuffled = replay.score_hmm_time_resolved(
+                    self.events, self.hmm, n_shuffles=5, normalize=normalize,
+                    random_state=0, batchsize=2, n_jobs=n_jobs)
+                assert np.allclose(scores, Lraw - Lprev)
+                assert np.allclose(shuffled, Lshuffled - Lprev)
+
+    def test_n_shuffles_must_be_integer(self):
+        """A non-integer number of shuffles is rejected"""
+        for func in (replay.score_hmm_transmat_shuffle, replay.score_hmm_time_resolved):
+            with pytest.raises(ValueError):
+                func(self.events, self.hmm, n_shuffles=2.5)
+
+class TestSignificance:
+
+    def test_pvalues_and_percentiles(self):
+        """Ranks from one sort match direct counts and np.percentile"""
+        rng = np.random.RandomState(0)
+        shuffled = rng.randint(0, 10, size=(40, 200)).astype(float)
+        scores = rng.randint(0, 10, size=200).astype(float)
+        sig_idx, pvalues = replay.get_significant_events(scores, shuffled, q=90)
+
+        r = np.sum(shuffled >= scores, axis=0)
+        assert np.allclose(pvalues, (r + 1)/41)
+        assert np.array_equal(sig_idx, np.flatnonzero(scores > np.percentile(shuffled, 90, axis=0)))
+
+    def test_nan_shuffles(self):
+        """Columns with NaN shuffled scores are never significant, as with
+        np.percentile, and NaNs do not count towards the ranks"""
+        shuffled = np.tile(np.arange(20, dtype=float)[:, np.newaxis], (1, 5))
+        shuffled[3, [0, 2]] = np.nan
+        scores = np.array([30., 30., 30., 10., 10.])
+        sig_idx, pvalues = replay.get_significant_events(scores, shuffled, q=95)
+
+        with np.errstate(invalid='ignore'):
+            expected = np.flatnonzero(scores > np.percentile(shuffled, 95, axis=0))
+            r = np.sum(shuffled >= scores, axis=0)
+        assert np.array_equal(sig_idx, expected)
+        assert np.array_equal(sig_idx, [1])
+        assert np.allclose(pvalues, (r + 1)/21)
+
+    def test_consecutive_bins(self):
+        """Events are significant when their last bins form a long enough run"""
+        above = [[1, 1, 1, 0], [0, 1, 1, 1], [1, 1], [], [1, 1, 1, 1, 1], [1, 1, 1, 0, 1, 1]]
+        pvals = 1 - np.hstack([np.array(ev, dtype=float) for ev in above])
+        lengths = [len(ev) for ev in above]
+        assert np.array_equal(replay.three_consecutive_bins_above_q(pvals, lengths, q=50), [1, 4])
@@ -0,0 +1,59 @@
+import nelpy as nel
+import numpy as np
+
+from nelpy.analysis import detect_ripples
+from nelpy.utils import get_events_boundaries
+
+def _lfp_with_ripples(fs=1500, duration=10):
+    """Two channels of noise, with 200 Hz bursts at 2 s (channel 0),
+    5 s (channel 1) and 8 s (both channels)."""
+    rng = np.random.RandomState(0)
+    t = np.arange(0, duration, 1/fs)
+    data = rng.randn(2, len(t))
+    bursts = [(2.0, [0]), (5.0, [1]), (8.0, [0, 1])]
+    for center, channels in bursts:
+        window = np.exp(-(t - center)**2/(2*0.015**2))
+        data[channels] += 8*window*np.sin(2*np.pi*200*t)
+    lfp = nel.AnalogSignalArray(data.tolist(), timestamps=t.tolist(), fs=fs)
+    return lfp, [center for center, _ in bursts]
+
+class TestDetectRipples:
+
+    def test_detected_epochs(self):
+        """Every injected burst is detected once, around its center"""
+        lfp, centers = _lfp_with_ripples()
+        results = detect_ripples(lfp)
+
+        assert results.epochs.n_epochs == len(centers)
+        assert np.all(results.epochs.starts < centers)
+        assert np.all(results.epochs.stops > centers)
+        assert np.all(results.epochs.durations < 0.2)
+        assert np.allclose(results.peak_times, centers, atol=0.01)
+        assert [ep.n_epochs for ep in results.tetrode_epochs] == [2, 2]
+
+    def test_parallel(self):
+        """Tetrodes processed in a process pool give the serial result"""
+        lfp, _ = _lfp_with_ripples()
+        serial = detect_ripples(lfp)
+        pooled = detect_ripples(lfp, n_jobs=2)
+
+        assert np.array_equal(serial.epochs.time, pooled.epochs.time)
+        assert np.array_equal(serial.peak_times, pooled.peak_times)
+        assert np.array_equal(serial.peak_amplitudes, pooled.peak_amplitudes)
+        assert np.array_equal(serial.peak_tetrodes, pooled.peak_tetrodes)
+
+class TestGetEventsBoundaries:
+
+    def test_length_criteria(self):
+        """minThresholdLength, minLength and maxLength remove events"""
+        x = np.zeros(100)
+        x[8:14], x[10:12] = 1, 3   # too short above PrimaryThreshold
+        x[25:45], x[30:40] = 1, 3  # kept
+        x[50:90], x[60:70] = 1, 3  # too long above SecondaryThreshold
+        x[93:99], x[94:98] = 1, 3  # too short above SecondaryThreshold
+
+        bounds, maxes, events = get_events_boundaries(x, PrimaryThreshold=2,
+            SecondaryThreshold=0.5, minThresholdLength=3, minLength=10,
+            maxLength=25, ds=1)
+        assert np.array_equal(bounds, [[25, 44]])
+        assert np.array_equal(maxes, [3])
@@ -0,0 +1,33 @@
+import numpy as np
+
+from types import SimpleNamespace
+from nelpy import scoring
+
+class TestOrderScores:
+
+    def test_matches_transition_loop(self):
+        """Vectorized order scores match summing logP along each path"""
+        rng = np.random.RandomState(0)
+        transmat = rng.uniform(0.1, 1, size=(4, 4))
+        transmat /= transmat.sum(axis=1, keepdims=True)
+        hmm = SimpleNamespace(transmat_=transmat)
+        state_sequences = [[0, 1, 1, 3, 2], [2], [3, 3, 3, 0], [1, 0]]
+
+        for seq, scoreD, scoreND in zip(state_sequences,
+                                        scoring.scoreOrderD(hmm, state_sequences),
+                                        scoring.scoreOrderND(hmm, state_sequences)):
+            logp = sum(np.log(transmat[a, b]) for a, b in zip(seq[:-1], seq[1:]))
+            assert np.isclose(scoreD, logp - np.log(len(seq)))
+            pth = [s for ii, s in enumerate(seq) if ii == 0 or s != seq[ii-1]]
+            logp = sum(np.log(transmat[a, b]) for a, b in zip(pth[:-1], pth[1:]))
+            assert np.isclose(scoreND, logp - np.log(len(pth)))
+
+    def test_time_swap_permutes_within_sequences(self):
+        """Time-swap shuffles are permutations of each sequence"""
+        state_sequences = [[0, 1, 2, 3], [3, 3], [2, 0, 1]]
+        states, offsets = scoring._concatenate_sequences(state_sequences)
+        shuffled = scoring._time_swap_states(states, offsets, n_shuffles=20, random_state=0)
+
+        assert shuffled.shape == (20, 9)
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            assert np.all(np.sort(shuffled[:, start:stop], axis=1) == np.sort(states[start:stop]))
@@ -0,0 +1,28 @@
+import nelpy as nel
+import numpy as np
+from scipy import signal
+
+class TestSpectral:
+
+    def test_psd_welch(self):
+        """psd matches scipy.signal.welch for a single epoch"""
+        data = np.random.RandomState(0).randn(2, 5000)
+        freqs, expected = signal.welch(data, fs=1000)
+        out = nel.spectral.psd(data, fs=1000, chunksize=7)
+        assert np.allclose(out.freqs, freqs)
+        assert np.allclose(out.power, expected)
+
+    def test_spectrogram(self):
+        """spectrogram matches scipy.signal.spectrogram for a single epoch"""
+        data = np.random.RandomState(0).randn(2, 5000)
+        freqs, time, expected = signal.spectrogram(data, fs=1000, window='hann',
+                                                   nperseg=256, noverlap=128)
+        out = nel.spectral.spectrogram(data, fs=1000, dtype=float)
+        assert np.allclose(out.time, time)
+        assert np.allclose(out.power, expected)
+
+    def test_psd_multitaper(self):
+        """Multitaper psd of white noise is flat at 2*var/fs"""
+        data = np.random.RandomState(0).randn(1, 50000)
+        out = nel.spectral.psd(data, fs=1000, NW=3)
+        assert np.isclose(out.power[0,1:-1].mean(), 2/1000, rtol=0.05)
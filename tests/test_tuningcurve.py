@@ -0,0 +1,114 @@
+import nelpy as nel
+import numpy as np
+
+from nelpy.auxiliary._tuningcurve import _interp_extern, _EXT_CACHE_SIZE
+from nelpy.decoding import decodeND
+
+def _bst_and_position(duration=200, n_units=3):
+    rng = np.random.RandomState(0)
+    spikes = np.sort(rng.uniform(0, duration, size=(n_units, 400)), axis=1)
+    st = nel.SpikeTrainArray(spikes.tolist(), support=nel.EpochArray([0, duration]), fs=1)
+    bst = st.bin(ds=0.1)
+    t = np.arange(0, duration, 0.05)
+    x = (np.sin(t/7) + 1)/2*0.98 + 0.01
+    y = (np.cos(t/5) + 1)/2*0.98 + 0.01
+    pos1 = nel.AnalogSignalArray([x.tolist()], timestamps=t.tolist(), fs=20)
+    pos2 = nel.AnalogSignalArray([x.tolist(), y.tolist()], timestamps=t.tolist(), fs=20)
+    return bst, pos1, pos2
+
+class TestTuningCurveAccumulator:
+
+    def test_batches_match_tuningcurve1d(self):
+        """Accumulating batches gives the same TuningCurve1D as all data at once"""
+        bst, pos, _ = _bst_and_position()
+        tc = nel.TuningCurve1D(bst=bst, extern=pos, n_extern=20, sigma=0.05)
+
+        ext = pos.asarray(at=bst.bin_centers).yvals
+        acc = nel.TuningCurveAccumulator(n_extern=20, sigma=0.05)
+        for start in range(0, bst.n_bins, 333):
+            acc.update(counts=bst.data[:,start:start+333],
+                       ext=ext[start:start+333], ds=bst.ds)
+        snapshot = acc.snapshot()
+
+        assert acc.n_samples == bst.n_bins
+        assert np.array_equal(snapshot.occupancy, tc.occupancy)
+        assert np.allclose(snapshot.ratemap, tc.ratemap)
+
+    def test_batches_match_tuningcurve2d(self):
+        """Accumulating batches gives the same TuningCurve2D as all data at once"""
+        bst, _, pos = _bst_and_position()
+        tc = nel.TuningCurve2D(bst=bst, extern=pos, ext_nx=8, ext_ny=6)
+
+        acc = nel.TuningCurveAccumulator(ext_nx=8, ext_ny=6)
+        acc.update(bst, pos)
+        snapshot = acc.snapshot()
+
+        assert np.array_equal(snapshot.occupancy, tc.occupancy)
+        assert np.allclose(snapshot.ratemap, tc.ratemap)
+
+class TestTuningCurveND:
+
+    def test_matches_tuningcurve2d_on_occupied_bins(self):
+        """TuningCurveND stores the TuningCurve2D rates of occupied bins"""
+        bst, _, pos = _bst_and_position()
+        tc2d = nel.TuningCurve2D(bst=bst, extern=pos, ext_nx=8, ext_ny=6)
+        tcnd = nel.TuningCurveND(bst=bst, extern=pos, n_extern=(8, 6))
+
+        occupied = tc2d.occupancy > 0
+        assert tcnd.n_occupied == occupied.sum()
+        assert np.allclose(tcnd.to_dense()[:, occupied], tc2d.ratemap[:, occupied])
+
+    def test_decode(self):
+        """decodeND returns normalized posteriors over the occupied bins"""
+        bst, _, pos = _bst_and_position()
+        tcnd = nel.TuningCurveND(bst=bst, extern=pos, n_extern=(8, 6), sigma=0.1)
+        posterior, _, mode_pth, mean_pth = decodeND(bst, tcnd)
+
+        assert posterior.shape == (tcnd.n_occupied, bst.n_bins)
+        assert mode_pth.shape == mean_pth.shape == (2, bst.n_bins)
+        nonempty = bst.data.sum(axis=0) > 0
+        assert np.allclose(posterior[:, nonempty].sum(axis=0), 1)
+
+class TestInterpExtern:
+
+    def setup_method(self):
+        _, self.pos, _ = _bst_and_position(duration=20)
+        self.at = np.arange(1, 19, 0.1)
+        self.calls = []
+
+    def _transform(self, extern, at):
+        self.calls.append(at)
+        return extern.asarray(at=at).yvals
+
+    def test_hit_and_miss(self):
+        """Entries are re-used at the same times, and recomputed at others"""
+        cache = {}
+        first = _interp_extern(self._transform, self.pos, self.at, cache)
+        again = _interp_extern(self._transform, self.pos, self.at.copy(), cache)
+        assert len(self.calls) == 1
+        assert again is first
+
+        # a subset is recomputed, since self._transform may not be pointwise:
+        subset = _interp_extern(self._transform, self.pos, self.at[::3], cache)
+        assert len(self.calls) == 2
+        assert np.allclose(subset, first[..., ::3])
+
+    def test_superset_reuse(self):
+        """The default transform re-uses entries at a superset of times"""
+        tc = nel.TuningCurve1D(bst=_bst_and_position(duration=20)[0], extern=self.pos, n_extern=10)
+        cache = {}
+        full = _interp_extern(tc._trans_func, self.pos, self.at, cache)
+        subset = _interp_extern(tc._trans_func, self.pos, self.at[::3], cache)
+
+        assert len(next(iter(cache.values()))) == 1
+        assert np.allclose(subset, full[..., ::3])
+        assert np.allclose(subset, tc._trans_func(self.pos, at=self.at[::3]))
+
+    def test_eviction(self):
+        """Least recently used entries are evicted"""
+        cache = {}
+        for start in range(_EXT_CACHE_SIZE + 3):
+            _interp_extern(self._transform, self.pos, self.at + start*0.01, cache)
+        entries = next(iter(cache.values()))
+        assert len(entries) == _EXT_CACHE_SIZE
+        assert np.array_equal(entries[-1][1], self.at + (_EXT_CACHE_SIZE + 2)*0.01)
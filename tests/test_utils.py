@@ -1,4 +1,5 @@
 from nelpy.utils import *
+import numpy as np
 
 class TestUtils:
 
@@ -25,4 +26,53 @@ class TestUtils:
     def test_linear_merge5(self):
         """Merge two empty lists"""
         merged = linear_merge([],[])
-        assert list(merged) == []
\ No newline at end of file
+        assert list(merged) == []
+
+class TestStreamingEventDetector:
+
+    def test_events_across_chunks(self):
+        """Events spanning chunk boundaries are stitched together"""
+        x = np.zeros(100)
+        x[10:20] = 1; x[14] = 5       # qualifying event
+        x[30:35] = 1                  # never reaches PrimaryThreshold
+        x[48:60] = 1; x[52:55] = 5    # qualifying event
+        x[90:100] = 1; x[95] = 5      # still in progress at the end
+        detector = StreamingEventDetector(fs=1, PrimaryThreshold=3,
+                                          SecondaryThreshold=0.5)
+        for chunk in np.array_split(x, 9):
+            detector.update(chunk)
+        assert np.all(detector.bounds == [[10, 19], [48, 59]])
+        detector.finalize()
+        assert np.all(detector.bounds == [[10, 19], [48, 59], [90, 99]])
+        assert np.allclose(detector.maxes, [5, 5, 5])
+
+    def test_chunksize_invariance(self):
+        """Detected events do not depend on the chunk size"""
+        x = np.convolve(np.random.RandomState(0).randn(20000), np.ones(20), 'same')
+        kwargs = {'fs' : 1000, 'PrimaryThreshold' : 10, 'SecondaryThreshold' : 2,
+                  'minLength' : 0.01, 'maxLength' : 0.05}
+        reference = StreamingEventDetector(**kwargs)
+        list(reference.process(x, chunksize=len(x)))
+        for chunksize in [13, 500]:
+            detector = StreamingEventDetector(**kwargs)
+            list(detector.process(x, chunksize=chunksize))
+            assert np.all(detector.bounds == reference.bounds)
+
+
+class TestSignalEnvelope:
+
+    def test_envelope_multichannel(self):
+        """Envelope of sinusoids with different amplitudes"""
+        t = np.arange(2000)/1000
+        data = np.vstack((np.sin(2*np.pi*50*t), 3*np.sin(2*np.pi*50*t)))
+        envelope = signal_envelope(data, fs=1000, sigma=0)
+        assert envelope.dtype == np.float32
+        assert np.allclose(envelope[:,200:-200], [[1], [3]], atol=1e-2)
+
+    def test_envelope_chunked(self):
+        """Chunked envelope of a narrowband signal matches the unchunked one"""
+        t = np.arange(10000)/1000
+        data = (1 + 0.5*np.sin(2*np.pi*0.5*t))*np.sin(2*np.pi*50*t)
+        envelope = signal_envelope(data, fs=1000)
+        chunked = signal_envelope(data, fs=1000, chunksize=1500, overlap=500)
+        assert np.allclose(envelope[500:-500], chunked[500:-500], atol=1e-2)